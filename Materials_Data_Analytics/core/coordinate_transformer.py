@@ -2,15 +2,143 @@ import numpy as np
 import pandas as pd
 
 
+def _as_frames(frames: np.ndarray, reference: np.ndarray, weights: np.ndarray = None) -> tuple:
+    """
+    function to check the shapes of a set of frames and a reference, and to normalise the weights
+    :param frames: array of coordinates with shape (atoms, 3) or (frames, atoms, 3)
+    :param reference: array of reference coordinates with shape (atoms, 3)
+    :param weights: array of weights for each atom, or None for equal weights
+    :return: the frames with shape (frames, atoms, 3), the reference, the normalised weights, and whether a single frame
+    was given
+    """
+    frames = np.asarray(frames, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    single = frames.ndim == 2
+    frames = frames[None] if single else frames
+
+    if frames.ndim != 3 or frames.shape[2] != 3 or reference.shape != frames.shape[1:]:
+        raise ValueError("The frames must have shape (frames, atoms, 3) and the reference must have shape (atoms, 3)")
+
+    weights = np.ones(reference.shape[0]) if weights is None else np.asarray(weights, dtype=float)
+    if weights.shape != (reference.shape[0],) or np.any(weights < 0) or weights.sum() == 0:
+        raise ValueError("There must be a non-negative weight for each atom")
+
+    return frames, reference, weights / weights.sum(), single
+
+
+def kabsch(frames: np.ndarray, reference: np.ndarray, weights: np.ndarray = None, method: str = 'quaternion') -> tuple:
+    """
+    function to find the rotations and translations which best fit each frame onto a reference, minimising the weighted
+    root mean squared deviation. The rotations are always proper rotations, with no reflections.
+    :param frames: array of coordinates with shape (atoms, 3) or (frames, atoms, 3)
+    :param reference: array of reference coordinates with shape (atoms, 3)
+    :param weights: array of weights for each atom, for example the masses, or None for equal weights
+    :param method: 'quaternion' to use the eigenvector of Horn's quaternion matrix, or 'svd' to use a singular value
+    decomposition with a correction for the sign of the determinant
+    :return: rotation matrices with shape (frames, 3, 3), the centroids of the frames with shape (frames, 3) and the
+    centroid of the reference. A single frame is treated as a trajectory of one frame. A fitted frame is (frame - frame centroid) @ rotation.T + reference centroid
+    """
+    frames, reference, weights, single = _as_frames(frames, reference, weights)
+
+    centroid_frames = np.einsum('n,fni->fi', weights, frames)
+    centroid_reference = weights @ reference
+    h = np.einsum('n,fni,nj->fij', weights, frames - centroid_frames[:, None, :], reference - centroid_reference)
+
+    if method == 'svd':
+        u, s, vh = np.linalg.svd(h)
+        d = np.sign(np.linalg.det(np.matmul(np.swapaxes(vh, 1, 2), np.swapaxes(u, 1, 2))))
+        correction = np.broadcast_to(np.eye(3), h.shape).copy()
+        correction[:, 2, 2] = d
+        r = np.matmul(np.swapaxes(vh, 1, 2), np.matmul(correction, np.swapaxes(u, 1, 2)))
+    elif method == 'quaternion':
+        r = _quaternion_to_matrix(_get_fit_quaternion(h))
+    else:
+        raise ValueError("The method must be either quaternion or svd")
+
+    return r, centroid_frames, centroid_reference
+
+
+def _get_fit_quaternion(h: np.ndarray) -> np.ndarray:
+    """
+    function to get the unit quaternions of the best fit rotations from the covariance matrices of the frames, as the
+    eigenvectors with the largest eigenvalues of Horn's symmetric 4x4 matrices
+    :param h: covariance matrices with shape (frames, 3, 3)
+    :return: quaternions (w, x, y, z) with shape (frames, 4)
+    """
+    sxx, sxy, sxz = h[:, 0, 0], h[:, 0, 1], h[:, 0, 2]
+    syx, syy, syz = h[:, 1, 0], h[:, 1, 1], h[:, 1, 2]
+    szx, szy, szz = h[:, 2, 0], h[:, 2, 1], h[:, 2, 2]
+
+    n = np.stack([
+        np.stack([sxx + syy + szz, syz - szy, szx - sxz, sxy - syx], axis=-1),
+        np.stack([syz - szy, sxx - syy - szz, sxy + syx, szx + sxz], axis=-1),
+        np.stack([szx - sxz, sxy + syx, -sxx + syy - szz, syz + szy], axis=-1),
+        np.stack([sxy - syx, szx + sxz, syz + szy, -sxx - syy + szz], axis=-1)
+    ], axis=-2)
+
+    eigenvalues, eigenvectors = np.linalg.eigh(n)
+    return eigenvectors[:, :, -1]
+
+
+def _quaternion_to_matrix(q: np.ndarray) -> np.ndarray:
+    """
+    function to convert unit quaternions to rotation matrices
+    :param q: quaternions (w, x, y, z) with shape (frames, 4)
+    :return: rotation matrices with shape (frames, 3, 3)
+    """
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    return np.stack([
+        np.stack([w*w + x*x - y*y - z*z, 2*(x*y - w*z), 2*(x*z + w*y)], axis=-1),
+        np.stack([2*(x*y + w*z), w*w - x*x + y*y - z*z, 2*(y*z - w*x)], axis=-1),
+        np.stack([2*(x*z - w*y), 2*(y*z + w*x), w*w - x*x - y*y + z*z], axis=-1)
+    ], axis=-2)
+
+
+def align(frames: np.ndarray, reference: np.ndarray, weights: np.ndarray = None, method: str = 'quaternion') -> np.ndarray:
+    """
+    function to rotate and translate each frame to best fit a reference
+    :param frames: array of coordinates with shape (atoms, 3) or (frames, atoms, 3)
+    :param reference: array of reference coordinates with shape (atoms, 3)
+    :param weights: array of weights for each atom, for example the masses, or None for equal weights
+    :param method: either 'quaternion' or 'svd'
+    :return: the aligned frames, with the same shape as the frames
+    """
+    r, centroid_frames, centroid_reference = kabsch(frames, reference, weights=weights, method=method)
+    frames = np.asarray(frames, dtype=float)
+    single = frames.ndim == 2
+    frames = frames[None] if single else frames
+    aligned = np.matmul(frames - centroid_frames[:, None, :], np.swapaxes(r, 1, 2)) + centroid_reference
+    return aligned[0] if single else aligned
+
+
+def rmsd(frames: np.ndarray, reference: np.ndarray, weights: np.ndarray = None, superposition: bool = True) -> np.ndarray | float:
+    """
+    function to get the root mean squared deviation of each frame from a reference
+    :param frames: array of coordinates with shape (atoms, 3) or (frames, atoms, 3)
+    :param reference: array of reference coordinates with shape (atoms, 3)
+    :param weights: array of weights for each atom, for example the masses, or None for equal weights
+    :param superposition: whether to align each frame to the reference before calculating the deviation
+    :return: array of the deviation of each frame, or a float if a single frame is given
+    """
+    frames, reference, weights, single = _as_frames(frames, reference, weights)
+    if superposition is True:
+        frames = align(frames, reference, weights=weights)
+    deviation = np.sqrt(np.einsum('n,fn->f', weights, ((frames - reference) ** 2).sum(axis=2)))
+    return float(deviation[0]) if single else deviation
+
+
 class CoordinateTransformer:
 
-    def __init__(self, data: pd.DataFrame, x: str = 'x', y: str = 'y', z: str = 'z'):
+    def __init__(self, data: pd.DataFrame, x: str = 'x', y: str = 'y', z: str = 'z', frame_col: str = None):
         """
-        class to take coordinate data and perform transformations
+        class to take coordinate data and perform transformations. The coordinates are held as a (atoms, 3) array, or as
+        a (frames, atoms, 3) array if there is a column labelling the frames of a trajectory, so that each transformation
+        is a single matrix operation on all the atoms of all the frames
         :param data: pandas dataframe with the coordinates
         :param x: column name with the x coordinates
         :param y: column name with the y coordinates
         :param z: column name with the z coordinates
+        :param frame_col: column name with the frame of each atom, for transforming the frames of a trajectory together
         :return: self
         """
 
@@ -40,17 +168,58 @@ class CoordinateTransformer:
         self._x_name = x
         self._y_name = y
         self._z_name = z
-        self._n = range(0, len(data[x]))
+        self._frame_col = frame_col
         self._data = data
-        self._coordinates = [np.array([
-            [self._data[x].iloc[i]],
-            [self._data[y].iloc[i]],
-            [self._data[z].iloc[i]]]) for i in self._n]
+        coordinates = self._data[[x, y, z]].to_numpy(dtype=float)
+
+        if frame_col is None:
+            self._order = np.arange(len(data))
+            self._coordinates = coordinates
+        else:
+            if frame_col not in data.columns:
+                raise ValueError("Your frame column isn't in your coordinates")
+            frame_sizes = data.groupby(frame_col).size()
+            if frame_sizes.nunique() != 1:
+                raise ValueError("All the frames must have the same number of atoms")
+            self._order = np.argsort(data[frame_col].to_numpy(), kind='stable')
+            self._coordinates = coordinates[self._order].reshape(len(frame_sizes), frame_sizes.iloc[0], 3)
 
     @property
     def data(self):
         return self._data
 
+    @property
+    def coordinates(self) -> np.ndarray:
+        return self._coordinates
+
+    def _set_coordinates(self, coordinates: np.ndarray):
+        """
+        function to store new coordinates and write them back to the dataframe
+        :param coordinates: array of the new coordinates, with the same shape as the old ones
+        :return: self
+        """
+        self._coordinates = coordinates
+        values = np.empty((len(self._order), 3))
+        values[self._order] = coordinates.reshape(-1, 3)
+        self._data[self._x_name] = values[:, 0]
+        self._data[self._y_name] = values[:, 1]
+        self._data[self._z_name] = values[:, 2]
+        return self
+
+    def _get_reference(self, reference_data_frame: pd.DataFrame) -> np.ndarray:
+        """
+        function to check a reference data frame and get its coordinates
+        :param reference_data_frame: pandas dataframe with the reference coordinates for each atom
+        :return: array of the reference coordinates with shape (atoms, 3)
+        """
+        if self._coordinates.shape[-2] != reference_data_frame.shape[0]:
+            raise ValueError("The number of data points in the two dataframes must be equal")
+        
+        if self._x_name not in reference_data_frame.columns or self._y_name not in reference_data_frame.columns or self._z_name not in reference_data_frame.columns:
+            raise ValueError("The reference data frame must have the same column names for the coordinates as the data of the coordinate transformer")
+
+        return reference_data_frame[[self._x_name, self._y_name, self._z_name]].to_numpy(dtype=float)
+
     def rotate(self, theta_x: float = 0, theta_y: float = 0, theta_z: float = 0):
         """
         function to rotate coordinates
@@ -85,15 +254,8 @@ class CoordinateTransformer:
 
         r = np.matmul(rz, np.matmul(ry, rx))
 
-        # matrix multiply to get the new coordinates
-        new_coords = [np.matmul(r, self._coordinates[i]) for i in self._n]
-
-        # write out to self
-        self._data[self._x_name] = [c.flat[0] for c in new_coords]
-        self._data[self._y_name] = [c.flat[1] for c in new_coords]
-        self._data[self._z_name] = [c.flat[2] for c in new_coords]
-
-        return self
+        # matrix multiply all the coordinates at once and write out to self
+        return self._set_coordinates(np.matmul(self._coordinates, r.T))
     
     def translate(self, x: float = 0, y: float = 0, z: float = 0):
         """
@@ -103,65 +265,229 @@ class CoordinateTransformer:
         :param z: translation in the z direction
         :return:
         """
-        self._data[self._x_name] = self._data[self._x_name] + x
-        self._data[self._y_name] = self._data[self._y_name] + y
-        self._data[self._z_name] = self._data[self._z_name] + z
-
-        return self
+        return self._set_coordinates(self._coordinates + np.array([x, y, z]))
     
     def translation_fit(self, reference_data_frame: pd.DataFrame):
         """
-        Function to translate the data to the reference data frame to reduce the mean squared error between the two dataframe's coordinates
+        Function to translate the data to the reference data frame to reduce the mean squared error between the two dataframe's coordinates.
+        For a trajectory, each frame is translated to the reference.
         """
-        if self._data.shape[0] != reference_data_frame.shape[0]:
-            raise ValueError("The number of data points in the two dataframes must be equal")
-        
-        if self._x_name not in reference_data_frame.columns or self._y_name not in reference_data_frame.columns or self._z_name not in reference_data_frame.columns:
-            raise ValueError("The reference data frame must have the same column names for the coordinates as the data of the coordinate transformer")
-        
-        coords = self._data[[self._x_name, self._y_name, self._z_name]].values
-        reference = reference_data_frame[[self._x_name, self._y_name, self._z_name]].values
-        centroid_coords = np.mean(coords, axis=0)
+        reference = self._get_reference(reference_data_frame)
+        centroid_coords = np.mean(self._coordinates, axis=-2, keepdims=True)
         centroid_reference = np.mean(reference, axis=0)
-        translation_vector = centroid_reference - centroid_coords
-        self.translate(translation_vector[0], translation_vector[1], translation_vector[2])
-        return self
+        return self._set_coordinates(self._coordinates - centroid_coords + centroid_reference)
     
-    def rotation_fit(self, reference_data_frame: pd.DataFrame):
+    def rotation_fit(self, reference_data_frame: pd.DataFrame, weights: np.ndarray = None, method: str = 'quaternion'):
         """
-        Function to rotate the data to the reference data frame to reduce the mean squared error between the two dataframe's coordinates
+        Function to rotate the data to the reference data frame to reduce the mean squared error between the two dataframe's coordinates.
+        For a trajectory, every frame is fitted to the reference at once with a batched Kabsch algorithm.
+        :param reference_data_frame: pandas dataframe with the reference coordinates
+        :param weights: weights for each atom, or None for equal weights
+        :param method: either 'quaternion' or 'svd'
         """
-        if self._data.shape[0] != reference_data_frame.shape[0]:
-            raise ValueError("The number of data points in the two dataframes must be equal")
-        
-        if self._x_name not in reference_data_frame.columns or self._y_name not in reference_data_frame.columns or self._z_name not in reference_data_frame.columns:
-            raise ValueError("The reference data frame must have the same column names for the coordinates as the data of the coordinate transformer")
-        
-        coords = self._data[[self._x_name, self._y_name, self._z_name]].values
-        reference = reference_data_frame[[self._x_name, self._y_name, self._z_name]].values
-
-        centroid_coords = np.mean(coords, axis=0)
-        centroid_reference = np.mean(reference, axis=0)
+        reference = self._get_reference(reference_data_frame)
+        return self._set_coordinates(align(self._coordinates, reference, weights=weights, method=method))
 
-        coords_centered = coords - centroid_coords
-        reference_centered = reference - centroid_reference
+    def rmsd(self, reference_data_frame: pd.DataFrame, weights: np.ndarray = None, superposition: bool = True) -> np.ndarray | float:
+        """
+        Function to get the root mean squared deviation of the coordinates, or of each frame, from the reference data frame
+        :param reference_data_frame: pandas dataframe with the reference coordinates
+        :param weights: weights for each atom, or None for equal weights
+        :param superposition: whether to align the coordinates to the reference before calculating the deviation
+        """
+        reference = self._get_reference(reference_data_frame)
+        return rmsd(self._coordinates, reference, weights=weights, superposition=superposition)
+    
 
-        h = np.matmul(coords_centered.T, reference_centered)
-        u, s, vh = np.linalg.svd(h)
-        r = np.matmul(vh.T, u.T)
+class TrajectoryWriter:
+    """
+    Class to stream frames of coordinates to a trajectory file, keeping a single buffered file handle open for all the
+    frames. The file can be a pdb file, an xyz file or a binary dcd file.
+    """
+    _PDB_ATOM = "ATOM  %5d  %-2s  UNK     1    %8.3f%8.3f%8.3f  1.00  0.00          %-2s\n"
+    _XYZ_ATOM = "%-2s %15.8f %15.8f %15.8f\n"
 
-        theta_y = np.degrees(np.arcsin(-r[2, 0]))
-        if np.cos(theta_y) > 1e-6:
-            theta_x = np.degrees(np.arctan2(r[2, 1] / np.cos(theta_y), r[2, 2] / np.cos(theta_y)))
-            theta_z = np.degrees(np.arctan2(r[1, 0] / np.cos(theta_y), r[0, 0] / np.cos(theta_y)))
+    def __init__(self, filename: str, path: str = '.', file_format: str = None, x_col: str = 'x', y_col: str = 'y',
+                 z_col: str = 'z', element_col: str = 'element', cell_x: float = 1000.0, cell_y: float = 1000.0,
+                 cell_z: float = 1000.0, overwrite: bool = True):
+        """
+        :param filename: name of the file to write. The extension is added if it is missing
+        :param path: path to write the file
+        :param file_format: either 'pdb', 'xyz' or 'dcd'. If None, it is taken from the extension of the filename
+        :param x_col: column name with the x coordinates
+        :param y_col: column name with the y coordinates
+        :param z_col: column name with the z coordinates
+        :param element_col: column name with the element type
+        :param cell_x: x dimension of the simulation box
+        :param cell_y: y dimension of the simulation box
+        :param cell_z: z dimension of the simulation box
+        :param overwrite: boolean to overwrite the file if it exists or to append to a file if it exists. Dcd files are
+        always overwritten
+        """
+        if file_format is None:
+            file_format = filename.split('.')[-1] if '.' in filename else 'pdb'
+
+        if file_format not in ['pdb', 'xyz', 'dcd']:
+            raise ValueError("The file format must be either pdb, xyz or dcd")
+
+        if filename.endswith('.' + file_format):
+            filename = filename[:-len(file_format) - 1]
+
+        self._file_format = file_format
+        self._x_col = x_col
+        self._y_col = y_col
+        self._z_col = z_col
+        self._element_col = element_col
+        self._cell = (cell_x, cell_y, cell_z)
+        self._n_frames = 0
+        self._n_atoms = None
+
+        if file_format == 'dcd':
+            self._file = open(f"{path}/{filename}.{file_format}", 'wb')
         else:
-            theta_x = np.degrees(np.arctan2(r[1, 2], r[1, 1]))
-            theta_z = 0 
+            self._file = open(f"{path}/{filename}.{file_format}", 'w' if overwrite else 'a')
 
-        self.rotate(theta_x=theta_x, theta_y=theta_y, theta_z=theta_z).translate(centroid_reference[0], centroid_reference[1], centroid_reference[2])
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def n_frames(self) -> int:
+        return self._n_frames
 
+    def write_frame(self, data: pd.DataFrame, time: float = 0.0, model: int = None, step: int = None):
+        """
+        function to write a frame of coordinates to the file
+        :param data: pandas dataframe with the coordinates
+        :param time: time of the frame
+        :param model: model number of the frame, for pdb files. If None, the frames are numbered from 1
+        :param step: step number of the frame. If None, the frames are numbered from 1
+        :return: self
+        """
+        columns = [self._x_col, self._y_col, self._z_col]
+        if all(col in data.columns for col in columns + [self._element_col]) is False:
+            raise ValueError("Check your values of x_col, y_col, z_col, and element_col")
+
+        model = self._n_frames + 1 if model is None else model
+        step = self._n_frames + 1 if step is None else step
+        coordinates = data[columns].to_numpy(dtype=float)
+        elements = data[self._element_col].to_numpy()
+
+        if self._file_format == 'pdb':
+            self._file.write(self._format_pdb_frame(coordinates, elements, time, model, step, self._cell))
+        elif self._file_format == 'xyz':
+            self._file.write(self._format_xyz_frame(coordinates, elements, time, step))
+        else:
+            self._write_dcd_frame(coordinates)
+
+        self._n_frames += 1
         return self
-    
+
+    @staticmethod
+    def _format_pdb_frame(coordinates: np.ndarray, elements: np.ndarray, time: float, model: int, step: int,
+                          cell: tuple) -> str:
+        """
+        function to format a frame of a pdb file as a string, formatting all the atoms in a single operation
+        :param coordinates: array of the coordinates with shape (atoms, 3)
+        :param elements: array of the elements
+        :param time: time of the frame
+        :param model: model number of the frame
+        :param step: step number of the frame
+        :param cell: the dimensions of the simulation box
+        :return: the formatted frame
+        """
+        values = np.empty((len(coordinates), 6), dtype=object)
+        values[:, 0] = np.arange(1, len(coordinates) + 1).tolist()
+        values[:, 1] = elements
+        values[:, 2:5] = coordinates
+        values[:, 5] = elements
+
+        header = (f"REMARK    GENERATED BY PDBParser in Materials_Data_Analytics \n"
+                  f"TITLE     GENERATED BY PDBParser in Materials_Data_Analytics  t=   {time} step= {step} \n"
+                  f"REMARK    THIS IS A SIMULATION BOX\n"
+                  f"CRYST1  {cell[0]:>8.3f}  {cell[1]:>8.3f}  {cell[2]:>8.3f}  90.00  90.00  90.00 P 1           1\n"
+                  f"MODEL        {model}\n")
+
+        return header + (TrajectoryWriter._PDB_ATOM * len(coordinates)) % tuple(values.ravel().tolist()) + "TER\nENDMDL\n"
+
+    @staticmethod
+    def _format_xyz_frame(coordinates: np.ndarray, elements: np.ndarray, time: float, step: int) -> str:
+        """
+        function to format a frame of an xyz file as a string, formatting all the atoms in a single operation
+        :param coordinates: array of the coordinates with shape (atoms, 3)
+        :param elements: array of the elements
+        :param time: time of the frame
+        :param step: step number of the frame
+        :return: the formatted frame
+        """
+        values = np.empty((len(coordinates), 4), dtype=object)
+        values[:, 0] = elements
+        values[:, 1:] = coordinates
+        header = f"{len(coordinates)}\nGENERATED BY TrajectoryWriter in Materials_Data_Analytics t= {time} step= {step}\n"
+        return header + (TrajectoryWriter._XYZ_ATOM * len(coordinates)) % tuple(values.ravel().tolist())
+
+    def _write_dcd_frame(self, coordinates: np.ndarray):
+        """
+        function to write a frame to a CHARMM style dcd file, with the unit cell followed by the x, y and z coordinates
+        as fortran records of 32-bit floats. The header is written with the first frame.
+        :param coordinates: array of the coordinates with shape (atoms, 3)
+        :return: None
+        """
+        if self._n_atoms is None:
+            self._n_atoms = len(coordinates)
+            self._file.write(self._get_dcd_header(self._n_atoms))
+        elif len(coordinates) != self._n_atoms:
+            raise ValueError("All the frames of a dcd file must have the same number of atoms")
+
+        cell = np.array([self._cell[0], 90.0, self._cell[1], 90.0, 90.0, self._cell[2]], dtype='<f8')
+        record = np.array([cell.nbytes], dtype='<i4').tobytes()
+        self._file.write(record + cell.tobytes() + record)
+
+        record = np.array([4 * self._n_atoms], dtype='<i4').tobytes()
+        for column in np.ascontiguousarray(coordinates.T, dtype='<f4'):
+            self._file.write(record + column.tobytes() + record)
+
+        return None
+
+    @staticmethod
+    def _get_dcd_header(n_atoms: int) -> bytes:
+        """
+        function to get the header of a CHARMM style dcd file, with the number of frames left as 0 to be filled in when
+        the file is closed
+        :param n_atoms: number of atoms in each frame
+        :return: the header
+        """
+        control = np.zeros(20, dtype='<i4')
+        control[1] = 1
+        control[2] = 1
+        control[10] = 1
+        control[19] = 24
+        control[9] = np.array([1.0], dtype='<f4').view('<i4')[0]
+        title = 'REMARKS GENERATED BY TrajectoryWriter in Materials_Data_Analytics'.ljust(80).encode()
+
+        return (np.array([84], dtype='<i4').tobytes() + b'CORD' + control.tobytes() + np.array([84], dtype='<i4').tobytes()
+                + np.array([84, 1], dtype='<i4').tobytes() + title + np.array([84], dtype='<i4').tobytes()
+                + np.array([4, n_atoms, 4], dtype='<i4').tobytes())
+
+    def close(self):
+        """
+        function to close the file. For dcd files the number of frames is written into the header
+        :return: None
+        """
+        if self._file.closed:
+            return None
+
+        if self._file_format == 'dcd' and self._n_atoms is not None:
+            self._file.seek(8)
+            self._file.write(np.array([self._n_frames], dtype='<i4').tobytes())
+            self._file.seek(20)
+            self._file.write(np.array([self._n_frames], dtype='<i4').tobytes())
+
+        self._file.close()
+        return None
+
 
 class PdbParser:
     """
@@ -201,18 +527,10 @@ class PdbParser:
         if all(col in data.columns for col in [x_col, y_col, z_col, element_col]) is False:
             raise ValueError("Check your values of x_col, y_col, z_col, and element_col")
 
-        mode = 'w' if overwrite else 'a'
-
-        with open(f"{path}/{filename}.pdb", mode) as f:
-            f.write(f"REMARK    GENERATED BY PDBParser in Materials_Data_Analytics \n")
-            f.write(f"TITLE     GENERATED BY PDBParser in Materials_Data_Analytics  t=   {time} step= {step} \n")
-            f.write(f"REMARK    THIS IS A SIMULATION BOX\n")
-            f.write(f"CRYST1  {cell_x:>8.3f}  {cell_y:>8.3f}  {cell_z:>8.3f}  90.00  90.00  90.00 P 1           1\n")
-            f.write(f"MODEL        {model}\n")
-            for i in range(0, len(data)):
-                f.write(f"ATOM  {i+1:5}  {data[element_col].iloc[i]:<2}  UNK     1    {data[x_col].iloc[i]:>8.3f}{data[y_col].iloc[i]:>8.3f}{data[z_col].iloc[i]:>8.3f}  1.00  0.00          {data[element_col].iloc[i]:<2}\n")
-            f.write("TER\n")
-            f.write("ENDMDL\n")
+        with TrajectoryWriter(filename, path=path, file_format='pdb', x_col=x_col, y_col=y_col, z_col=z_col,
+                              element_col=element_col, cell_x=cell_x, cell_y=cell_y, cell_z=cell_z,
+                              overwrite=overwrite) as writer:
+            writer.write_frame(data, time=time, model=model, step=step)
 
         return None
 
@@ -251,24 +569,36 @@ class PdbParser:
         :param time_col: column name with the time data
         :return: None
         """
-        data = data.reset_index().sort_values(by=[time_col, 'index']).drop(columns=['index'])
+        PdbParser.pandas_to_trajectory(data, time_col, file_format='pdb', fit_t0=fit_t0, **kwargs)
+        return None
+
+    @staticmethod
+    def pandas_to_trajectory(data: pd.DataFrame, time_col: str, file_format: str = 'pdb', fit_t0 = False,
+                             filename: str = 'trajectory', path: str = '.', **kwargs):
+        """
+        Function to write a pandas dataframe to a pdb, xyz or dcd trajectory file, writing all the frames through a
+        single file handle
+        :param data: pandas dataframe with the coordinates
+        :param time_col: column name with the time data
+        :param file_format: either 'pdb', 'xyz' or 'dcd'
+        :param fit_t0: whether to rotate each frame to fit the first frame
+        :param filename: name of the file to write
+        :param path: path to write the file
+        :return: None
+        """
+        data = data.reset_index().sort_values(by=[time_col, 'index'], kind='stable').drop(columns=['index'])
         t_0 = data[time_col].iloc[0]
-        model_0 = 1
-        step_0 = 1
         data_0 = data.query(f"{time_col} == {t_0}")
 
-        if fit_t0 is False:
-            PdbParser._write_pdb(data_0, time=t_0, model=model_0, step=step_0, overwrite=True, **kwargs)
-            for name, group in data.query(f"{time_col} != {t_0}").groupby(time_col):
-                model_0 += 1
-                step_0 += 1
-                PdbParser._write_pdb(group, time=name, model=model_0, step=step_0, overwrite=False, **kwargs)
-        else:
-            PdbParser._write_pdb(data_0, time=t_0, model=model_0, step=step_0, overwrite=True, **kwargs)
-            for name, group in data.query(f"{time_col} != {t_0}").groupby(time_col):
-                model_0 += 1
-                step_0 += 1
-                group = CoordinateTransformer(group).rotation_fit(data_0).data
-                PdbParser._write_pdb(group, time=name, model=model_0, step=step_0, overwrite=False, **kwargs)
+        frames = data.query(f"{time_col} != {t_0}")
+
+        if fit_t0 is True and len(frames) > 0:
+            columns = {k: kwargs[k + '_col'] for k in ['x', 'y', 'z'] if k + '_col' in kwargs}
+            frames = CoordinateTransformer(frames, frame_col=time_col, **columns).rotation_fit(data_0).data
+
+        with TrajectoryWriter(filename, path=path, file_format=file_format, overwrite=True, **kwargs) as writer:
+            writer.write_frame(data_0, time=t_0)
+            for name, group in frames.groupby(time_col):
+                writer.write_frame(group, time=name)
         
         return None
@@ -63,6 +63,125 @@ class Measurement():
 
         return root
     
+    @staticmethod
+    def get_roots_linear_interpolation(x1: np.ndarray, x2: np.ndarray, y1: np.ndarray, y2: np.ndarray) -> np.ndarray:
+        """
+        Function to get the roots of many lines at once, each given by two points
+        :param x1: the x values of the first points
+        :param x2: the x values of the second points
+        :param y1: the y values of the first points
+        :param y2: the y values of the second points
+        :return: an array with the root of each line
+        """
+        slope = (y2 - y1) / (x2 - x1)
+        intercept = y1 - slope * x1
+        return -intercept / slope
+    
+    @staticmethod
+    def get_simpson_integrals(x: np.ndarray, y: np.ndarray, groups: np.ndarray) -> pd.Series:
+        """
+        Function to integrate y over x with Simpson's rule separately for each group of points, using the same
+        composite rule for irregular spacing as scipy.integrate.simpson. Groups with fewer than two points integrate to 0
+        :param x: the x values of the points
+        :param y: the y values of the points
+        :param groups: the group label of each point. Points keep their order within each group
+        :return: a series with the integral of each group, indexed by group label
+        """
+        order = np.argsort(np.asarray(groups), kind='stable')
+        x = np.asarray(x, dtype=float)[order]
+        y = np.asarray(y, dtype=float)[order]
+        labels, starts, counts = np.unique(np.asarray(groups)[order], return_index=True, return_counts=True)
+        codes = np.repeat(np.arange(len(labels)), counts)
+        position = np.arange(len(x)) - starts[codes]
+        n = counts[codes]
+        integrals = np.zeros(len(labels))
+
+        # composite simpson over pairs of intervals, leaving the last interval of even length groups for the correction
+        last = np.where(n % 2 == 0, n - 2, n - 1)
+        i = np.flatnonzero((position % 2 == 0) & (position + 2 <= last) & (n >= 3))
+        h0 = x[i+1] - x[i]
+        h1 = x[i+2] - x[i+1]
+        hsum = h0 + h1
+        hprod = h0 * h1
+        h0divh1 = np.divide(h0, h1, out=np.zeros_like(h0), where=h1 != 0)
+        terms = hsum / 6.0 * (y[i] * (2.0 - np.divide(1.0, h0divh1, out=np.zeros_like(h0divh1), where=h0divh1 != 0)) +
+                              y[i+1] * (hsum * np.divide(hsum, hprod, out=np.zeros_like(hsum), where=hprod != 0)) +
+                              y[i+2] * (2.0 - h0divh1))
+        integrals += np.bincount(codes[i], weights=terms, minlength=len(labels))
+
+        # correction for the last interval of even length groups
+        even = (counts % 2 == 0) & (counts >= 4)
+        j = (starts + counts - 1)[even]
+        h0 = x[j-1] - x[j-2]
+        h1 = x[j] - x[j-1]
+        alpha = np.divide(2 * h1 ** 2 + 3 * h0 * h1, 6 * (h1 + h0), out=np.zeros_like(h0), where=(h1 + h0) != 0)
+        beta = np.divide(h1 ** 2 + 3.0 * h0 * h1, 6 * h0, out=np.zeros_like(h0), where=h0 != 0)
+        eta = np.divide(h1 ** 3, 6 * h0 * (h0 + h1), out=np.zeros_like(h0), where=(h0 * (h0 + h1)) != 0)
+        integrals[even] += alpha * y[j] + beta * y[j-1] - eta * y[j-2]
+
+        # trapezoid for groups of two points
+        pair = counts == 2
+        j = (starts + counts - 1)[pair]
+        integrals[pair] += 0.5 * (x[j] - x[j-1]) * (y[j] + y[j-1])
+
+        return pd.Series(integrals, index=labels)
+    
+    @staticmethod
+    def get_lttb_indices(x: np.ndarray, y: np.ndarray, groups: np.ndarray, n: int) -> np.ndarray:
+        """
+        Function to pick the points which best keep the shape of each group of a curve, using the largest triangle 
+        three buckets algorithm. The buckets of all groups are processed together, so the cost is linear in the number of points
+        :param x: the x values of the points, sorted within each group
+        :param y: the y values of the points
+        :param groups: the group label of each point, with the points of each group contiguous
+        :param n: the number of points to keep per group. Groups with n points or fewer are kept whole
+        :return: the sorted positions of the kept points
+        """
+        if n < 3:
+            raise ValueError('At least 3 points per group are needed for largest triangle three buckets downsampling')
+
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        _, starts, counts = np.unique(np.asarray(groups), return_index=True, return_counts=True)
+        kept = [np.flatnonzero(np.repeat(counts <= n, counts))]
+
+        starts = starts[counts > n]
+        counts = counts[counts > n]
+        
+        # the first and last points are kept, and the rest are split into n - 2 buckets followed by the last point
+        every = (counts - 2) / (n - 2)
+        bucket_starts = np.floor(np.arange(n - 1)[None, :] * every[:, None]).astype(int) + 1
+        bucket_starts[:, -1] = counts - 1
+        bucket_ends = np.concatenate([bucket_starts[:, 1:], counts[:, None]], axis=1)
+        bucket_starts = bucket_starts + starts[:, None]
+        bucket_ends = bucket_ends + starts[:, None]
+
+        # the centroid of each bucket, from cumulative sums
+        x_sums = np.concatenate([[0], np.cumsum(x)])
+        y_sums = np.concatenate([[0], np.cumsum(y)])
+        x_means = (x_sums[bucket_ends] - x_sums[bucket_starts]) / (bucket_ends - bucket_starts)
+        y_means = (y_sums[bucket_ends] - y_sums[bucket_starts]) / (bucket_ends - bucket_starts)
+
+        selected = starts
+        kept += [starts, starts + counts - 1]
+        for b in range(n - 2):
+            lengths = bucket_ends[:, b] - bucket_starts[:, b]
+            offsets = np.cumsum(lengths) - lengths
+            points = np.repeat(bucket_starts[:, b] - offsets, lengths) + np.arange(lengths.sum())
+
+            # area of the triangle between the last selected point, each point in the bucket and the next bucket centroid
+            ax, ay = np.repeat(x[selected], lengths), np.repeat(y[selected], lengths)
+            cx, cy = np.repeat(x_means[:, b+1], lengths), np.repeat(y_means[:, b+1], lengths)
+            area = np.abs((ax - cx) * (y[points] - ay) - (ax - x[points]) * (cy - ay))
+
+            # pick the first point with the largest area in each bucket
+            is_max = np.flatnonzero(area == np.repeat(np.maximum.reduceat(area, offsets), lengths))
+            _, first = np.unique(np.repeat(np.arange(len(lengths)), lengths)[is_max], return_index=True)
+            selected = points[is_max[first]]
+            kept.append(selected)
+
+        return np.sort(np.concatenate(kept))
+    
     @staticmethod
     def get_root_cube_spline(x: pd.Series, y: pd.Series):
         """
@@ -151,6 +270,105 @@ class Measurement():
         return data
     
 
+    @staticmethod
+    def find_local_peaks_with_polynomial(data: pd.DataFrame, 
+                                         y_col: str, 
+                                         x_col: str, 
+                                         group_cols: list[str], 
+                                         window = 0.01, 
+                                         polynomial_order = 4) -> pd.DataFrame:
+        """
+        Function to find a local peak in every group of a data set at once, as find_local_peak_with_polynomial does for
+        one group with the initial guess at the maximum y value of the group.
+        1. Window each group around the x value of its maximum y value
+        2. Fit all the polynomials with one batched least squares solve on scaled Vandermonde matrices
+        3. Find the critical points of all the polynomials, directly for order 2 and from the eigenvalues of the 
+           companion matrices of the derivatives otherwise
+        4. Pick the critical point or window boundary with the largest y value in each group
+        :param data: The data frame with the x and y values
+        :param y_col: The column name of the y values
+        :param x_col: The column name of the x values
+        :param group_cols: The columns which define the groups to find a peak in
+        :param window: The x window around the initial guess to search for the peak
+        :param polynomial_order: The order of the polynomial to fit to the data
+        :return: a data frame with the windowed data, the fitted polynomials and the peak values of each group
+        """
+        if polynomial_order % 2 != 0:
+            raise ValueError('Polynomial order must be an even number')
+        
+        if data.groupby(group_cols).size().min() < polynomial_order * 2:
+            raise ValueError('Dataframe must have at least twice the polynomial order number of points. Increase the window size or decrease polynomial order')
+        
+        # order the rows by group, and window each group around the x value at its first maximum y value
+        codes = data.groupby(group_cols, sort=True).ngroup().to_numpy()
+        data = data.iloc[np.argsort(codes, kind='stable')]
+        codes = np.sort(codes, kind='stable')
+        x = data[x_col].to_numpy(dtype=float)
+        y = data[y_col].to_numpy(dtype=float)
+        _, starts = np.unique(codes, return_index=True)
+        is_max = np.flatnonzero(y == np.repeat(np.maximum.reduceat(y, starts), np.diff(np.append(starts, len(y)))))
+        initial_guess = x[is_max[np.unique(codes[is_max], return_index=True)[1]]][codes]
+
+        in_window = (x < initial_guess + window) & (x > initial_guess - window)
+        data, x, y, codes = data[in_window], x[in_window], y[in_window], codes[in_window]
+        groups, starts, counts = np.unique(codes, return_index=True, return_counts=True)
+        codes = np.repeat(np.arange(len(groups)), counts)
+
+        if counts.min() <= polynomial_order + 1:
+            raise ValueError('The polynomial fit failed. Increase the window size or decrease polynomial order')
+
+        # scale x to [-1, 1] in each window and fit all the polynomials with one batched QR solve
+        x_min = np.minimum.reduceat(x, starts)
+        x_max = np.maximum.reduceat(x, starts)
+        centre = (x_max + x_min) / 2
+        scale = np.where(x_max > x_min, (x_max - x_min) / 2, 1)
+        t = (x - centre[codes]) / scale[codes]
+        powers = np.arange(polynomial_order, -1, -1)
+
+        vandermonde = np.zeros((len(groups), counts.max(), polynomial_order + 1))
+        targets = np.zeros((len(groups), counts.max()))
+        position = np.arange(len(x)) - starts[codes]
+        vandermonde[codes, position] = t[:, None] ** powers
+        targets[codes, position] = y
+
+        q, r = np.linalg.qr(vandermonde)
+        diagonal = np.abs(np.diagonal(r, axis1=1, axis2=2))
+        if np.any(diagonal <= diagonal.max(axis=1, keepdims=True) * len(powers) * np.finfo(float).eps):
+            raise ValueError('The polynomial fit failed. Increase the window size or decrease polynomial order')
+        coefficients = np.linalg.solve(r, np.einsum('gnk,gn->gk', q, targets)[..., None])[..., 0]
+
+        # find the real critical points inside each window
+        derivative = coefficients[:, :-1] * powers[:-1]
+        if polynomial_order == 2:
+            critical_points = (-derivative[:, 1] / derivative[:, 0])[:, None].astype(complex)
+        else:
+            companion = np.zeros((len(groups), polynomial_order - 1, polynomial_order - 1))
+            companion[:, 0, :] = -derivative[:, 1:] / derivative[:, :1]
+            companion[:, np.arange(1, polynomial_order - 1), np.arange(polynomial_order - 2)] = 1
+            critical_points = np.linalg.eigvals(companion)
+
+        t_min = (x_min - centre) / scale
+        t_max = (x_max - centre) / scale
+        valid = (critical_points.imag == 0) & (critical_points.real >= t_min[:, None]) & (critical_points.real <= t_max[:, None])
+        candidates = np.concatenate([critical_points.real, t_min[:, None], t_max[:, None]], axis=1)
+        valid = np.concatenate([valid, np.ones((len(groups), 2), dtype=bool)], axis=1)
+
+        # evaluate the polynomials at the candidates and pick the largest
+        values = np.where(valid, (candidates[..., None] ** powers * coefficients[:, None, :]).sum(axis=2), -np.inf)
+        best = np.argmax(values, axis=1)
+
+        if np.any(best >= candidates.shape[1] - 2):
+            raise ValueError('The peak is at the edge of the window. Increase the window size or decrease polynomial order')
+
+        peak_t = candidates[np.arange(len(groups)), best]
+        peak_y = values[np.arange(len(groups)), best]
+
+        return (data
+                .assign(**{'fit_' + y_col: (t[:, None] ** powers * coefficients[codes]).sum(axis=1)})
+                .assign(**{y_col + '_peak': peak_y[codes]})
+                .assign(**{x_col + '_peak': (centre + scale * peak_t)[codes]})
+                )
+    
     @staticmethod
     def binary_search(x0:float,
                    y0:float,
@@ -507,22 +725,13 @@ class ElectrochemicalMeasurement(Measurement):
         else:
             direction = 'reduction'
 
-        # assign the direction to each point and determine its segment
-        direction_list = []
-        segment_list = []
-        segment = 0
-        for index, row in data.iterrows():
-            direction_list.append(direction)
-            segment_list.append(segment)
-            if index in positive_peaks:
-                direction = 'reduction'
-                segment += 1
-            if index in negative_peaks:
-                direction = 'oxidation'
-                segment += 1
-        
-        data['direction'] = direction_list
-        data['segment'] = segment_list
+        # mark each turning point with the direction the scan takes after it, then carry it forward so that
+        # every point takes the direction and segment count of the turning points strictly before it
+        turns = pd.Series(None, index=data.index, dtype=object)
+        turns.iloc[positive_peaks] = 'reduction'
+        turns.iloc[negative_peaks] = 'oxidation'
+        data['direction'] = turns.shift(1).ffill().fillna(direction)
+        data['segment'] = turns.notna().cumsum().shift(1, fill_value=0)
         data['cycle'] = ((data['segment']-1) // 2) + 1 
 
         return data
@@ -6,9 +6,12 @@ import numpy as np
 from typing import Union
 import plotly.express as px
 import plotly.graph_objects as go
-import scipy.integrate as integrate
 import base64
 import io
+import importlib.util
+import glob
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 
 class CyclicVoltammogram(ElectrochemicalMeasurement):
@@ -19,6 +22,9 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
     Nicholas Siemons
     Contributors:
     """
+    _BIOLOGIC_COLUMNS = {'Ewe/V': 'potential', '<I>/mA': 'current', 'time/s': 'time'}
+    _AFTERMATH_COLUMNS = {'Potential (V)': 'potential', 'Current (A)': 'current'}
+
     def __init__(self,  
                  potential: Union[list, pd.Series, np.array] = None,
                  current: Union[list, pd.Series, np.array] = None,
@@ -30,6 +36,7 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         super().__init__(electrolyte, metadata=metadata)
 
         self._data = pd.DataFrame()
+        self._peak_cache = (None, {})
 
         if len(potential) and len(current) and len(time) != 0:
             self._data = (pd
@@ -74,26 +81,24 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         """
         Function to find the time and voltage points where the current passes through 0
         """
-        raw_roots_indexes = (data
-                             .copy()
-                             .assign(sign_diff = lambda x: np.sign(x['current']).diff())
-                             .query('sign_diff != 0 and sign_diff.notna()')
-                             .index
-                             )
-        
-        for i in raw_roots_indexes:
-            data_interpolate = data.iloc[i-1:i+1]
-            time_root = self.get_root_linear_interpolation(data_interpolate['time'], data_interpolate['current'])
-            potential_root = self.get_root_linear_interpolation(data_interpolate['potential'], data_interpolate['current'])
-
-            new_row = (data_interpolate
-                       .query('index == index.min()')
-                       .assign(potential = potential_root)
-                       .assign(time = time_root)
-                       .assign(current = 0)
-                       )
+        data = data.reset_index(drop=True)
+        current = data['current'].to_numpy()
+        time = data['time'].to_numpy()
+        potential = data['potential'].to_numpy()
+
+        # the positions of the points directly after each sign change in the current
+        sign_diff = np.diff(np.sign(current))
+        after = np.flatnonzero((sign_diff != 0) & ~np.isnan(sign_diff)) + 1
+        before = after - 1
+
+        roots = (data
+                 .iloc[before]
+                 .assign(potential = self.get_roots_linear_interpolation(potential[before], potential[after], current[before], current[after]))
+                 .assign(time = self.get_roots_linear_interpolation(time[before], time[after], current[before], current[after]))
+                 .assign(current = 0)
+                 )
 
-            data = pd.concat([data, new_row], ignore_index=True) 
+        data = pd.concat([data, roots], ignore_index=True)
 
         return data.sort_values(by=['time']).reset_index(drop=True)
     
@@ -101,21 +106,22 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         """
         Function to double up data points at the end of the cycles so that each cycle is complete when filtered by direction
         """
-        for s in range(data['segment'].min()+1, data['segment'].max()+1):
-            prev_seg_num = s - 1
-            prev_time = data.query('segment == @prev_seg_num')['time'].iloc[-1]
-            prev_current = data.query('segment == @prev_seg_num')['current'].iloc[-1]
-            prev_potential = data.query('segment == @prev_seg_num')['potential'].iloc[-1]
+        # the last point of every segment and the first point(s) of every segment after the first
+        ends = (data
+                .sort_values(by=['time'], kind='stable')
+                .drop_duplicates(subset=['segment'], keep='last')
+                .set_index('segment')
+                )
+        starts = data[(data['time'] == data.groupby('segment')['time'].transform('min')) & (data['segment'] > data['segment'].min())]
 
-            new_row = (data
-                    .query('segment == @s')
-                    .query('time == time.min()')
-                    .assign(time = prev_time, current = prev_current, potential = prev_potential)
-                    )
-            
-            data = pd.concat([data, new_row], ignore_index=True).sort_values(by=['time'])
+        # copy the end of each previous segment onto the start of the next one
+        previous_ends = ends.reindex(starts['segment'] - 1)
+        new_rows = starts.assign(time = previous_ends['time'].to_numpy(),
+                                 current = previous_ends['current'].to_numpy(),
+                                 potential = previous_ends['potential'].to_numpy()
+                                 )
 
-        return data
+        return pd.concat([data, new_rows], ignore_index=True).sort_values(by=['time'], kind='stable')
     
     def _check_types(self, data) -> pd.DataFrame:
         """
@@ -133,19 +139,73 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
 
     @property
     def data(self) -> pd.DataFrame:
-        
-        data = self._data.copy()
-        metadata = self.metadata
+        return self._data.assign(**self.metadata)
+    
+    def data_with_metadata(self) -> pd.DataFrame:
+        """
+        Function to return the data with a column for each metadata item. The metadata is stored as scalars and only
+        broadcast here, as categorical columns so that each one costs a single byte per row
+        :return: a new dataframe with the data and the metadata columns
+        """
+        n = len(self._data)
+        columns = {}
 
-        for k in metadata.keys():
-            data[k] = self.metadata[k]
+        for k, v in self.metadata.items():
+            try:
+                columns[k] = pd.Categorical.from_codes(np.zeros(n, dtype=np.int8), categories=[v])
+            except (TypeError, ValueError):
+                columns[k] = [v] * n
 
-        return data
+        return self._data.assign(**columns)
     
     @property
     def steps_per_cycle(self) -> int:
         return self._data.query('segment == 0')['time'].count()
 
+    @staticmethod
+    def _read_columns(path, sep: str, columns: dict, dtype = np.float64, chunksize: int = None) -> pd.DataFrame:
+        """
+        Function to read only the given columns of a delimited text file, with an explicit dtype, renaming them to the
+        names used by the class
+        :param path: str or buffer, the file to read
+        :param sep: str, the column separator
+        :param columns: dict mapping the column names in the file to the names to return
+        :param dtype: the dtype to parse the columns as
+        :param chunksize: int, if given the file is streamed in chunks of this many rows, each of which is reduced to
+        the requested columns and dtype before the chunks are joined
+        :return: pd.DataFrame with only the requested columns
+        """
+        def reduce(chunk: pd.DataFrame) -> pd.DataFrame:
+            return chunk.filter(list(columns)).rename(columns, axis=1).astype(dtype, copy=False)
+
+        data = pd.read_table(path, sep=sep, usecols=list(columns), dtype={c: dtype for c in columns}, chunksize=chunksize)
+
+        if chunksize is not None:
+            return pd.concat((reduce(chunk) for chunk in data), ignore_index=True)
+
+        return reduce(data)
+    
+    @staticmethod
+    def _read_biologic_mpr(path: str, dtype = np.float64) -> pd.DataFrame:
+        """
+        Function to read the potential, current and time columns from a native biologic .mpr file
+        :param path: str, path to the .mpr file
+        :param dtype: the dtype to return the columns as
+        :return: pd.DataFrame with the biologic column names
+        """
+        if importlib.util.find_spec('galvani') is None:
+            raise ImportError('galvani is required to read .mpr files. Please install galvani using pip install galvani')
+        else:
+            from galvani import BioLogic
+
+        records = BioLogic.MPRfile(path).data
+        current_col = '<I>/mA' if '<I>/mA' in records.dtype.names else 'I/mA'
+
+        return pd.DataFrame({'Ewe/V': records['Ewe/V'].astype(dtype), 
+                             '<I>/mA': records[current_col].astype(dtype), 
+                             'time/s': records['time/s'].astype(dtype)
+                             })
+
     @classmethod
     def from_html_base64(cls, file_contents, source, scan_rate = None, **kwargs):
         """
@@ -156,10 +216,10 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         file_data = io.StringIO(decoded.decode('utf-8'))
 
         if source == 'biologic':
-            data = pd.read_table(file_data, sep='\t')
+            data = cls._read_columns(file_data, sep='\t', columns=cls._BIOLOGIC_COLUMNS)
             cv = cls.from_biologic(data=data, **kwargs)
         elif source == 'aftermath':
-            data = pd.read_table(file_data, sep=",")
+            data = cls._read_columns(file_data, sep=',', columns=cls._AFTERMATH_COLUMNS)
             cv = cls.from_aftermath(data=data, scan_rate=scan_rate, **kwargs)
         else:
             raise ValueError('The source must be either biologic or aftermath')
@@ -167,18 +227,24 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         return cv
 
     @classmethod
-    def from_biologic(cls, path: str = None, data: pd.DataFrame = None, **kwargs):
+    def from_biologic(cls, path: str = None, data: pd.DataFrame = None, dtype = np.float64, chunksize: int = None, **kwargs):
         """
         Function to make a CyclicVoltammogram object from a biologic file
+        :param path: str, path to the biologic .txt export or native .mpr file
+        :param data: pd.DataFrame, the data of the cyclic voltammogram
+        :param dtype: the dtype to read the potential, current and time columns as
+        :param chunksize: int, if given the text export is streamed in chunks of this many rows
         """
 
         if path is None and data is not None:
             data = data
+        elif path is not None and data is None and str(path).lower().endswith('.mpr'):
+            data = cls._read_biologic_mpr(path, dtype=dtype)
         elif path is not None and data is None:
-            data = pd.read_table(path, sep='\t')
+            data = cls._read_columns(path, sep='\t', columns=cls._BIOLOGIC_COLUMNS, dtype=dtype, chunksize=chunksize)
 
         data = (data
-                .rename({'Ewe/V': 'potential', '<I>/mA': 'current', 'time/s': 'time'}, axis=1)
+                .rename(cls._BIOLOGIC_COLUMNS, axis=1)
                 .filter(['potential', 'current', 'time'])
                 )
 
@@ -187,18 +253,20 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         return cv
     
     @classmethod
-    def from_aftermath(cls, path: str = None, scan_rate: float = None, data: pd.DataFrame = None, **kwargs):
+    def from_aftermath(cls, path: str = None, scan_rate: float = None, data: pd.DataFrame = None, dtype = np.float64, chunksize: int = None, **kwargs):
         """
         Function to make a CyclicVoltammogram object from an AfterMath file
         :param path: str, path to the AfterMath file
         :param scan_rate: float, the scan rate of the cyclic voltammogram in mV/s
         :param data: pd.DataFrame, the data of the cyclic voltammogram
+        :param dtype: the dtype to read the potential and current columns as
+        :param chunksize: int, if given the file is streamed in chunks of this many rows
         """
 
         if path is None and data is not None:
             data = data
         elif path is not None and data is None:
-            data = pd.read_table(path, sep=",")
+            data = cls._read_columns(path, sep=',', columns=cls._AFTERMATH_COLUMNS, dtype=dtype, chunksize=chunksize)
 
         if type(scan_rate) != float:
             scan_rate = float(scan_rate)
@@ -206,7 +274,7 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         scan_rate = scan_rate/1000
 
         data = (data
-                .rename({'Potential (V)': 'potential', 'Current (A)': 'current'}, axis=1)
+                .rename(cls._AFTERMATH_COLUMNS, axis=1)
                 .filter(['potential', 'current'])
                 .assign(current = lambda x: x['current']*1000)
                 .assign(dv = lambda x: x['potential'] - x['potential'].shift(1))
@@ -239,14 +307,20 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
 
         return self
     
+    def _get_cycle_direction(self) -> pd.Series:
+        """
+        Function to label each row of the data with its cycle and direction, to colour the plots by. The labels are
+        passed to plotly as a separate series so that the data is not copied to hold them
+        :return: pd.Series with a label for each row of the data
+        """
+        return self._data['cycle'].astype('str') + ', ' + self._data['direction']
+
     def get_current_potential_plot(self, **kwargs):
         """
         Function to plot the cyclic voltammogram
         """
-        data = self.data.assign(cycle_direction = lambda x: x['cycle'].astype('str') + ', ' + x['direction'])
-
-        figure = px.line(data, x='potential', y='current', color='cycle_direction', markers=True, 
-                         labels={'potential': 'Potential [V]', 'current': 'Current [mA]'}, **kwargs)
+        figure = px.line(self._data, x='potential', y='current', color=self._get_cycle_direction(), markers=True, 
+                         labels={'potential': 'Potential [V]', 'current': 'Current [mA]', 'color': 'cycle_direction'}, **kwargs)
         
         return figure
     
@@ -262,10 +336,8 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         """
         Function to plot the current vs time
         """
-        data = self.data.assign(cycle_direction = lambda x: x['cycle'].astype('str') + ', ' + x['direction'])
-
-        figure = px.line(data, x='time', y='current', color='cycle_direction', markers=True, 
-                         labels={'time': 'Time [s]', 'current': 'Current [mA]', 'cycle_direction': 'Cycle, Direction'}, **kwargs)
+        figure = px.line(self._data, x='time', y='current', color=self._get_cycle_direction(), markers=True, 
+                         labels={'time': 'Time [s]', 'current': 'Current [mA]', 'color': 'Cycle, Direction'}, **kwargs)
         
         return figure
     
@@ -281,10 +353,8 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         """
         Function to plot the potential vs time
         """
-        data = self.data.assign(cycle_direction = lambda x: x['cycle'].astype('str') + ', ' + x['direction'])
-        
-        figure = px.line(data, x='time', y='potential', color='cycle_direction', markers=True, 
-                         labels={'time': 'Time [s]', 'potential': 'Potential [V]'}, **kwargs)
+        figure = px.line(self._data, x='time', y='potential', color=self._get_cycle_direction(), markers=True, 
+                         labels={'time': 'Time [s]', 'potential': 'Potential [V]', 'color': 'cycle_direction'}, **kwargs)
         
         return figure
     
@@ -316,44 +386,27 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
     def max_cycle(self) -> int:
         return self._max_cycle
     
-    #TODO: I dont like this function, it should be more general
-    def _integrate_curves(self, data: pd.DataFrame, direction: str, valence: str) -> float:
-        """
-        Function to integrate data
-        """
-        if valence == 'positive':
-            current_data = data.query('current >= 0')
-        elif valence == 'negative':
-            current_data = data.query('current <= 0')
-        else:
-            raise ValueError('Valence must be either positive or negative')
-
-        int_current = current_data.query('direction == @direction')['current'].to_numpy()
-        int_time = current_data.query('direction == @direction')['time'].to_numpy()
-
-        if len(int_current) == 0 or len(int_current) == 1:
-            return 0
-        else:
-            integral = abs(integrate.simpson(int_current, x=int_time))
-
-        return integral
-
     def get_charge_passed(self, average_segments = False) -> pd.DataFrame:
         """
         Function to get the integrals of the current
         """ 
-        data = self._data.query('segment != 0 and segment != @self._max_segment').copy()
+        data = self._data.query('segment != 0 and segment != @self._max_segment')
+        in_direction = data['direction'] == data.groupby('segment')['direction'].transform('first')
+
+        # integrate the positive and negative currents of every segment in one pass each
+        anodic = data[in_direction & (data['current'] >= 0)]
+        cathodic = data[in_direction & (data['current'] <= 0)]
+        anodic_charges = self.get_simpson_integrals(anodic['time'], anodic['current'], anodic['segment']).abs()
+        cathodic_charges = self.get_simpson_integrals(cathodic['time'], cathodic['current'], cathodic['segment']).abs()
 
         integrals = (data
-                     .groupby(['segment'], group_keys=False)
-                     .apply(lambda df: (df
-                                        .assign(anodic_charge = lambda x: self._integrate_curves(x, direction=x['direction'].iloc[0], valence='positive'))
-                                        .assign(cathodic_charge = lambda x: self._integrate_curves(x, direction=x['direction'].iloc[0], valence='negative'))
-                                        ))
                      .drop(columns=['potential', 'time', 'current'])
                      .drop_duplicates()
+                     .sort_values(by=['segment'], kind='stable')
                      .reset_index(drop=True)
-                     .assign(valence = lambda x: [-1 if i == 'reduction' else 1 for i in x.direction])
+                     .assign(anodic_charge = lambda x: x['segment'].map(anodic_charges).fillna(0))
+                     .assign(cathodic_charge = lambda x: x['segment'].map(cathodic_charges).fillna(0))
+                     .assign(valence = lambda x: np.where(x['direction'] == 'reduction', -1, 1))
                      .assign(total_charge = lambda x: (x.anodic_charge - x.cathodic_charge)*x.valence)
                      .drop(columns=['valence'])
                      )
@@ -377,34 +430,31 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         """
         Function to get the maximum charges passed in each direction
         """ 
-        data = (self
-                ._data.query('segment != 0 and segment != @self._max_segment')
-                .copy()
-                .assign(section = lambda x: (x['current'] == 0).cumsum())
-                )
-        
-        additional_points = (data
-                             .assign(sos = lambda x: (x['current'] == 0))
-                             .query('sos == True')
-                             .assign(section = lambda x: x['section'] - 1)  
-                             .drop(columns=['sos'])
-                             )
+        data = self._data.query('segment != 0 and segment != @self._max_segment')
+
+        # a new section starts at each zero current point, which also closes the section before it
+        roots = (data['current'] == 0).to_numpy()
+        section = np.cumsum(roots)
+        section = np.concatenate([section, section[roots] - 1])
+        time = np.concatenate([data['time'].to_numpy(), data['time'].to_numpy()[roots]])
+        current = np.concatenate([data['current'].to_numpy(), data['current'].to_numpy()[roots]])
+
+        order = np.argsort(time, kind='stable')
+        time, current, section = time[order], current[order], section[order]
+        bounds = pd.Series(time).groupby(section).agg(['min', 'max'])
+
+        total_charges = self.get_simpson_integrals(time, current, section)
 
         max_charges_passed = (pd
-                              .concat([data, additional_points], axis=0)
-                              .sort_values(by=['time'])
-                              .reset_index(drop=True)
-                              .groupby(['section'], group_keys=False)
-                              .apply(lambda df: (df
-                                                  .assign(total_charge = integrate.simpson(df.current, x=df.time))
-                                                  .assign(t_min = df.time.min())
-                                                  .assign(t_max = df.time.max())
-                                                  .filter(['total_charge', 'section', 't_min', 't_max'])
-                                                  .drop_duplicates()
-                                                  ))
-                              .assign(type = lambda x: ['anodic_charge' if i > 0 else 'cathodic_charge' for i in x['total_charge']])
+                              .DataFrame({'total_charge': total_charges.to_numpy(), 
+                                          'section': total_charges.index, 
+                                          't_min': bounds['min'].to_numpy(), 
+                                          't_max': bounds['max'].to_numpy()
+                                          })
+                              .assign(type = lambda x: np.where(x['total_charge'] > 0, 'anodic_charge', 'cathodic_charge'))
                               .assign(total_charge = lambda x: x['total_charge'].abs())
                               .query('section != section.max() and section != section.min()')
+                              .reset_index(drop=True)
                               )
         
         if average_sections is True:
@@ -457,7 +507,7 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         """
         Function to return a plot showing the area integrated to get the maximum charges passed 
         """
-        data = self.data.assign(cycle_direction = lambda x: x['cycle'].astype('str') + ', ' + x['direction'])
+        data = self._data
         charge_data = self.get_maximum_charges_passed()
         charge_valence = charge_data.query('section == @section')['type'].iloc[0]
 
@@ -473,7 +523,7 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         c_plot_min = c_min - (c_max - c_min) * 0.1
         c_plot_max = c_max + (c_max - c_min) * 0.1
 
-        figure = px.line(data, x='time', y='current', color='cycle_direction', labels={'time': 'Time [s]', 'current': 'Current [mA]', 'cycle_direction': 'Cycle, Direction'}, **kwargs)
+        figure = px.line(data, x='time', y='current', color=self._get_cycle_direction(), labels={'time': 'Time [s]', 'current': 'Current [mA]', 'color': 'Cycle, Direction'}, **kwargs)
 
         if charge_valence == 'anodic_charge':
             figure.add_trace(go.Scatter(x=data_area['time'], y=data_area['current'], mode='lines', name='anodic charge', fill='tozeroy', fillcolor='#ADD8E6', line=dict(color='rgba(0, 0, 0, 0)')))
@@ -495,7 +545,7 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
 
         direction = direction.lower()
 
-        data = self.data.copy().assign(cycle_direction = lambda x: x['cycle'].astype('str') + ', ' + x['direction'])
+        data = self._data
         segment = data.query('cycle == @cycle and direction == @direction')['segment'].values[0]
         data_area = data.query('segment == @segment')
         data_area_positive = data_area.query('current >= 0')
@@ -510,8 +560,8 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
         c_min = c_min - (c_max - c_min) * 0.1
         c_max = c_max + (c_max - c_min) * 0.1
 
-        figure = px.line(data, x='time', y='current', color='cycle_direction', 
-                         labels={'time': 'Time [s]', 'current': 'Current [mA]', 'cycle_direction': 'Cycle, Direction'}, **kwargs)
+        figure = px.line(data, x='time', y='current', color=self._get_cycle_direction(), 
+                         labels={'time': 'Time [s]', 'current': 'Current [mA]', 'color': 'Cycle, Direction'}, **kwargs)
         
         figure.add_trace(go.Scatter(x=data_area_positive['time'], y=data_area_positive['current'], mode='lines', name='anodic charge', 
                                     fill='tozeroy', fillcolor='#ADD8E6', line=dict(color='rgba(0, 0, 0, 0)')))
@@ -524,64 +574,94 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
 
         return figure
 
-    def downsample(self, n: int | list[float] = 400) -> pd.DataFrame:
+    def downsample(self, n: int = 400, method: str = 'mean') -> pd.DataFrame:
         """
         Function to downsample the data
+        :param n: the number of points to keep per segment
+        :param method: either 'mean', to average the points in n time bins per segment, or 'lttb', to pick the n points 
+        per segment which best keep the shape of the current with the largest triangle three buckets algorithm
         """
-        # from a range and number of intervals, get the bin edges
-        def get_bins(df, n):
-            t_min = df['time'].min()
-            t_max = df['time'].max()
-            t_mids = np.linspace(t_min, t_max, n)
-            dt = (t_max - t_min) / n
-            bins = np.concatenate(([t_min - dt / 2], t_mids + dt / 2))
-            return bins
+        if method not in ['mean', 'lttb']:
+            raise ValueError('The method must be either mean or lttb')
 
         # get the original data and remove the additional segment points and current roots
-        data = (self
-                ._data
-                .query('current != 0')
-                .groupby(['segment'], group_keys=False)
-                .apply(lambda df: df.query('index != index.max()'))
-                )
+        data = self._data.query('current != 0')
+        data = data[data.index != data.index.to_series().groupby(data['segment']).transform('max')]
 
-        # downsample the data. Attention to use the .agg as it is much faster than .apply
-        down_sampled_data = (data
-                             .groupby(['cycle', 'direction', 'segment'], group_keys=False)
-                             .apply(lambda df: df.assign(time_bin = pd.cut(df['time'], bins=get_bins(df, n), labels=False)))
-                             .groupby(['cycle', 'direction', 'segment', 'time_bin'], group_keys=False)
-                             .agg(
-                                 potential = ('potential', 'mean'),
-                                 current = ('current', 'mean'),
-                                 time = ('time', 'mean')
+        if method == 'mean':
+            # n bins per segment, centred on n evenly spaced times between the first and last time of the segment
+            t_min = data.groupby('segment')['time'].transform('min').to_numpy()
+            t_max = data.groupby('segment')['time'].transform('max').to_numpy()
+            dt = (t_max - t_min) / n
+            spacing = (t_max - t_min) / max(n - 1, 1)
+            offset = data['time'].to_numpy() - t_min - dt / 2
+            time_bin = np.ceil(np.divide(offset, spacing, out=np.zeros_like(offset), where=spacing > 0)).clip(0, n - 1).astype(int)
+
+            # average the points in each bin of each segment
+            segment_codes, segments = pd.factorize(data['segment'], sort=True)
+            bins = segment_codes * n + time_bin
+            counts = np.bincount(bins, minlength=len(segments) * n)
+            filled = np.flatnonzero(counts)
+            labels = data.drop_duplicates(subset=['segment']).set_index('segment').loc[segments[filled // n]]
+
+            down_sampled_data = pd.DataFrame({
+                'cycle': labels['cycle'].to_numpy(),
+                'direction': labels['direction'].to_numpy(),
+                'segment': labels.index.to_numpy(),
+                'potential': np.bincount(bins, weights=data['potential'], minlength=len(counts))[filled] / counts[filled],
+                'current': np.bincount(bins, weights=data['current'], minlength=len(counts))[filled] / counts[filled],
+                'time': np.bincount(bins, weights=data['time'], minlength=len(counts))[filled] / counts[filled]
+                })
+        else:
+            data = data.sort_values(by=['segment', 'time'], kind='stable')
+            kept = self.get_lttb_indices(data['time'], data['current'], data['segment'], n)
+            down_sampled_data = (data
+                                 .iloc[kept]
+                                 .filter(['cycle', 'direction', 'segment', 'potential', 'current', 'time'])
+                                 .reset_index(drop=True)
                                  )
-                             .reset_index()
-                             .drop(columns=['time_bin'])
-                             .pipe(self._add_endpoints)
-                             .pipe(self._find_current_roots)
-                             )
+
+        # the roots are found before the endpoints are added, as when the data is first wrangled, so that a root just after
+        # the end of a segment belongs to that segment rather than to the copy of its end at the start of the next one
+        self._data = (down_sampled_data
+                      .sort_values(by=['time'], kind='stable')
+                      .pipe(self._find_current_roots)
+                      .pipe(self._add_endpoints)
+                      .reset_index(drop=True)
+                      )
         
-        self._data = down_sampled_data
         return self
     
     def get_peaks(self, window = 0.01, polynomial_order = 4, summary: bool = False) -> pd.DataFrame:
         """
-        Function to find the peaks in the data
-        """
-        data = self._data.copy()
-        
-        peaks = (data
-                 .query('segment != 0 and segment != @self._max_segment')
-                 .assign(current=lambda x: np.where(x['direction'] == 'reduction', x['current'] * -1, x['current']))
-                 .groupby(['segment', 'direction', 'cycle'], group_keys=False)
-                 .apply(lambda df: self.find_local_peak_with_polynomial(df, y_col='current', x_col='potential', initial_guess=df.loc[df['current'].idxmax(), 'potential'], window=window, polynomial_order=polynomial_order))
-                 .assign(
-                     current=lambda x: np.where(x['direction'] == 'reduction', x['current'] * -1, x['current']),
-                     fit_current=lambda x: np.where(x['direction'] == 'reduction', x['fit_current'] * -1, x['fit_current']),
-                     current_peak=lambda x: np.where(x['direction'] == 'reduction', x['current_peak'] * -1, x['current_peak'])
-                     )
-                 )
+        Function to find the peaks in the data. The peaks of all segments are fitted together, and the fits are cached
+        for each window and polynomial order until the data changes
+        :param window: The window around the maximum current of each segment to search for the peak
+        :param polynomial_order: The order of the polynomial to fit to the data
+        :param summary: Whether to return only the peak of each segment, rather than the fitted curves
+        :return: a data frame with the peaks
+        """
+        if self._peak_cache[0] is not self._data:
+            self._peak_cache = (self._data, {})
+
+        peak_fits = self._peak_cache[1]
+
+        if (window, polynomial_order) not in peak_fits:
+            peak_fits[(window, polynomial_order)] = (self
+                                                     ._data
+                                                     .query('segment != 0 and segment != @self._max_segment')
+                                                     .assign(current=lambda x: np.where(x['direction'] == 'reduction', x['current'] * -1, x['current']))
+                                                     .pipe(self.find_local_peaks_with_polynomial, y_col='current', x_col='potential', 
+                                                           group_cols=['segment', 'direction', 'cycle'], window=window, polynomial_order=polynomial_order)
+                                                     .assign(
+                                                         current=lambda x: np.where(x['direction'] == 'reduction', x['current'] * -1, x['current']),
+                                                         fit_current=lambda x: np.where(x['direction'] == 'reduction', x['fit_current'] * -1, x['fit_current']),
+                                                         current_peak=lambda x: np.where(x['direction'] == 'reduction', x['current_peak'] * -1, x['current_peak'])
+                                                         )
+                                                     )
         
+        peaks = peak_fits[(window, polynomial_order)].copy()
+
         if summary is True:
             peaks = (peaks
                      .drop(columns=['current', 'potential', 'time', 'fit_current'])
@@ -604,8 +684,7 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
             raise ValueError('Direction must be either oxidation or reduction')
 
         data = (self
-                .data
-                .copy()
+                ._data
                 .query('segment != segment.max() and segment != segment.min()')
                 .query(f'direction == "{direction}"')
                 .assign(cycle = lambda x: x['cycle'].astype('str'))
@@ -666,3 +745,166 @@ class CyclicVoltammogram(ElectrochemicalMeasurement):
     
     def __str__(self):
         return f"A cyclic voltammogram initiated on {self.object_creation_time}"
+
+
+class CyclicVoltammogramBatch():
+    """
+    A class for analysing many cyclic voltammogram files at once. Each file is read, wrangled and analysed in a pool of
+    worker processes, and the charges and peaks of all the files are collected into tidy tables keyed by file and by 
+    any metadata given in the manifest. A file which fails does not stop the others; its error is reported in the log.
+    Main contributors:
+    Nicholas Siemons
+    Contributors:
+    """
+    def __init__(self, 
+                 files: str | list[str] | pd.DataFrame, 
+                 source: str = 'biologic', 
+                 scan_rate: float = None, 
+                 workers: int = None, 
+                 **kwargs) -> None:
+        """
+        :param files: a glob pattern, a list of paths, or a manifest dataframe with a file column. Any other columns of the
+        manifest are treated as metadata, and a manifest can also set the source and scan_rate of each file
+        :param source: the source of the files, either biologic or aftermath, for files without a source in the manifest
+        :param scan_rate: the scan rate in mV/s of aftermath files without a scan_rate in the manifest
+        :param workers: the number of processes to use. If 1, the files are processed in this process
+        :param kwargs: additional arguments passed to CyclicVoltammogram.from_biologic or from_aftermath, such as electrolyte
+        """
+        if type(files) == str:
+            manifest = pd.DataFrame({'file': sorted(glob.glob(files))})
+        elif type(files) == pd.DataFrame:
+            manifest = files.copy()
+        else:
+            manifest = pd.DataFrame({'file': list(files)})
+
+        if 'file' not in manifest.columns:
+            raise ValueError('The manifest must have a file column')
+
+        if 'source' not in manifest.columns:
+            manifest['source'] = source
+        if 'scan_rate' not in manifest.columns:
+            manifest['scan_rate'] = scan_rate
+
+        if not manifest['source'].isin(['biologic', 'aftermath']).all():
+            raise ValueError('The source must be either biologic or aftermath')
+
+        self._manifest = manifest.reset_index(drop=True)
+        self._workers = workers
+        self._kwargs = kwargs
+        self._results = None
+
+    @property
+    def manifest(self) -> pd.DataFrame:
+        return self._manifest
+    
+    @property
+    def metadata_columns(self) -> list[str]:
+        return [c for c in self._manifest.columns if c not in ['file', 'source', 'scan_rate']]
+    
+    def process(self, charges: bool = True, peaks: bool = True, window = 0.01, polynomial_order = 4) -> 'CyclicVoltammogramBatch':
+        """
+        Function to read and analyse all the files in the manifest
+        :param charges: whether to calculate the charges passed in each segment
+        :param peaks: whether to find the peaks in each segment
+        :param window: the window around the maximum current of each segment to search for the peak
+        :param polynomial_order: the order of the polynomial to fit to the peaks
+        :return: self
+        """
+        tasks = [{
+            'file': row['file'], 
+            'source': row['source'], 
+            'scan_rate': row['scan_rate'], 
+            'metadata': {c: row[c] for c in self.metadata_columns},
+            'charges': charges, 
+            'peaks': peaks, 
+            'window': window, 
+            'polynomial_order': polynomial_order, 
+            'kwargs': self._kwargs
+            } for _, row in self._manifest.iterrows()]
+
+        if self._workers == 1:
+            self._results = [self._process_file(t) for t in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=self._workers) as executor:
+                self._results = list(executor.map(self._process_file, tasks))
+
+        return self
+    
+    @staticmethod
+    def _process_file(task: dict) -> dict:
+        """
+        Function to read and analyse one file, timing it and catching any errors
+        :param task: dict with the file, source, scan_rate, metadata and analysis options
+        :return: dict with the charges and peaks tables, the time taken in seconds and the error, which is None if every
+        step succeeded
+        """
+        start = time.perf_counter()
+        result = {'charges': None, 'peaks': None, 'error': None}
+        errors = []
+
+        try:
+            if task['source'] == 'biologic':
+                cv = CyclicVoltammogram.from_biologic(path=task['file'], metadata=task['metadata'], **task['kwargs'])
+            else:
+                cv = CyclicVoltammogram.from_aftermath(path=task['file'], scan_rate=task['scan_rate'], metadata=task['metadata'], **task['kwargs'])
+        except Exception as e:
+            cv = None
+            errors.append(f"{type(e).__name__}: {e}")
+
+        if cv is not None and task['charges']:
+            try:
+                result['charges'] = cv.get_charge_passed()
+            except Exception as e:
+                errors.append(f"charges {type(e).__name__}: {e}")
+
+        if cv is not None and task['peaks']:
+            try:
+                result['peaks'] = cv.get_peaks(window=task['window'], polynomial_order=task['polynomial_order'], summary=True)
+            except Exception as e:
+                errors.append(f"peaks {type(e).__name__}: {e}")
+
+        result['time'] = time.perf_counter() - start
+        result['error'] = '; '.join(errors) if len(errors) > 0 else None
+
+        return result
+    
+    def _get_table(self, name: str) -> pd.DataFrame:
+        """
+        Function to concatenate one of the result tables of all the files, keyed by file and metadata
+        :param name: the name of the table, either charges or peaks
+        :return: the concatenated table
+        """
+        if self._results is None:
+            raise ValueError('The batch has not been processed yet. Call process first')
+
+        keys = ['file'] + self.metadata_columns
+        tables = [result[name].reset_index(drop=True).assign(**row[keys].to_dict()) for (_, row), result in zip(self._manifest.iterrows(), self._results) if result[name] is not None]
+
+        if len(tables) == 0:
+            return pd.DataFrame(columns=keys)
+
+        table = pd.concat(tables, ignore_index=True)
+        return table.filter(keys + [c for c in table.columns if c not in keys])
+    
+    @property
+    def charges(self) -> pd.DataFrame:
+        return self._get_table('charges')
+    
+    @property
+    def peaks(self) -> pd.DataFrame:
+        return self._get_table('peaks')
+    
+    @property
+    def log(self) -> pd.DataFrame:
+        if self._results is None:
+            raise ValueError('The batch has not been processed yet. Call process first')
+        
+        return (self
+                ._manifest
+                .filter(['file'] + self.metadata_columns)
+                .assign(time = [r['time'] for r in self._results])
+                .assign(error = [r['error'] for r in self._results])
+                )
+    
+    def __str__(self):
+        return f"A batch of {len(self._manifest)} cyclic voltammograms"
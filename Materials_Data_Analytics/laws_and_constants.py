@@ -1,5 +1,6 @@
 import pandas as pd
 import numpy as np
+from scipy.signal import fftconvolve
 
 # fundamentals
 KB = 1.380649e-23         # Boltzmann constant in J/K
@@ -17,6 +18,17 @@ DIFF_RATE_O2  = 1.9e-5 # cm2/s
 # viscosity parameters
 VISCOSITY_AQ = 0.01 # cm2/s
 
+# covalent radii in Angstroms, from Cordero et al., Dalton Trans., 2008, 2832
+COVALENT_RADII = {
+    'H': 0.31, 'He': 0.28, 'Li': 1.28, 'Be': 0.96, 'B': 0.84, 'C': 0.76, 'N': 0.71, 'O': 0.66, 'F': 0.57, 'Ne': 0.58,
+    'Na': 1.66, 'Mg': 1.41, 'Al': 1.21, 'Si': 1.11, 'P': 1.07, 'S': 1.05, 'Cl': 1.02, 'Ar': 1.06, 'K': 2.03,
+    'Ca': 1.76, 'Sc': 1.70, 'Ti': 1.60, 'V': 1.53, 'Cr': 1.39, 'Mn': 1.39, 'Fe': 1.32, 'Co': 1.26, 'Ni': 1.24,
+    'Cu': 1.32, 'Zn': 1.22, 'Ga': 1.22, 'Ge': 1.20, 'As': 1.19, 'Se': 1.20, 'Br': 1.20, 'Kr': 1.16, 'Rb': 2.20,
+    'Sr': 1.95, 'Y': 1.90, 'Zr': 1.75, 'Nb': 1.64, 'Mo': 1.54, 'Tc': 1.47, 'Ru': 1.46, 'Rh': 1.42, 'Pd': 1.39,
+    'Ag': 1.45, 'Cd': 1.44, 'In': 1.42, 'Sn': 1.39, 'Sb': 1.39, 'Te': 1.38, 'I': 1.39, 'Xe': 1.40, 'Cs': 2.44,
+    'Ba': 2.15, 'Pt': 1.36, 'Au': 1.36, 'Hg': 1.32, 'Pb': 1.46, 'Bi': 1.48
+}
+
 def boltzmann_energy_to_population(data: pd.DataFrame, x_col: str, temperature: float = 298, y_col: str = 'energy',
                                    y_col_out: str = 'population', discrete_bins: bool = False) -> pd.DataFrame:
     """
@@ -52,14 +64,101 @@ def boltzmann_population_to_energy(data: pd.DataFrame, temperature: float = 298,
     return data
 
 
-def lorentzian(x: list, x0: float, w: float, h: float) -> list[float]:
+def lorentzian(x: list | np.ndarray, x0: float | np.ndarray, w: float, h: float | np.ndarray) -> np.ndarray:
     """
-    lorentzian function
-    :param x: a list of x values
+    lorentzian function. The arguments are broadcast against each other, so many peaks can be evaluated at once
+    :param x: a list or array of x values
     :param x0: the center of the lorentzian
     :param w: width of the lorentzian peak
     :param h: height of the lorentzian peak
-    :return: list of y values
+    :return: array of y values
     """
-    y = [(h/np.pi)*((w/2)/((x-x0)**2 + (w/2)**2)) for x in x]
+    x = np.asarray(x, dtype=float)
+    y = (h/np.pi)*((w/2)/((x-x0)**2 + (w/2)**2))
     return y
+
+
+def gaussian(x: list | np.ndarray, x0: float | np.ndarray, w: float, h: float | np.ndarray) -> np.ndarray:
+    """
+    gaussian function, with the same area as a lorentzian of the same height and full width at half maximum. The
+    arguments are broadcast against each other, so many peaks can be evaluated at once
+    :param x: a list or array of x values
+    :param x0: the center of the gaussian
+    :param w: full width at half maximum of the gaussian peak
+    :param h: height of the gaussian peak
+    :return: array of y values
+    """
+    x = np.asarray(x, dtype=float)
+    sigma = w / (2 * np.sqrt(2 * np.log(2)))
+    y = h / (sigma * np.sqrt(2 * np.pi)) * np.exp(-(x-x0)**2 / (2 * sigma**2))
+    return y
+
+
+def pseudo_voigt(x: list | np.ndarray, x0: float | np.ndarray, w: float, h: float | np.ndarray,
+                 eta: float = 0.5) -> np.ndarray:
+    """
+    pseudo-voigt function, a weighted sum of a lorentzian and a gaussian of the same width
+    :param x: a list or array of x values
+    :param x0: the center of the peak
+    :param w: full width at half maximum of the peak
+    :param h: height of the peak
+    :param eta: the fraction of the lorentzian
+    :return: array of y values
+    """
+    return eta * lorentzian(x, x0, w, h) + (1 - eta) * gaussian(x, x0, w, h)
+
+
+def broadened_spectrum(x: list | np.ndarray, x0: list | np.ndarray, h: list | np.ndarray, w: float,
+                       shape: str = 'lorentzian', eta: float = 0.5, fft: bool = False,
+                       max_elements: int = 4194304) -> np.ndarray:
+    """
+    function to build a spectrum from a set of peak positions and heights by broadening each peak with a line shape. If
+    x0 and h are 2D, with a row of peaks for each spectrum, then a spectrum is built for each row. Rows with fewer peaks
+    can be padded with peaks of zero height.
+    :param x: the x values of the spectrum
+    :param x0: the positions of the peaks, with shape (peaks,) or (spectra, peaks)
+    :param h: the heights of the peaks, with the same shape as x0
+    :param w: the width of the peaks
+    :param shape: the line shape, either 'lorentzian', 'gaussian' or 'pseudo_voigt'
+    :param eta: the fraction of the lorentzian in a pseudo-voigt line shape
+    :param fft: if True, each peak is split between its two nearest x values and convolved with the line shape using an
+    FFT. This is faster for fine grids with many peaks, but x must be evenly spaced and peaks outside the grid are
+    dropped
+    :param max_elements: without the FFT, the spectra are built in chunks so that each intermediate (spectra, peaks, x)
+    array has at most this many elements
+    :return: the y values, with shape (x,) or (spectra, x)
+    """
+    line_shapes = {'lorentzian': lorentzian, 'gaussian': gaussian, 'pseudo_voigt': pseudo_voigt}
+    if shape not in line_shapes:
+        raise ValueError(f"shape must be one of {list(line_shapes.keys())}")
+
+    line_shape = line_shapes[shape] if shape != 'pseudo_voigt' else lambda *args: pseudo_voigt(*args, eta=eta)
+    x = np.asarray(x, dtype=float)
+    x0 = np.asarray(x0, dtype=float)
+    h = np.asarray(h, dtype=float)
+    batch = x0.ndim == 2
+    x0 = np.atleast_2d(x0)
+    h = np.atleast_2d(h)
+
+    if fft is False:
+        chunk = max(1, max_elements // max(1, x0.shape[1] * len(x)))
+        y = np.empty((x0.shape[0], len(x)))
+        for i in range(0, x0.shape[0], chunk):
+            y[i:i+chunk] = line_shape(x[None, None, :], x0[i:i+chunk, :, None], w, h[i:i+chunk, :, None]).sum(axis=1)
+    else:
+        step = x[1] - x[0]
+        if not np.allclose(np.diff(x), step):
+            raise ValueError("x must be evenly spaced to use an FFT")
+        position = (x0 - x[0]) / step
+        index = np.floor(position).astype(int)
+        fraction = position - index
+        sticks = np.zeros((x0.shape[0], len(x) + 1))
+        rows = np.broadcast_to(np.arange(x0.shape[0])[:, None], x0.shape)
+        for i, weight in [(index, 1 - fraction), (index + 1, fraction)]:
+            inside = (i >= 0) & (i < len(x))
+            np.add.at(sticks, (rows[inside], i[inside]), (h * weight)[inside])
+        sticks = sticks[:, :len(x)]
+        kernel = line_shape(np.arange(-len(x) + 1, len(x)) * step, 0, w, 1)
+        y = fftconvolve(sticks, kernel[None, :], mode='full', axes=1)[:, len(x) - 1:2 * len(x) - 1]
+
+    return y if batch else y[0]
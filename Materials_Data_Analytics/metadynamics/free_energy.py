@@ -2,7 +2,11 @@ from __future__ import annotations
 import pandas as pd
 import numpy as np
 import os
+import glob
 import plotly.graph_objects as go
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 import plotly.express as px
 from pandas import DataFrame
 from Materials_Data_Analytics.laws_and_constants import boltzmann_energy_to_population, KB, NA, boltzmann_population_to_energy
@@ -102,6 +106,227 @@ class MetaTrajectory:
         return data
 
 
+class StreamingReweighter:
+    """
+    Class to reweight a metadynamics run along one cv while plumed is still writing its colvar files. Each call to update
+    only reads the frames written since the last call, by seeking to the last byte offset read, and adds them to a
+    weighted histogram for that file. As in MetaTrajectory, the weights of each file are relative to the largest weight
+    in that file. If plumed has backed up a colvar file to bck.*.COLVAR* on a restart, the rest of the backed up file is
+    read before starting on the new one. The columns are taken from the latest #! FIELDS line, so columns can change
+    between restarts.
+    """
+    def __init__(self, colvar_files: str | list[str], cv: str, bins: int | list[int | float], cv_range: tuple = None,
+                 temperature: float = 298, metadata: dict = None):
+        """
+        :param colvar_files: the colvar file or files to follow
+        :param cv: the cv to reweight along
+        :param bins: number of bins, or a list with the bin boundaries
+        :param cv_range: tuple with the range of the cv to bin over, needed if bins is a number
+        :param temperature: temperature of the simulation
+        :param metadata: any metadata to give the free energy lines
+        """
+        if type(bins) == int:
+            if cv_range is None:
+                raise ValueError("Give a cv_range if bins is a number, since the data range is not known in advance")
+            self._edges = np.linspace(min(cv_range), max(cv_range), bins + 1)
+        else:
+            self._edges = np.array(bins, dtype=np.float64)
+
+        self._discrete_bins = type(bins) != int
+        self._files = {f: {'offset': 0, 'inode': None, 'columns': None, 'log_shift': None,
+                           'histogram': np.zeros(len(self._edges) - 1)}
+                       for f in ([colvar_files] if type(colvar_files) == str else colvar_files)}
+        self.cv = cv
+        self.temperature = temperature
+        self._metadata = metadata
+        self.n_frames = 0
+
+    def update(self):
+        """
+        Function to read the frames written to the colvar files since the last update and add them to the histogram
+        :return: self
+        """
+        for file, state in self._files.items():
+            if not os.path.exists(file):
+                continue
+
+            stat = os.stat(file)
+            if state['inode'] is not None and (stat.st_ino != state['inode'] or stat.st_size < state['offset']):
+                backup = self._find_backup(file, state['inode'])
+                if backup is not None:
+                    self._read_new_frames(backup, state)
+                state['offset'] = 0
+                state['columns'] = None
+
+            state['inode'] = stat.st_ino
+            self._read_new_frames(file, state)
+
+        return self
+
+    @staticmethod
+    def _find_backup(file: str, inode: int) -> str | None:
+        """
+        Function to find the file plumed backed up a colvar file to on a restart
+        :param file: the colvar file
+        :param inode: the inode of the colvar file before the restart
+        :return: the path of the backup, or None if it can't be found
+        """
+        directory, name = os.path.split(file)
+        for backup in glob.glob(os.path.join(directory, 'bck.*.' + name)):
+            if os.stat(backup).st_ino == inode:
+                return backup
+        return None
+
+    def _read_new_frames(self, file: str, state: dict):
+        """
+        Function to read the complete lines written to a file since the last read, and add them to the histogram
+        :param file: the file to read
+        :param state: the offset, columns and histogram of the file
+        :return:
+        """
+        with open(file, 'rb') as f:
+            f.seek(state['offset'])
+            text = f.read()
+
+        end = text.rfind(b'\n') + 1
+        state['offset'] += end
+        rows = []
+
+        for line in text[:end].decode().splitlines():
+            if line.startswith('#! FIELDS'):
+                self._add_frames(rows, state)
+                rows = []
+                state['columns'] = line.split()[2:]
+            elif line.strip() and not line.startswith('#'):
+                rows.append(line.split())
+
+        self._add_frames(rows, state)
+
+    def _add_frames(self, rows: list[list[str]], state: dict):
+        """
+        Function to add frames to the weighted histogram of a file. The log weights are shifted by the largest seen so
+        far in that file, and the histogram is rescaled when that shift changes.
+        :param rows: the split data lines
+        :param state: the columns and histogram of the file
+        :return:
+        """
+        rows = [r for r in rows if state['columns'] is not None and len(r) == len(state['columns'])]
+        if not rows:
+            return
+
+        data = np.array(rows, dtype=np.float64)
+        columns = {c: i for i, c in enumerate(state['columns'])}
+
+        if 'metad.rbias' in columns:
+            reweight_bias = data[:, columns['metad.rbias']]
+        elif 'opes.bias' in columns:
+            reweight_bias = data[:, columns['opes.bias']]
+        elif 'metad.bias' in columns and 'metad.rct' in columns:
+            reweight_bias = data[:, columns['metad.bias']] - data[:, columns['metad.rct']]
+        else:
+            raise ValueError("The colvar file needs a metad.rbias, opes.bias or metad.bias and metad.rct column")
+
+        if self.cv not in columns:
+            raise ValueError(f"The colvar file does not have the cv {self.cv}")
+
+        log_weights = reweight_bias / (KB * self.temperature)
+        if state['log_shift'] is None or log_weights.max() > state['log_shift']:
+            if state['log_shift'] is not None:
+                state['histogram'] = state['histogram'] * np.exp(state['log_shift'] - log_weights.max())
+            state['log_shift'] = log_weights.max()
+
+        state['histogram'] += np.histogram(data[:, columns[self.cv]], bins=self._edges,
+                                           weights=np.exp(log_weights - state['log_shift']))[0]
+        self.n_frames += data.shape[0]
+
+    def get_line(self, update: bool = True) -> FreeEnergyLine:
+        """
+        Function to get the free energy line from the frames read so far
+        :param update: read any new frames first
+        :return: a free energy line
+        """
+        if update:
+            self.update()
+
+        histogram = np.sum([state['histogram'] for state in self._files.values()], axis=0)
+        if histogram.sum() == 0:
+            raise ValueError("No frames have been read from the colvar files yet")
+
+        widths = np.diff(self._edges)
+        population = histogram / (histogram.sum() * widths)
+        if self._discrete_bins:
+            population = population * widths
+
+        data = (pd.DataFrame({
+            'population': population,
+            self.cv: (self._edges[1:] + self._edges[:-1]) / 2
+        })
+                .pipe(boltzmann_population_to_energy, temperature=self.temperature)
+                .filter([self.cv, 'energy', 'population'])
+                )
+
+        return FreeEnergyLine(data, temperature=self.temperature, metadata=self._metadata)
+
+
+class LazyTimeData(Mapping):
+    """
+    Class to hold the time data of a free energy shape as a read-only mapping of time stamp to snapshot, where each
+    snapshot is only read from its file when it is first accessed. Each access returns a copy, so in-place edits to a
+    snapshot are not kept. At most max_cached snapshots are held in memory,
+    dropping the least recently used first. A datum is held as a rule giving the energy offset of a snapshot, and the
+    offset is applied when the snapshot is accessed rather than by rewriting every snapshot.
+    """
+    def __init__(self, files: dict[int | float, str], reader, max_cached: int = 32):
+        """
+        :param files: dict with the time stamp as the key and the snapshot file as the value
+        :param reader: function to read a snapshot file into a dataframe
+        :param max_cached: the maximum number of snapshots to keep in memory
+        """
+        self._files = dict(sorted(files.items()))
+        self._reader = reader
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        self._offset_rule = None
+        self._offsets = {}
+
+    def __getitem__(self, time_stamp: int | float) -> pd.DataFrame:
+        if time_stamp not in self._files:
+            raise KeyError(time_stamp)
+
+        if time_stamp in self._cache:
+            self._cache.move_to_end(time_stamp)
+            data = self._cache[time_stamp]
+        else:
+            data = self._reader(self._files[time_stamp])
+            self._cache[time_stamp] = data
+            if len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+        if self._offset_rule is None:
+            return data.copy()
+
+        if time_stamp not in self._offsets:
+            self._offsets[time_stamp] = self._offset_rule(data)
+
+        return data.assign(energy=data['energy'] - self._offsets[time_stamp])
+
+    def __iter__(self):
+        return iter(self._files)
+
+    def __len__(self):
+        return len(self._files)
+
+    def set_offset_rule(self, offset_rule):
+        """
+        Function to set the rule giving the energy offset of each snapshot. Offsets already computed are discarded.
+        :param offset_rule: function taking an unshifted snapshot and returning its energy offset
+        :return: self
+        """
+        self._offset_rule = offset_rule
+        self._offsets = {}
+        return self
+
+
 class FreeEnergyShape:
 
     def __init__(self, data: pd.DataFrame | dict[int | float], temperature: float = 298, dimension: int = None,
@@ -125,6 +350,9 @@ class FreeEnergyShape:
                     raise ValueError("make sure there is an energy column in each dataframe in your dict")
             self._time_data = data
             self._data = data[max(data)].copy()
+        elif isinstance(data, LazyTimeData):
+            self._time_data = data
+            self._data = data[max(data)]
         else:
             raise ValueError("fes_file must be a pd.Dataframe or a list[pd.Dataframe]")
 
@@ -132,16 +360,22 @@ class FreeEnergyShape:
         self.cvs = self._data.columns.values.tolist()[:dimension]
         self.dimension = dimension
         self._metadata = metadata
+        self._time_array = None
 
     @property
     def metadata(self):
         return self._metadata
 
     @classmethod
-    def from_plumed(cls, file: str | list[str], **kwargs):
+    def from_plumed(cls, file: str | list[str], lazy: bool = False, max_cached: int = 32, workers: int = None,
+                    **kwargs):
         """
         alternate constructor to build the fes from a plumed file
         :param file: the file or list of files to make the plumed fes from. if list then it will make the time _data
+        :param lazy: if a list of files, only read each time stamp when it is first accessed. Lazy time stamps are
+        read-only: each access returns a copy, so in-place edits to a time stamp are not kept
+        :param max_cached: if lazy, the maximum number of time stamps to keep in memory
+        :param workers: if not lazy, the number of threads to read the files with
         :return: fes object
         """
         if type(file) == str:
@@ -149,8 +383,12 @@ class FreeEnergyShape:
         elif type(file) == list:
             individual_files = [f.split("/")[-1] for f in file]
             time_stamps = [int(''.join(x for x in os.path.basename(f) if x.isdigit())) for f in individual_files]
-            data_frames = [cls._read_file(f) for f in file]
-            data = {time_stamps[i]: data_frames[i] for i in range(0, len(file))}
+            if lazy:
+                data = LazyTimeData(dict(zip(time_stamps, file)), reader=cls._read_file, max_cached=max_cached)
+            else:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    data_frames = list(executor.map(cls._read_file, file))
+                data = {time_stamps[i]: data_frames[i] for i in range(0, len(file))}
         else:
             raise ValueError("")
 
@@ -211,25 +449,33 @@ class FreeEnergyShape:
             if cv not in self.cvs:
                 raise ValueError("The keys for the datum dictionary need to be cvs!")
 
-        if type(datum[self.cvs[0]]) == float or type(datum[self.cvs[0]]) == int:
-            adjust_value = self.get_nearest_value(self._data, datum, 'energy')
-            self._data['energy'] = self._data['energy'] - adjust_value
-            if self._time_data is not None:
-                for _, v in self._time_data.items():
-                    adjust_value = self.get_nearest_value(v, datum, 'energy')
-                    v['energy'] = v['energy'] - adjust_value
-        elif type(datum[self.cvs[0]]) == tuple:
-            adjust_value = self._get_mean_in_range(self._data, self.cvs[0], 'energy', datum[self.cvs[0]])
-            self._data['energy'] = self._data['energy'] - adjust_value
-            if self._time_data is not None:
-                for _, v in self._time_data.items():
-                    adjust_value = self._get_mean_in_range(v, self.cvs[0], 'energy', datum[self.cvs[0]])
-                    v['energy'] = v['energy'] - adjust_value
-        else:
+        if type(datum[self.cvs[0]]) not in [float, int, tuple]:
             raise ValueError("Enter either a float or a tuple!")
 
+        self._data['energy'] = self._data['energy'] - self._get_datum_offset(self._data, datum)
+
+        if isinstance(self._time_data, LazyTimeData):
+            self._time_data.set_offset_rule(lambda x: self._get_datum_offset(x, datum))
+        elif self._time_data is not None:
+            for _, v in self._time_data.items():
+                v['energy'] = v['energy'] - self._get_datum_offset(v, datum)
+
+        self._time_array = None
+
         return self
 
+    def _get_datum_offset(self, data: pd.DataFrame, datum: dict[str, float | int | tuple[float | int, float | int]]):
+        """
+        Function to get the energy by which data needs to be shifted to set the datum
+        :param data: the data to shift
+        :param datum: either the point on the fes to set as the datum, or a range of the fes to set as the datum
+        :return: the energy offset
+        """
+        if type(datum[self.cvs[0]]) == tuple:
+            return self._get_mean_in_range(data, self.cvs[0], 'energy', datum[self.cvs[0]])
+        else:
+            return self.get_nearest_value(data, datum, 'energy')
+
     @staticmethod
     def _read_file(file, **kwargs):
         pass
@@ -244,8 +490,7 @@ class FreeEnergyShape:
         if with_timedata:
             data = []
             for ts, d in self._time_data.items():
-                d['timestamp'] = ts
-                data.append(d)
+                data.append(d.assign(timestamp=ts))
             data = pd.concat(data)
         else:
             data = self._data.copy()
@@ -311,30 +556,14 @@ class FreeEnergyLine(FreeEnergyShape):
         :param with_metadata: whether to return _data with the line _metadata
         :return: pandas dataframe with the _data
         """
-        time_data = []
-
-        for key, df in self._time_data.items():
-
-            if type(region_1) == int or type(region_1) == float:
-                value_1 = df.loc[(df[self.cvs[0]] - region_1).abs().argsort()[:1], 'energy'].values[0]
-            elif type(region_1) == tuple:
-                value_1 = df.loc[df[self.cvs[0]].between(min(region_1), max(region_1)), 'energy'].values.mean()
-            else:
-                raise ValueError("Use either a number or tuple of two numbers")
-
-            if (type(region_2) == int or type(region_2) == float) and region_2 is not None:
-                value_2 = df.loc[(df[self.cvs[0]] - region_2).abs().argsort()[:1], 'energy'].values[0]
-            elif type(region_2) == tuple and region_2 is not None:
-                value_2 = df.loc[df[self.cvs[0]].between(min(region_2), max(region_2)), 'energy'].values.mean()
-            elif region_2 is None:
-                value_2 = 0
-            else:
-                raise ValueError("Use either a number or tuple of two numbers")
+        if self._time_data is None:
+            raise ValueError("You need time _data to use this function")
 
-            difference = value_2 - value_1
-            time_data.append(pd.DataFrame({'time_stamp': [key], 'energy_difference': [difference]}))
+        time_stamps, grid, values = self._get_time_array()
+        value_1 = self._get_time_region_energy(grid, values['energy'], region_1)
+        value_2 = self._get_time_region_energy(grid, values['energy'], region_2) if region_2 is not None else 0
 
-        time_data = pd.concat(time_data).sort_values('time_stamp')
+        time_data = pd.DataFrame({'time_stamp': time_stamps, 'energy_difference': value_2 - value_1})
 
         if with_metadata:
             time_data['temperature'] = self.temperature
@@ -343,6 +572,54 @@ class FreeEnergyLine(FreeEnergyShape):
 
         return time_data
 
+    @staticmethod
+    def _get_time_region_energy(grid: np.ndarray, energy: np.ndarray,
+                                region: float | int | tuple[float | int, float | int]) -> np.ndarray:
+        """
+        Function to get the energy of a point or region of the FES at every time stamp
+        :param grid: the cv grid
+        :param energy: the energy array with shape (n_timestamps, n_grid)
+        :param region: a number to take the nearest point, or a tuple to take the mean over the interval
+        :return: array with the energy at each time stamp
+        """
+        if type(region) == int or type(region) == float:
+            return energy[:, np.abs(grid - region).argmin()]
+        elif type(region) == tuple:
+            return energy[:, (grid >= min(region)) & (grid <= max(region))].mean(axis=1)
+        else:
+            raise ValueError("Use either a number or tuple of two numbers")
+
+    def _get_time_array(self) -> tuple[np.ndarray, np.ndarray, dict[str, np.ndarray]]:
+        """
+        Function to stack the time data onto a common cv grid, so that statistics across time stamps are reductions
+        along the first axis. The grid is that of the final time stamp, and any frame on a different grid is linearly
+        interpolated onto it. The stack is cached until the energies are next changed. Every time stamp is read to build
+        the stack, so with lazy time data this reads every file once, although only the stacked arrays are kept.
+        :return: the sorted time stamps, the cv grid and a dict of (n_timestamps, n_grid) arrays for each value column
+        """
+        if self._time_array is not None:
+            return self._time_array
+
+        cv = self.cvs[0]
+        time_stamps = np.sort(np.array(list(self._time_data.keys())))
+        grid = self._time_data[time_stamps[-1]][cv].to_numpy(dtype=np.float64)
+        columns = [c for c in ['energy', 'population'] if c in self._time_data[time_stamps[-1]].columns]
+        values = {c: np.empty((len(time_stamps), len(grid))) for c in columns}
+
+        for i, t in enumerate(time_stamps):
+            frame = self._time_data[t]
+            frame_grid = frame[cv].to_numpy(dtype=np.float64)
+            same_grid = len(frame_grid) == len(grid) and np.array_equal(frame_grid, grid)
+            order = None if same_grid else np.argsort(frame_grid)
+            for c in columns:
+                if same_grid:
+                    values[c][i] = frame[c].to_numpy(dtype=np.float64)
+                else:
+                    values[c][i] = np.interp(grid, frame_grid[order], frame[c].to_numpy(dtype=np.float64)[order])
+
+        self._time_array = (time_stamps, grid, values)
+        return self._time_array
+
     def set_errors_from_time_dynamics(self, n_timestamps: int, bins: int = 200):
         """
         Function to get _data and errors from considering the time dynamics of the FES
@@ -355,27 +632,31 @@ class FreeEnergyLine(FreeEnergyShape):
         if self._time_data is None:
             raise ValueError("You need time _data to use this function")
 
-        data = []
-        min_timestamp = max(self._time_data) - n_timestamps
-        for key, value in self._time_data.items():
-            new_data = value.copy()
-            new_data['timestamp'] = key
-            data.append(new_data)
-
-        data = (pd.concat(data)
-                .query('timestamp > @min_timestamp')
-                .assign(bin=lambda x: pd.cut(x[self.cvs[0]], bins))
-                )
-
-        binned_data = pd.DataFrame({
-            self.cvs[0]: data.groupby('bin', observed=True).mean()[self.cvs[0]],
-            'energy': data.groupby('bin', observed=True).mean()['energy'],
-            'energy_err': data.groupby('bin', observed=True).std()['energy'],
-            'population': data.groupby('bin', observed=True).mean()['population'],
-            'population_err': data.groupby('bin', observed=True).std()['population']/np.sqrt(n_timestamps)
-        }).dropna()
-
-        self._data = binned_data
+        time_stamps, grid, values = self._get_time_array()
+        recent = time_stamps > time_stamps.max() - n_timestamps
+        n_recent = recent.sum()
+        bin_index = pd.cut(grid, bins, labels=False)
+        counts = np.bincount(bin_index, minlength=bins) * n_recent
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            binned_data = {self.cvs[0]: np.bincount(bin_index, weights=grid, minlength=bins) * n_recent / counts}
+            for c in ['energy', 'population']:
+                recent_values = values[c][recent]
+                mean = np.bincount(bin_index, weights=recent_values.sum(axis=0), minlength=bins) / counts
+                square_deviation = ((recent_values - mean[bin_index])**2).sum(axis=0)
+                std = np.sqrt(np.bincount(bin_index, weights=square_deviation, minlength=bins) / (counts - 1))
+                binned_data[c] = mean
+                binned_data[c + '_err'] = std
+
+        binned_data['population_err'] = binned_data['population_err'] / np.sqrt(n_timestamps)
+
+        self._data = (pd
+                      .DataFrame(binned_data)
+                      .filter([self.cvs[0], 'energy', 'energy_err', 'population', 'population_err'])
+                      .loc[lambda x: counts > 0]
+                      .dropna()
+                      .reset_index(drop=True)
+                      )
 
         return self
 
@@ -443,6 +724,17 @@ class FreeEnergySurface(FreeEnergyShape):
 
         return self
 
+    def _get_grid(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Function to get the free energy surface as a regular grid
+        :return: the cv1 grid points, the cv2 grid points and the energy array with shape (len(x), len(y))
+        """
+        grid = self._data.pivot(index=self.cvs[0], columns=self.cvs[1], values='energy').sort_index().sort_index(axis=1)
+        x = grid.index.to_numpy(dtype=np.float64)
+        y = grid.columns.to_numpy(dtype=np.float64)
+        v = grid.to_numpy(dtype=np.float64)
+        return x, y, v
+
     def get_mean_force(self) -> pd.DataFrame:
         """
         Function to get the mean force from the free energy surface
@@ -450,9 +742,7 @@ class FreeEnergySurface(FreeEnergyShape):
         """
         cv1 = self.cvs[0]
         cv2 = self.cvs[1]
-        x = self._data.pivot(index=[cv1], columns=[cv2], values=['energy']).index.to_list()
-        y = [i[1] for i in self._data.pivot(index=[cv1], columns=[cv2], values=['energy']).columns.to_list()]
-        v = self._data.pivot(index=[cv1], columns=[cv2], values=['energy']).to_numpy()
+        x, y, v = self._get_grid()
 
         force = [-f for f in np.gradient(v, x, y)]
 
@@ -487,6 +777,7 @@ class FreeEnergySpace:
         self.n_walker = 0
         self.sigmas = None
         self._hills = None
+        self._hills_array = None
         self.n_timesteps = None
         self.max_time = None
         self.dt = None
@@ -693,6 +984,94 @@ class FreeEnergySpace:
         self.surfaces.append(surface)
         return self
 
+    def _get_hills_array(self) -> tuple[np.ndarray, np.ndarray, list[str], np.ndarray]:
+        """
+        Function to get the hills as an array with shape (n_times, n_groups, n_fields), where the groups are the walkers,
+        or the biased cvs for a bias-exchange simulation. Walkers with no hill at a time are nan. The array is built
+        once and cached.
+        :return: the sorted times, the groups, the field names and the array
+        """
+        if self._hills_array is None:
+            if self._biasexchange is True:
+                group_col = 'variable'
+                fields = ['value', 'height']
+            else:
+                group_col = 'walker'
+                fields = [c for c in self.cvs + ['height', 'logweight'] if c in self._hills.columns]
+
+            hills = self._hills.sort_values('time', kind='stable')
+            times, time_index = np.unique(hills['time'].to_numpy(), return_inverse=True)
+            groups, group_index = np.unique(hills[group_col].to_numpy(), return_inverse=True)
+            array = np.full((len(times), len(groups), len(fields)), np.nan)
+            array[time_index, group_index] = hills[fields].to_numpy(dtype=np.float64)
+            self._hills_array = (times, groups, fields, array)
+
+        return self._hills_array
+
+    def _get_binned_hills(self, time_resolution: int = 6, height_power: float = 1
+                          ) -> tuple[np.ndarray, np.ndarray, list[str], np.ndarray]:
+        """
+        Function to bin the hills array in time by rounding the times, and taking the mean of each field over each bin
+        with reduceat. The height is raised to height_power before taking the mean.
+        :param time_resolution: number of decimal places to round the times to
+        :param height_power: raise the height to the power of this
+        :return: the binned times, the groups, the field labels and the binned array
+        """
+        times, groups, fields, array = self._get_hills_array()
+        height_label = 'height^' + str(height_power) if height_power != 1 else 'height'
+        labels = [height_label if f == 'height' else f for f in fields]
+
+        values = array.copy()
+        values[:, :, fields.index('height')] = values[:, :, fields.index('height')] ** height_power
+
+        rounded_times = times.round(time_resolution)
+        starts = np.flatnonzero(np.concatenate([[True], rounded_times[1:] != rounded_times[:-1]]))
+        present = ~np.isnan(values)
+        sums = np.add.reduceat(np.where(present, values, 0), starts, axis=0)
+        counts = np.add.reduceat(present, starts, axis=0)
+
+        with np.errstate(invalid='ignore'):
+            binned = sums / counts
+
+        return rounded_times[starts], groups, labels, binned
+
+    def _get_long_hills_from_array(self, times: np.ndarray, groups: np.ndarray, labels: list[str],
+                                   values: np.ndarray) -> pd.DataFrame:
+        """
+        Function to turn a binned hills array into the long format hills dataframe
+        :param times: the binned times
+        :param groups: the walkers, or the biased cvs for a bias-exchange simulation
+        :param labels: the field labels
+        :param values: the binned hills array with shape (n_times, n_groups, n_fields)
+        :return: long format dataframe
+        """
+        n_times, n_groups, _ = values.shape
+
+        if self._biasexchange is True:
+            long_hills = (pd.DataFrame({
+                'time': np.repeat(times, n_groups),
+                'walker': 0,
+                'variable': np.tile(groups, n_times).astype(object),
+                'value': values[:, :, labels.index('value')].reshape(-1),
+                labels[1]: values[:, :, 1].reshape(-1)
+            })
+                          .dropna(how='all', subset=['value', labels[1]])
+                          )
+        else:
+            order = sorted(range(len(labels)), key=lambda i: labels[i])
+            if not self._opes:
+                order = [i for i in order if labels[i] != 'logweight']
+            long_hills = (pd.DataFrame({
+                'time': np.repeat(times, n_groups * len(order)),
+                'walker': np.tile(np.repeat(groups, len(order)), n_times),
+                'variable': np.tile(np.array([labels[i] for i in order], dtype=object), n_times * n_groups),
+                'value': values[:, :, order].reshape(-1)
+            })
+                          .dropna(subset=['value'])
+                          )
+
+        return long_hills.reset_index(drop=True)
+
     def get_long_hills(self, time_resolution: int = 6, height_power: float = 1):
         """
         Function to turn the _hills into long format, and allow for time binning and height power conversion. Works for
@@ -709,30 +1088,7 @@ class FreeEnergySpace:
         if self._hills is None:
             raise ValueError("The space needs some hills/kernels data!")
 
-        height_label = 'height^' + str(height_power) if height_power != 1 else 'height'
-        long_hills = self._hills.rename(columns={'height': height_label})
-        long_hills[height_label] = long_hills[height_label].pow(height_power)
-
-        if not self._opes and not self._biasexchange:
-            long_hills = long_hills.melt(value_vars=self.cvs + [height_label], id_vars=['time', 'walker'])
-        elif self._opes and not self._biasexchange:
-            long_hills = (long_hills
-                          .melt(value_vars=self.cvs + [height_label] + ['logweight'], id_vars=['time', 'walker'])
-                          )
-        elif self._biasexchange is True:
-            long_hills = (long_hills
-                          .assign(walker=0)
-                          )
-
-        long_hills = (long_hills
-                      .assign(time=lambda x: x['time'].round(time_resolution).astype('category'))
-                      .groupby(['time', 'walker', 'variable'], group_keys=False, observed=True)
-                      .agg('mean')
-                      .reset_index()
-                      .assign(time = lambda x: x['time'].astype(float))
-                      )
-
-        return long_hills
+        return self._get_long_hills_from_array(*self._get_binned_hills(time_resolution, height_power))
 
     def get_hills_figures(self, **kwargs) -> dict[int | str, go.Figure]:
         """
@@ -746,14 +1102,15 @@ class FreeEnergySpace:
         if self._hills is None:
             raise ValueError("The space needs some hills data!")
 
-        long_hills = self.get_long_hills(**kwargs)
-        long_hills = long_hills.groupby('walker') if self._biasexchange is False else long_hills.groupby('variable')
+        times, groups, labels, values = self._get_binned_hills(**kwargs)
 
         figs = {}
-        for name, df in long_hills:
+        for i, name in enumerate(groups):
+
+            df = self._get_long_hills_from_array(times, groups[i:i+1], labels, values[:, i:i+1, :])
 
             if self._biasexchange is True:
-                height_label = [hl for hl in df.columns.to_list() if 'height' in hl][0]
+                height_label = labels[1]
                 df = (df
                       .drop(columns=['variable'])
                       .rename(columns={'value': name})
@@ -766,7 +1123,7 @@ class FreeEnergySpace:
             figure.update_traces(line=dict(width=0.3), marker=dict(size=1.2))
             figure.update_yaxes(title=None, matches=None)
             figure.for_each_annotation(lambda a: a.update(text=a.text.split("=")[1]))
-            figs[name] = figure
+            figs[name.item() if isinstance(name, np.generic) else name] = figure
 
         return figs
 
@@ -1,5 +1,6 @@
 import pandas as pd
 import numpy as np
+from scipy.interpolate import RegularGridInterpolator
 from Materials_Data_Analytics.metadynamics.free_energy import FreeEnergySurface
 from Materials_Data_Analytics.metadynamics.free_energy import FreeEnergyShape
 
@@ -73,6 +74,28 @@ class SurfacePath(Path):
         if self._cvs[0] not in shape.cvs or self._cvs[1] not in shape.cvs:
             raise ValueError("Check the path and surface cvs are the same!")
 
+        self._surface_cvs = [c for c in shape.cvs]
+        self._energy_interpolator, self._gradient_interpolator, self._bounds = self._get_interpolators(shape)
+        self.converged = None
+        self.n_iterations = 0
+
+    @staticmethod
+    def _get_interpolators(shape: FreeEnergySurface):
+        """
+        Function to build interpolators for the energy and the energy gradient on the grid of a free energy surface.
+        The grid is built once so that all images on the path can be evaluated in a single call. Non-finite energies
+        (empty bins in a reweighted surface) are set to the highest finite energy on the surface.
+        :param shape: the free energy surface
+        :return: the energy interpolator, the gradient interpolator and the (2, 2) array of the grid bounds
+        """
+        x, y, v = shape._get_grid()
+        v = np.where(np.isfinite(v), v, np.nanmax(np.where(np.isfinite(v), v, np.nan)))
+        gradient = np.stack(np.gradient(v, x, y), axis=-1)
+        energy_interpolator = RegularGridInterpolator((x, y), v, bounds_error=False, fill_value=None)
+        gradient_interpolator = RegularGridInterpolator((x, y), gradient, bounds_error=False, fill_value=None)
+        bounds = np.array([[x.min(), x.max()], [y.min(), y.max()]])
+        return energy_interpolator, gradient_interpolator, bounds
+
     def _get_surface_forces(self, index: int):
         """
         Function to get the force from a free energy surface acting on the i'th point of the path
@@ -82,17 +105,63 @@ class SurfacePath(Path):
         if index < 0 or index > self._path.index.max():
             raise ValueError("The index needs to be between 0 and the max index")
 
-        surface_forces = self._shape.get_mean_force()
-        cv1 = self._cvs[0]
-        cv2 = self._cvs[1]
-
         if index == self._path.index.max() or index == 0:
-            fx = 0
-            fy = 0
-        else:
-            x = self._path[cv1].iloc[index]
-            y = self._path[cv2].iloc[index]
-            fx = FreeEnergyShape.get_nearest_value(surface_forces, {cv1: x}, val_col=f"{cv1}_grad")
-            fy = FreeEnergyShape.get_nearest_value(surface_forces, {cv2: y}, val_col=f"{cv2}_grad")
-
-        return np.array([fx, fy])
+            return np.array([0, 0])
+
+        gradient = self._gradient_interpolator(self._path[self._surface_cvs].to_numpy()[index])[0]
+        return -pd.Series(gradient, index=self._surface_cvs)[self._cvs].to_numpy()
+
+    @staticmethod
+    def _reparametrise(images: np.ndarray) -> np.ndarray:
+        """
+        Function to redistribute the images of a path so that they are equally spaced in arc length
+        :param images: array of shape (n_images, 2) with the images
+        :return: array of the same shape with equally spaced images
+        """
+        arc_length = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(images, axis=0), axis=1))])
+        if arc_length[-1] == 0:
+            return images
+        new_arc_length = np.linspace(0, arc_length[-1], images.shape[0])
+        return np.stack([np.interp(new_arc_length, arc_length, images[:, i]) for i in range(images.shape[1])], axis=1)
+
+    def minimise(self, step_size: float = 0.01, tolerance: float = 1e-5, max_iterations: int = 10000,
+                 fix_ends: bool = True):
+        """
+        Function to relax the path to the minimum free energy path using the simplified string method. At each
+        iteration all images are moved down the interpolated gradient of the surface at once, and then reparametrised
+        to be equally spaced in arc length.
+        :param step_size: the size of the steepest descent step, in units of cv^2/energy
+        :param tolerance: stop once the largest displacement of any image in an iteration is below this
+        :param max_iterations: the maximum number of iterations
+        :param fix_ends: keep the end points of the path fixed, otherwise they relax into the nearest minima
+        :return: self
+        """
+        images = self._path[self._surface_cvs].to_numpy(dtype=np.float64)
+        mobile = slice(1, -1) if fix_ends else slice(None)
+        self.converged = False
+
+        for i in range(max_iterations):
+            new_images = images.copy()
+            new_images[mobile] = new_images[mobile] - step_size * self._gradient_interpolator(images[mobile])
+            new_images = np.clip(new_images, self._bounds[:, 0], self._bounds[:, 1])
+            new_images = self._reparametrise(new_images)
+            displacement = np.abs(new_images - images).max()
+            images = new_images
+            self.n_iterations = i + 1
+            if displacement < tolerance:
+                self.converged = True
+                break
+
+        self._path = pd.DataFrame(images, columns=self._surface_cvs)[self._cvs]
+        return self
+
+    def get_data(self, with_energy: bool = False):
+        """
+        function to get the path data
+        :param with_energy: also return the free energy along the path
+        :return:
+        """
+        data = self._path.copy()
+        if with_energy:
+            data['energy'] = self._energy_interpolator(data[self._surface_cvs].to_numpy())
+        return data.round(3)
@@ -1,7 +1,13 @@
+import os
+import re
+import mmap
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 import numpy as np
 import DateTime as dt
-from Materials_Data_Analytics.laws_and_constants import lorentzian
+from scipy.spatial import cKDTree
+from Materials_Data_Analytics.laws_and_constants import broadened_spectrum, COVALENT_RADII
 from Materials_Data_Analytics.core.coordinate_transformer import PdbParser
 import plotly.express as px
 
@@ -14,61 +20,278 @@ C_TO_E = 6.242e18
 H_TO_EV = 27.211386245988
 EV_TO_KJMOL = 96.485
 
+
+class LogLines(Sequence):
+    """
+    Class to give a read-only list of the lines of one or more log files, chained together in the order given. The files
+    are memory mapped and only the positions of the line breaks are stored, so a line is only decoded when it is
+    requested. The memory maps are released with close(), or by using the lines as a context manager.
+    """
+
+    def __init__(self, log_files: list[str] | str):
+
+        if type(log_files) == str:
+            log_files = [log_files]
+
+        self._log_files = list(log_files)
+        self._maps = [self._map_file(f) for f in self._log_files]
+        self._starts = [self._get_line_starts(m) for m in self._maps]
+        self._offsets = np.cumsum([0] + [len(s) - 1 for s in self._starts])
+
+    @staticmethod
+    def _map_file(log_file: str) -> mmap.mmap | bytes:
+        """
+        Function to memory map a log file for reading
+        :param log_file: path to the log file
+        :return: the memory map, or empty bytes for an empty file which cannot be mapped
+        """
+        with open(log_file, 'rb') as f:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                return b''
+
+    @staticmethod
+    def _get_line_starts(data: mmap.mmap | bytes) -> np.ndarray:
+        """
+        Function to get the byte positions where each line of a file starts, with the size of the file appended so that
+        line i is data[starts[i]:starts[i+1]]
+        :param data: the memory map of the file
+        :return: array of the positions
+        """
+        breaks = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10) + 1 if len(data) > 0 else np.array([], dtype=int)
+        starts = np.concatenate([[0], breaks])
+        if starts[-1] != len(data):
+            starts = np.append(starts, len(data))
+        return starts
+
+    def __len__(self) -> int:
+        return int(self._offsets[-1])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Function to release the memory maps of the log files. The lines cannot be read after this
+        :return: None
+        """
+        for m in self._maps:
+            if isinstance(m, mmap.mmap):
+                m.close()
+
+    def _get_line(self, i: int) -> str:
+        """
+        Function to decode a single line, given its number in the chained files
+        :param i: the line number
+        :return: the line, with a universal newline as it would be read from the file in text mode
+        """
+        file = np.searchsorted(self._offsets, i, side='right') - 1
+        starts = self._starts[file]
+        j = i - self._offsets[file]
+        line = self._maps[file][starts[j]:starts[j+1]].decode('utf-8', errors='replace')
+        return line[:-2] + '\n' if line.endswith('\r\n') else line
+
+    def __getitem__(self, i: int | slice) -> str | list[str]:
+        if isinstance(i, slice):
+            return [self._get_line(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("line number out of range")
+        return self._get_line(i)
+
+    def __iter__(self):
+        for data, starts in zip(self._maps, self._starts):
+            for a, b in zip(starts[:-1], starts[1:]):
+                line = data[a:b].decode('utf-8', errors='replace')
+                yield line[:-2] + '\n' if line.endswith('\r\n') else line
+
+    def find(self, pattern: re.Pattern) -> np.ndarray:
+        """
+        Function to find the numbers of the lines matching a bytes regular expression. The search is done on the raw
+        bytes of each file, so no lines are decoded.
+        :param pattern: compiled bytes regular expression
+        :return: sorted array of the unique line numbers with a match
+        """
+        lines = [np.array([], dtype=int)]
+        for data, starts, offset in zip(self._maps, self._starts, self._offsets):
+            positions = np.fromiter((m.start() for m in pattern.finditer(data)), dtype=int)
+            lines.append(np.searchsorted(starts, positions, side='right') - 1 + offset)
+        return np.unique(np.concatenate(lines))
+
 class GaussianParser:
     """
     Class to parse information from a gaussian log file
     """
 
+    # strings marking the sections of a log file. The lines containing them are found in one scan of the file
+    _MARKERS = [
+        '****',
+        'alpha electrons',
+        'Charge =',
+        'SCF Done',
+        '>>>>>>>>>> Convergence criterion not met',
+        'Mulliken charges',
+        'Sum of Mulliken charges',
+        'Mulliken charges and spin densities:',
+        'ESP charges',
+        'The wavefunction',
+        'Normal termination of',
+        'Zero-point correction',
+        'Thermal correction to Energy=',
+        'Thermal correction to Enthalpy=',
+        'Thermal correction to Gibbs Free Energy=',
+        'Sum of electronic and zero-point Energies=',
+        'Sum of electronic and thermal Energies=',
+        'Sum of electronic and thermal Enthalpies=',
+        'Sum of electronic and thermal Free Energies=',
+        '!    Initial Parameters    !',
+        '!   Optimized Parameters   !',
+        'Trust Radius=',
+        'Largest change from initial coordinates is atom',
+        'S**2 before annihilation',
+        'Standard orientation:',
+        'Frequencies --',
+        'Raman Activ --',
+        'Population analysis using the SCF Density',
+        'Condensed to atoms (all electrons)'
+    ]
+
+    # the parsing steps run by the constructor after the keywords are read, in order
+    _SECTIONS = ['electrons', 'charge', 'energy', 'atoms', 'stability', 'orbitals', 'thermochemistry']
+
+    # the parsing steps needed by each property which is not set from the keywords, so that bulk can skip the others
+    _FIELD_SECTIONS = {
+        'n_alpha': ['electrons'],
+        'n_beta': ['electrons'],
+        'charge': ['charge'],
+        'multiplicity': ['charge'],
+        'energy': ['energy'],
+        'unrestricted': ['energy'],
+        'scf_iterations': ['energy'],
+        'atoms': ['atoms'],
+        'atomcount': ['atoms'],
+        'heavyatoms': ['atoms'],
+        'heavyatomcount': ['atoms'],
+        'stable': ['stability'],
+        'orbitals': ['orbitals'],
+        'homo': ['orbitals'],
+        'lumo': ['orbitals'],
+        'bandgap': ['orbitals'],
+        'thermal_energy_corrections': ['thermochemistry'],
+        'free_energy': ['thermochemistry']
+    }
+
+    # properties which raise an AttributeError when the calculation did not compute them
+    _OPTIONAL_FIELDS = ['thermal_energy_corrections', 'free_energy']
+
     def __init__(self, log_file: str | list[str]):
 
+        self._read(log_file)
+        self._parse(self._SECTIONS)
+
+    @classmethod
+    def _from_sections(cls, log_file: str | list[str], sections: list[str]) -> 'GaussianParser':
+        """
+        Function to make a parser which only runs some of the parsing steps, for when only some properties are needed
+        :param log_file: the log file or list of log files
+        :param sections: the parsing steps to run, from _SECTIONS
+        :return: the parser
+        """
+        parser = cls.__new__(cls)
+        parser._read(log_file)
+        parser._parse(sections)
+        return parser
+
+    def _read(self, log_file: str | list[str]):
+        """
+        Function to map the log files, index them and read the keywords and the attributes which follow from them
+        :param log_file: the log file or list of log files
+        :return: None
+        """
         self._log_file = log_file
         self._lines, self._restart, self._time_stamp = self._concatenate_log_files(log_file)
-        self._keywords = self._get_keywords()
-
-        # extract boolean attributes from keywords
-        self._raman = any('raman' in s.lower() for s in self._keywords)
-        self._freq = any('freq' in s.lower() for s in self._keywords)
-        self._opt = any('opt' in s.lower() for s in self._keywords)
-        self._stable = any('stable' in s.lower() for s in self._keywords)
-        self._pop = any('pop' in s.lower() for s in self._keywords)
-        self._solvent = any('scrf' in s.lower() for s in self._keywords)
-
-        # extract boolean attributes from the log file
-        self._complete = any('Normal termination of' in s for s in self._lines[-20:])
-        self._esp = any('esp charges' in s.lower() for s in self._lines)
-
-        # extract non-boolean attributes from the keywords
-        self._functional = [k for k in self._keywords if "/" in k][0].split("/")[0].upper()
-        self._basis = [k for k in self._keywords if "/" in k][0].split("/")[1]
-        self._n_alpha = int([i for i in self._lines if "alpha electrons" in i][0].split()[0])
-        self._n_beta = int([i for i in self._lines if "alpha electrons" in i][0].split()[3])
+
+        try:
+            self._index = self._build_index()
+            self._keywords = self._get_keywords()
+
+            # extract boolean attributes from keywords
+            self._raman = any('raman' in s.lower() for s in self._keywords)
+            self._freq = any('freq' in s.lower() for s in self._keywords)
+            self._opt = any('opt' in s.lower() for s in self._keywords)
+            self._stable = any('stable' in s.lower() for s in self._keywords)
+            self._pop = any('pop' in s.lower() for s in self._keywords)
+            self._solvent = any('scrf' in s.lower() for s in self._keywords)
+
+            # extract boolean attributes from the log file
+            self._complete = any(i >= len(self._lines) - 20 for i in self._index['Normal termination of'])
+            self._esp = len(self._index['ESP charges']) > 0
+
+            # extract non-boolean attributes from the keywords
+            self._functional = [k for k in self._keywords if "/" in k][0].split("/")[0].upper()
+            self._basis = [k for k in self._keywords if "/" in k][0].split("/")[1]
+        except Exception:
+            self.close()
+            raise
+
+        # the orbitals and coordinates are only parsed when they are first requested
+        self._orbitals = None
+        self._coordinates = None
+        self._atom_table = None
+
+    def _parse(self, sections: list[str]):
+        """
+        Function to run parsing steps, in the order of _SECTIONS. The log files are closed if a step fails
+        :param sections: the parsing steps to run
+        :return: None
+        """
+        try:
+            for section in [s for s in self._SECTIONS if s in sections]:
+                getattr(self, f'_parse_{section}')()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse_electrons(self):
+        """ get the number of alpha and beta electrons from the log file """
+        self._n_alpha = int(self._get_marked_lines("alpha electrons")[0].split()[0])
+        self._n_beta = int(self._get_marked_lines("alpha electrons")[0].split()[3])
         self._n_electrons = self._n_alpha + self._n_beta
 
-        # get the charge and multiplicity from the log file
-        if any('Charge =' in c for c in self._lines):
-            self._charge = int([c for c in self._lines if 'Charge =' in c][0][9:].split()[0]) * E_TO_C
-            self._multiplicity = int([m for m in self._lines if 'Charge =' in m][0][27:])
+    def _parse_charge(self):
+        """ get the charge and multiplicity from the log file """
+        if self._index['Charge =']:
+            self._charge = int(self._get_marked_lines('Charge =')[0][9:].split()[0]) * E_TO_C
+            self._multiplicity = int(self._get_marked_lines('Charge =')[0][27:])
         else:
             self._charge = None
             self._multiplicity = None
 
-        # get the energy from the log file
-        if any('SCF Done' in e for e in self._lines):
-            self._energy = float([e for e in self._lines if 'SCF Done' in e][-1].split()[4]) * H_TO_J
-            self._unrestricted = True if [e for e in self._lines if 'SCF Done' in e][-1].split()[2][2] == "U" else False
-            self._scf_iterations = len([e for e in self._lines if 'SCF Done' in e]) - len([e for e in self._lines if '>>>>>>>>>> Convergence criterion not met' in e])
+    def _parse_energy(self):
+        """ get the energy from the log file """
+        if self._index['SCF Done']:
+            scf_line = self._get_marked_lines('SCF Done')[-1]
+            self._energy = float(scf_line.split()[4]) * H_TO_J
+            self._unrestricted = True if scf_line.split()[2][2] == "U" else False
+            self._scf_iterations = len(self._index['SCF Done']) - len(self._index['>>>>>>>>>> Convergence criterion not met'])
         else:
             self._energy = None
             self._unrestricted = None
             self._scf_iterations = None
 
-        # get the atom counts from the log file
-        if any('Mulliken charges' in a for a in self._lines):
-            _mull_start = self._lines.index([k for k in self._lines if 'Mulliken charges' in k][0]) + 2
-            _mull_end = self._lines.index([k for k in self._lines if 'Sum of Mulliken charges' in k][0])
+    def _parse_atoms(self):
+        """ get the atom counts from the log file """
+        if self._index['Mulliken charges']:
+            _mull_start = self._index['Mulliken charges'][0] + 2
+            _mull_end = self._index['Sum of Mulliken charges'][0]
             self._atomcount = _mull_end - _mull_start
             self._atoms = [a.split()[1] for a in self._lines[_mull_start:_mull_end]]
-            self._heavyatoms = [a.split()[1] for a in self._lines[_mull_start:_mull_end] if 'H' not in a]
+            self._heavyatoms = [a for a in self._atoms if a != 'H']
             self._heavyatomcount = len(self._heavyatoms)
         else:
             self._atomcount = None
@@ -76,34 +299,36 @@ class GaussianParser:
             self._heavyatoms = None
             self._heavyatomcount = None
 
-        # Get the stability report from the log file
-        if " The wavefunction is stable under the perturbations considered.\n" in self._lines:
+    def _parse_stability(self):
+        """ Get the stability report from the log file """
+        stability_lines = self._get_marked_lines('The wavefunction')
+        if " The wavefunction is stable under the perturbations considered.\n" in stability_lines:
             self._stable = "stable"
-        elif " The wavefunction has an internal instability.\n" in self._lines:
+        elif " The wavefunction has an internal instability.\n" in stability_lines:
             self._stable = "internal instability"
-        elif " The wavefunction has an RHF -> UHF instability.\n" in self._lines:
+        elif " The wavefunction has an RHF -> UHF instability.\n" in stability_lines:
             self._stable = "RHF instability"
         else:
             self._stable = "untested"
 
-        # Get the orbitals from the log file
-        self._orbitals = self._get_orbitals()
-        self._homo = self._orbitals.query('occupied == True').query('energy == energy.max()')['energy'].iloc[0]
-        self._lumo = self._orbitals.query('occupied == False').query('energy == energy.min()')['energy'].iloc[0]
-        self._bandgap = self._lumo - self._homo
+    def _parse_orbitals(self):
+        """ Check the log file has orbitals, which are only parsed when they are first requested """
+        if len(self._index['Population analysis using the SCF Density']) == 0:
+            raise ValueError("This log file doesnt have molecular orbital data in it")
 
-        # get the thermochemistry properties
+    def _parse_thermochemistry(self):
+        """ get the thermochemistry properties """
         if self._freq is True:
             self._thermal_energy_corrections = {
-                'zero_point_correction': float([line for line in self._lines if "Zero-point correction" in line][0].split()[2]) * H_TO_J,
-                'thermal_correction_to_energy': float([line for line in self._lines if "Thermal correction to Energy=" in line][0].split()[4]) * H_TO_J,
-                'thermal_correction_to_enthalpy': float([line for line in self._lines if "Thermal correction to Enthalpy=" in line][0].split()[4]) * H_TO_J,
-                'thermal_correction_to_free_energy': float([line for line in self._lines if "Thermal correction to Gibbs Free Energy=" in line][0].split()[6]) * H_TO_J,
-                'sum_of_electronic_and_zp_energies': float([line for line in self._lines if "Sum of electronic and zero-point Energies=" in line][0].split()[6]) * H_TO_J,
-                'sum_of_electronic_and_thermal_energies': float([line for line in self._lines if "Sum of electronic and thermal Energies=" in line][0].split()[6]) * H_TO_J,
-                'sum_of_electronic_and_thermal_enthalpies': float([line for line in self._lines if "Sum of electronic and thermal Enthalpies=" in line][0].split()[6]) * H_TO_J
+                'zero_point_correction': float(self._get_marked_lines("Zero-point correction")[0].split()[2]) * H_TO_J,
+                'thermal_correction_to_energy': float(self._get_marked_lines("Thermal correction to Energy=")[0].split()[4]) * H_TO_J,
+                'thermal_correction_to_enthalpy': float(self._get_marked_lines("Thermal correction to Enthalpy=")[0].split()[4]) * H_TO_J,
+                'thermal_correction_to_free_energy': float(self._get_marked_lines("Thermal correction to Gibbs Free Energy=")[0].split()[6]) * H_TO_J,
+                'sum_of_electronic_and_zp_energies': float(self._get_marked_lines("Sum of electronic and zero-point Energies=")[0].split()[6]) * H_TO_J,
+                'sum_of_electronic_and_thermal_energies': float(self._get_marked_lines("Sum of electronic and thermal Energies=")[0].split()[6]) * H_TO_J,
+                'sum_of_electronic_and_thermal_enthalpies': float(self._get_marked_lines("Sum of electronic and thermal Enthalpies=")[0].split()[6]) * H_TO_J
             }
-            self._free_energy = float([line for line in self._lines if "Sum of electronic and thermal Free Energies=" in line][0].split()[7]) * H_TO_J
+            self._free_energy = float(self._get_marked_lines("Sum of electronic and thermal Free Energies=")[0].split()[7]) * H_TO_J
 
     @property
     def thermal_energy_corrections(self) -> dict:
@@ -125,6 +350,7 @@ class GaussianParser:
         Function to return the orbitals as a dataframe
         """
         return (self
+                ._load_orbitals()
                 ._orbitals
                 .assign(energy = lambda x: x['energy'] * J_TO_EV)
                 )
@@ -134,21 +360,21 @@ class GaussianParser:
         """
         Function to get the HOMO energy with reference to the vacuum level
         """
-        return round(self._homo * J_TO_EV, 5)
+        return round(self._load_orbitals()._homo * J_TO_EV, 5)
     
     @property
     def lumo(self) -> float:
         """
         Function to get the LUMO energy with reference to the vacuum level
         """
-        return round(self._lumo * J_TO_EV, 5)
+        return round(self._load_orbitals()._lumo * J_TO_EV, 5)
 
     @property
     def bandgap(self) -> float:
         """
         Function to get the band gap from the log file
         """
-        return round(self._bandgap * J_TO_EV, 5)
+        return round(self._load_orbitals()._bandgap * J_TO_EV, 5)
 
     @property
     def n_alpha(self) -> int:
@@ -252,27 +478,161 @@ class GaussianParser:
     @property
     def atomcount(self) -> int:
         return self._atomcount
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Function to release the memory maps of the log files. Properties which are already parsed can still be read,
+        but anything which needs to read the log file again, such as the orbitals, cannot
+        :return: None
+        """
+        self._lines.close()
+
+    @classmethod
+    def bulk(cls, paths: list[str | list[str]] | pd.Series, fields: list[str] = ('energy',), workers: int = None,
+             cache: str = None) -> pd.DataFrame:
+        """
+        Function to parse a collection of log files in a process pool and collect properties from each of them into one
+        dataframe, with a row for each log file. A log file which fails to parse does not stop the others; its fields
+        are left empty and the exception is reported in the error column. Fields which are not available for a log
+        file, such as the free energy of a calculation without frequencies, are left empty. Only the parts of each log
+        file needed by the requested fields are parsed.
+        :param paths: the log files to parse. Each entry can be a path, or a list of paths for a restarted calculation
+        :param fields: the names of the GaussianParser properties to collect, for example ['energy', 'homo', 'lumo']
+        :param workers: the number of processes to use. If 1, the files are parsed in this process
+        :param cache: path to a manifest file storing the results. Log files which have not changed since they were last
+        parsed are not parsed again
+        :return: dataframe with a log_file column, a column for each field and an error column
+        """
+        fields = list(fields)
+        sections = cls._get_field_sections(fields)
+
+        paths = [tuple(p) if type(p) in [list, tuple, pd.Series] else p for p in paths]
+        manifest = pd.read_pickle(cache) if cache is not None and os.path.exists(cache) else {}
+        signatures = [cls._get_file_signature(p) for p in paths]
+
+        results = {}
+        to_parse = []
+        for p, signature in zip(paths, signatures):
+            entry = manifest.get(signature)
+            if entry is not None and all(f in entry for f in fields):
+                results[p] = {f: entry[f] for f in fields} | {'error': None}
+            else:
+                to_parse.append(p)
+
+        if workers == 1:
+            parsed = [cls._get_fields(p, fields, sections) for p in to_parse]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parsed = list(executor.map(cls._get_fields, to_parse, [fields] * len(to_parse), [sections] * len(to_parse)))
+
+        for p, result in zip(to_parse, parsed):
+            results[p] = result
+
+        if cache is not None:
+            for p, signature in zip(paths, signatures):
+                if results[p]['error'] is None:
+                    manifest[signature] = manifest.get(signature, {}) | {f: results[p][f] for f in fields}
+            pd.to_pickle(manifest, cache)
+
+        return pd.DataFrame([
+            {'log_file': list(p) if type(p) == tuple else p} | results[p] for p in paths
+        ], columns=['log_file'] + fields + ['error'])
+
+    @staticmethod
+    def _get_file_signature(path: str | tuple[str]) -> tuple:
+        """
+        Function to get a signature of one or more log files, from their absolute paths, sizes and modification times,
+        which changes if any of the files change
+        :param path: path or tuple of paths to the log files
+        :return: the signature
+        """
+        path = (path,) if type(path) == str else path
+        try:
+            return tuple((os.path.abspath(p), os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in path)
+        except OSError:
+            return tuple((os.path.abspath(p), None, None) for p in path)
+
+    @classmethod
+    def _get_field_sections(cls, fields: list[str]) -> list[str]:
+        """
+        Function to check the requested fields are properties of the parser and get the parsing steps they need
+        :param fields: the names of the properties
+        :return: the parsing steps, in the order of _SECTIONS
+        """
+        for f in fields:
+            if not isinstance(getattr(cls, f, None), property):
+                raise ValueError(f"{f} is not a property of a GaussianParser")
+
+        return [s for s in cls._SECTIONS if any(s in cls._FIELD_SECTIONS.get(f, []) for f in fields)]
+
+    @classmethod
+    def _get_field(cls, parser: 'GaussianParser', field: str):
+        """
+        Function to get a property from a parser. Optional properties which the calculation did not compute are None,
+        and any other error is raised
+        :param parser: the parser
+        :param field: the name of the property
+        :return: the value of the property
+        """
+        try:
+            return getattr(parser, field)
+        except AttributeError:
+            if field in cls._OPTIONAL_FIELDS:
+                return None
+            raise
+
+    @classmethod
+    def _get_fields(cls, path: str | tuple[str], fields: list[str], sections: list[str]) -> dict:
+        """
+        Function to parse a log file and get the requested properties from it, catching any errors. Only the parsing
+        steps needed by the requested properties are run
+        :param path: path or tuple of paths to the log files
+        :param fields: the names of the properties
+        :param sections: the parsing steps to run
+        :return: dict of the properties, with an error entry which is None if the parsing succeeded
+        """
+        try:
+            with cls._from_sections(list(path) if type(path) == tuple else path, sections) as parser:
+                return {f: cls._get_field(parser, f) for f in fields} | {'error': None}
+        except Exception as e:
+            return {f: None for f in fields} | {'error': f"{type(e).__name__}: {e}"}
     
-    def _concatenate_log_files(self, log_file: list[str] | tuple[str] | pd.Series | str) -> tuple[list[str], bool, dt.DateTime]:
+    def _load_orbitals(self):
         """
-        function to concatenate log files
+        Function to parse the orbitals from the log file the first time they are needed
+        :return: self
+        """
+        if self._orbitals is None:
+            self._orbitals = self._get_orbitals()
+            self._homo = self._orbitals.query('occupied == True').query('energy == energy.max()')['energy'].iloc[0]
+            self._lumo = self._orbitals.query('occupied == False').query('energy == energy.min()')['energy'].iloc[0]
+            self._bandgap = self._lumo - self._homo
+        return self
+
+    def _concatenate_log_files(self, log_file: list[str] | tuple[str] | pd.Series | str) -> tuple[LogLines, bool, dt.DateTime]:
+        """
+        function to concatenate log files into a chained view of their lines, ordered by their time stamps
         :return:
         """
         # If the file passed is just a string
         if type(log_file) == str:
-            lines = [line for line in open(log_file, 'r')]
+            lines = LogLines(log_file)
             restart = False
             time_stamp = self._get_time_stamp(log_file)
 
         # If a list or tuple of log files is passed
         elif (type(log_file) == list or type(log_file) == tuple or type(log_file) == pd.Series):
             log_file_dict = {}
-            lines = []
             for l in log_file:
                 time_stamp = self._get_time_stamp(l)
                 log_file_dict[time_stamp] = l
-            for key, value in sorted(log_file_dict.items()):
-                lines = lines + [line for line in open(value, 'r')]
+            lines = LogLines([value for key, value in sorted(log_file_dict.items())])
             restart = True
             time_stamp = min(log_file_dict)
         else:
@@ -281,22 +641,33 @@ class GaussianParser:
         return lines, restart, time_stamp
     
     @staticmethod
-    def _get_time_stamp(log_file):
+    def _get_time_stamp(log_file, tail_bytes: int = 8192):
         """ 
-        Function to read the contents of a log file, and from that get the line containing Leave Link and construct the time stamp from that line
+        Function to get the first line containing Leave Link in a log file and construct the time stamp from that line. 
+        If there is no Leave Link line, then the Normal termination line in the last 20 lines of the file is used. The
+        file is memory mapped and searched for the first match, so only the lines up to it and the tail are read.
+        :param log_file: path to the log file
+        :param tail_bytes: number of bytes to read from the end of the file
         """
-        with open(log_file, 'r') as f:
-            lines = f.readlines()
+        with open(log_file, 'rb') as f:
+            time_line = None
+            if f.seek(0, 2) > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    position = data.find(b'Leave Link ')
+                    end = data.find(b'\n', position) if position >= 0 else -1
+                    if end >= 0:
+                        time_line = data[data.rfind(b'\n', 0, position) + 1:end + 1].decode('utf-8', errors='replace')
+            f.seek(max(f.seek(0, 2) - tail_bytes, 0))
+            lines = f.read().decode('utf-8', errors='replace').splitlines()[-20:]
         
-        if any('Leave Link ' in l for l in lines):
-            time_line = [l for l in lines if 'Leave Link ' in l][0]
+        if time_line is not None:
             year = time_line.split()[8][:-1]
             month = time_line.split()[5]
             day = time_line.split()[6]
             time = time_line.split()[7]
             time_stamp = dt.DateTime(year + '-' + month + '-' + day + ' ' + time)
         elif any('Normal termination of' in l for l in lines):
-            time_line = [l for l in lines[-20:] if 'Normal termination of' in l][0]
+            time_line = [l for l in lines if 'Normal termination of' in l][0]
             year = time_line.split()[10][:-1]
             month = time_line.split()[7]
             day = time_line.split()[8]
@@ -307,13 +678,47 @@ class GaussianParser:
 
         return time_stamp
 
+    def _build_index(self) -> dict[str, list[int]]:
+        """
+        Function to scan the log file once and record the numbers of the lines containing each of the markers in
+        _MARKERS, so that sections of the log file can be found without searching through all the lines again
+        :return: dict with the marker as the key and a list of the line numbers containing it as the value
+        """
+        pattern = re.compile(b'|'.join(re.escape(m.encode()) for m in self._MARKERS))
+        index = {m: [] for m in self._MARKERS}
+
+        for i in self._lines.find(pattern).tolist():
+            line = self._lines[i]
+            for m in self._MARKERS:
+                if m in line:
+                    index[m].append(i)
+
+        return index
+
+    def _get_marked_lines(self, marker: str) -> list[str]:
+        """
+        Function to get the lines of the log file containing a marker
+        :param marker: the marker, which must be in _MARKERS
+        :return: list of the lines
+        """
+        return [self._lines[i] for i in self._index[marker]]
+
+    def _get_last_repeat(self, marker: str) -> int:
+        """
+        Function to get the line number of the last line which is identical to the first line containing a marker. This
+        finds the last time a section with that header is printed, for example in the last step of an optimisation.
+        :param marker: the marker, which must be in _MARKERS
+        :return: the line number
+        """
+        first_line = self._lines[self._index[marker][0]]
+        return [i for i in self._index[marker] if self._lines[i] == first_line][-1]
+
     def _get_keywords(self):
         """
         Function to extract the keywords from self._lines
         :return:
         """
-        star_value = [i for i in self._lines if "****" in i][0]
-        index = self._lines.index(star_value)
+        index = self._index['****'][0]
         temp_lines = self._lines[index+4:index+20]
         dash_value = [i for i in temp_lines if "--------" in i][0]
         index = temp_lines.index(dash_value)
@@ -338,8 +743,8 @@ class GaussianParser:
         if self._opt is False:
             raise ValueError("Your log file needs to be from an optimisation")
 
-        scf_to_ignore = [i + 2 for i, line in enumerate(self._lines) if '>>>>>>>>>> Convergence criterion not met' in line]
-        scf_lines = [line for i, line in enumerate(self._lines) if i not in scf_to_ignore and 'SCF Done' in line]
+        scf_to_ignore = set(i + 2 for i in self._index['>>>>>>>>>> Convergence criterion not met'])
+        scf_lines = [self._lines[i] for i in self._index['SCF Done'] if i not in scf_to_ignore]
 
         data = (pd
                 .DataFrame({
@@ -361,11 +766,11 @@ class GaussianParser:
         :return:
         """
         if self._opt is False:
-            start_line = len(self._lines) - (self._lines[::-1].index([k for k in self._lines if '!    Initial Parameters    !' in k][0]) - 4)
-            end_line = len(self._lines) - self._lines[::-1].index([k for k in self._lines if 'Trust Radius=' in k][0]) + 2
+            start_line = self._get_last_repeat('!    Initial Parameters    !') + 5
+            end_line = self._get_last_repeat('Trust Radius=') + 3
         else:
-            start_line = len(self._lines) - (self._lines[::-1].index([k for k in self._lines if '!   Optimized Parameters   !' in k][0]) - 4)
-            end_line = len(self._lines) - (self._lines[::-1].index([k for k in self._lines if 'Largest change from initial coordinates is atom' in k][0]) + 2)
+            start_line = self._get_last_repeat('!   Optimized Parameters   !') + 5
+            end_line = self._get_last_repeat('Largest change from initial coordinates is atom') - 1
 
         bond_lines = [r for r in self._lines[start_line:end_line] if '! R' in r]
 
@@ -387,7 +792,7 @@ class GaussianParser:
         Function to get the spin contamination from a log file
         :return: pandas data frame of the spin contamination
         """
-        contamination_lines = [s for s in self._lines if "S**2 before annihilation" in s]
+        contamination_lines = self._get_marked_lines("S**2 before annihilation")
         data = pd.DataFrame({
             'iteration': [i for i in range(len(contamination_lines))],
             'before_annihilation': [float(s.split()[3][:-1]) for s in contamination_lines],
@@ -395,37 +800,93 @@ class GaussianParser:
         })
         return data
 
-    def get_bonds_from_coordinates(self, cutoff: float = 1.8, heavy_atoms: bool = False, scf_iteration: int = -1):
+    def get_bonds_from_coordinates(self, cutoff: float = 1.8, heavy_atoms: bool = False, scf_iteration: int = -1,
+                                   covalent: bool = False, tolerance: float = 0.45) -> pd.DataFrame:
         """
         function to get bond data from the coordinates, using a cut-off distance
         :param cutoff: The cutoff for calculating the bond lengths
         :param heavy_atoms: just get the bonds involving heavy atoms
-        :param pre_optimisation: get the coordinated before the optimisation has begun?
+        :param scf_iteration: get the bonds at this scf iteration. If 0, then before optimisation has begun
+        :param covalent: if True, use a cutoff for each pair of elements of the sum of their covalent radii plus the
+        tolerance, instead of a single cutoff
+        :param tolerance: the tolerance added to the sum of the covalent radii
         :return:
         """
-        coordinates = self.get_coordinates(heavy_atoms=heavy_atoms, scf_iteration=scf_iteration)
-
-        cross = (coordinates
-                 .merge(coordinates, how='cross', suffixes=('_1', '_2'))
-                 .assign(dx=lambda x: x['x_2'] - x['x_1'])
-                 .assign(dy=lambda x: x['y_2'] - x['y_1'])
-                 .assign(dz=lambda x: x['z_2'] - x['z_1'])
-                 .assign(length=lambda x: (x['dx'].pow(2) + x['dy'].pow(2) + x['dz'].pow(2)).pow(0.5))
-                 .query('length < @cutoff')
-                 .query('length > 0')
-                 .filter(items=['atom_id_1', 'atom_id_2', 'length'])
-                 .reset_index(drop=True)
-                 .round(4)
-                 )
+        coordinates = self._get_all_coordinates()[[scf_iteration]][:, self._get_atom_mask(heavy_atoms), :]
 
-        cross[['atom_id_1', 'atom_id_2']] = np.sort(cross[['atom_id_1', 'atom_id_2']].to_numpy(), axis=1)
+        return (self
+                ._find_bonds(coordinates, heavy_atoms=heavy_atoms, cutoff=cutoff, covalent=covalent, tolerance=tolerance)
+                .drop(columns='iteration')
+                )
 
-        data = (cross
-                .groupby(['atom_id_1', 'atom_id_2'])
-                .agg(length=('length', 'first'))
-                .reset_index()
-                .assign(element_1=lambda x: [self._atoms[i - 1] for i in x['atom_id_1']])
-                .assign(element_2=lambda x: [self._atoms[i - 1] for i in x['atom_id_2']])
+    def get_bonds_through_scf(self, cutoff: float = 1.8, heavy_atoms: bool = False, covalent: bool = False,
+                              tolerance: float = 0.45) -> pd.DataFrame:
+        """
+        function to get the bonds from the coordinates at every scf iteration, to track bonds forming or breaking
+        through an optimisation
+        :param cutoff: The cutoff for calculating the bond lengths
+        :param heavy_atoms: just get the bonds involving heavy atoms
+        :param covalent: if True, use a cutoff for each pair of elements of the sum of their covalent radii plus the
+        tolerance, instead of a single cutoff
+        :param tolerance: the tolerance added to the sum of the covalent radii
+        :return:
+        """
+        if self.opt is False:
+            raise ValueError("This log file needs to be from an optimisation")
+
+        coordinates = self.get_coordinate_array(heavy_atoms=heavy_atoms)
+        return self._find_bonds(coordinates, heavy_atoms=heavy_atoms, cutoff=cutoff, covalent=covalent, tolerance=tolerance)
+
+    def _find_bonds(self, coordinates: np.ndarray, heavy_atoms: bool, cutoff: float, covalent: bool,
+                    tolerance: float) -> pd.DataFrame:
+        """
+        function to find the bonds in one or more frames of coordinates with a KD-tree. The frames are placed apart from
+        each other in space so that the bonds in all of them are found with a single tree.
+        :param coordinates: array with shape (number of frames, number of atoms, 3)
+        :param heavy_atoms: whether the coordinates are just for the heavy atoms
+        :param cutoff: the cutoff for calculating the bond lengths
+        :param covalent: whether to use cutoffs from the covalent radii
+        :param tolerance: the tolerance added to the sum of the covalent radii
+        :return: dataframe with the iteration, atom ids, bond length and elements of each bond
+        """
+        mask = self._get_atom_mask(heavy_atoms)
+        atom_ids = np.arange(1, self._atomcount + 1)[mask]
+        elements = np.array(self._atoms, dtype=object)[mask]
+        n_frames, n_atoms = coordinates.shape[0], coordinates.shape[1]
+
+        if covalent is True:
+            if any(e not in COVALENT_RADII for e in elements):
+                raise ValueError("There is no covalent radius for some of the elements in this log file")
+            radii = np.array([COVALENT_RADII[e] for e in elements])
+            search_radius = 2 * radii.max() + tolerance
+        else:
+            search_radius = cutoff
+
+        spacing = np.ptp(coordinates, axis=(0, 1)).max() + 2 * search_radius if coordinates.size > 0 else 0
+        shifted = coordinates + (np.arange(n_frames) * spacing)[:, None, None] * np.array([1, 0, 0])
+        pairs = cKDTree(shifted.reshape(-1, 3)).query_pairs(search_radius, output_type='ndarray')
+        pairs = np.sort(pairs, axis=1)
+
+        frame = pairs[:, 0] // n_atoms
+        atom_1, atom_2 = pairs[:, 0] % n_atoms, pairs[:, 1] % n_atoms
+        flat = coordinates.reshape(-1, 3)
+        length = ((flat[pairs[:, 1]] - flat[pairs[:, 0]]) ** 2).sum(axis=1) ** 0.5
+
+        if covalent is True:
+            keep = (length < radii[atom_1] + radii[atom_2] + tolerance) & (length > 0)
+        else:
+            keep = (length < cutoff) & (length > 0)
+
+        data = (pd.DataFrame({
+                    'iteration': frame[keep],
+                    'atom_id_1': atom_ids[atom_1[keep]],
+                    'atom_id_2': atom_ids[atom_2[keep]],
+                    'length': length[keep].round(4),
+                    'element_1': elements[atom_1[keep]],
+                    'element_2': elements[atom_2[keep]]
+                })
+                .sort_values(['iteration', 'atom_id_1', 'atom_id_2'])
+                .reset_index(drop=True)
                 )
 
         return data
@@ -439,13 +900,70 @@ class GaussianParser:
         if self.opt is False:
             raise ValueError("This log file needs to be from an optimisation")
 
-        data = pd.DataFrame()
-        for i in range(self._scf_iterations):
-            new_data = self.get_coordinates(heavy_atoms=heavy_atoms, scf_iteration=i).assign(iteration=i)
-            data = pd.concat([data, new_data])
+        coordinates = self.get_coordinate_array(heavy_atoms=heavy_atoms)
+        n_iterations, n_atoms = coordinates.shape[0], coordinates.shape[1]
+        atom_ids = np.arange(1, self._atomcount + 1)[self._get_atom_mask(heavy_atoms)]
+
+        data = pd.DataFrame({
+            'atom_id': np.tile(atom_ids, n_iterations),
+            'element': np.tile(np.array(self._atoms, dtype=object)[self._get_atom_mask(heavy_atoms)], n_iterations),
+            'x': coordinates[:, :, 0].ravel(),
+            'y': coordinates[:, :, 1].ravel(),
+            'z': coordinates[:, :, 2].ravel(),
+            'iteration': np.repeat(np.arange(n_iterations), n_atoms)
+        }, index=np.tile(atom_ids - 1, n_iterations))
 
         return data
 
+    def get_coordinate_array(self, heavy_atoms: bool = False) -> np.ndarray:
+        """
+        function to get the coordinates through the SCF iterations as an array
+        :param heavy_atoms: just get the heavy atoms?
+        :return: array with shape (number of scf iterations, number of atoms, 3)
+        """
+        return self._get_all_coordinates()[:self._scf_iterations, self._get_atom_mask(heavy_atoms), :]
+
+    def _get_all_coordinates(self) -> np.ndarray:
+        """
+        function to parse every standard orientation block in the log file in one pass, the first time the coordinates
+        are needed. Blocks without a complete row for every atom, such as the last block of a log file from a
+        calculation which is still running or was killed, are skipped
+        :return: array with shape (number of complete orientation blocks, number of atoms, 3)
+        """
+        if self._coordinates is None:
+            blocks = [self._get_orientation_block(i + 5) for i in self._index['Standard orientation:']]
+            self._coordinates = np.array([b for b in blocks if b is not None], dtype=float).reshape(-1, self._atomcount, 3)
+
+        return self._coordinates
+
+    def _get_orientation_block(self, start: int) -> np.ndarray:
+        """
+        function to parse the coordinates from one standard orientation block
+        :param start: the index of the first line of the block
+        :return: array with shape (number of atoms, 3), or None if the block does not have a numeric row of six fields
+        for every atom
+        """
+        rows = [line.split() for line in self._lines[start:start + self._atomcount]]
+
+        if len(rows) != self._atomcount or any(len(row) != 6 for row in rows):
+            return None
+
+        try:
+            return np.array(rows, dtype=float)[:, 3:]
+        except ValueError:
+            return None
+
+    def _get_atom_mask(self, heavy_atoms: bool = False) -> np.ndarray:
+        """
+        function to get a boolean mask of the atoms to include
+        :param heavy_atoms: just include the heavy atoms?
+        :return: the mask
+        """
+        if heavy_atoms is True:
+            return np.array([a != 'H' for a in self._atoms])
+        else:
+            return np.ones(self._atomcount, dtype=bool)
+
     def get_coordinates(self, heavy_atoms: bool = False, scf_iteration: int = -1) -> pd.DataFrame:
         """
         function to get the coordinates from the log file
@@ -453,16 +971,14 @@ class GaussianParser:
         :param scf_interation: get the coordinates at this scf iteration. If 0, then before optimisation has begun
         :return:
         """
-        indices = [i for i, line in enumerate(self._lines) if 'Standard orientation:' in line]
-        start_line = indices[scf_iteration] + 5
-        end_line = start_line + self._atomcount
+        coordinates = self._get_all_coordinates()[scf_iteration]
 
         data = (pd.DataFrame({
             'atom_id': [i for i in range(1, self._atomcount + 1)],
             'element': self._atoms,
-            'x': [float(a.split()[3]) for a in self._lines[start_line:end_line]],
-            'y': [float(a.split()[4]) for a in self._lines[start_line:end_line]],
-            'z': [float(a.split()[5]) for a in self._lines[start_line:end_line]]
+            'x': coordinates[:, 0],
+            'y': coordinates[:, 1],
+            'z': coordinates[:, 2]
         }))
 
         if heavy_atoms is False:
@@ -470,89 +986,142 @@ class GaussianParser:
         elif heavy_atoms is True:
             return data.query("element != 'H'")
 
-    def get_mulliken_charges(self, heavy_atoms: bool = False, with_coordinates: bool = False, **kwargs) -> pd.DataFrame:
+    def get_atom_properties(self, heavy_atoms: bool = False, scf_iteration: int = -1) -> pd.DataFrame:
         """
-        method to return the mulliken charges from the log file
-        :param heavy_atoms: whether to give the heavy atoms or all the atoms
-        :param with_coordinates: whether to also output coordinates
-        :return:
+        method to return a table of the properties of each atom, with the element, coordinates, mulliken charge,
+        mulliken spin density and ESP charge. Spin densities are 0 if there are none in the log file, and ESP charges are
+        empty if there are none in the log file.
+        :param heavy_atoms: whether to give the heavy atoms, with the properties of the hydrogens summed into them
+        :param scf_iteration: get the coordinates at this scf iteration. If 0, then before optimisation has begun
+        :return: pandas dataframe with a row for each atom
         """
-        start_line = len(self._lines) - self._lines[::-1].index([k for k in self._lines if 'Mulliken charges' in k][0]) + 1
-        end_line = start_line + self._atomcount
-        
-        if heavy_atoms is False:
-            data = pd.DataFrame({
-                "atom_id": [int(a.split()[0]) for a in self._lines[start_line:end_line]],
-                "element": [a.split()[1] for a in self._lines[start_line:end_line]],
-                "partial_charge": [float(a.split()[2]) for a in self._lines[start_line:end_line]]
-            })
-        else:
-            start_line = start_line + self._atomcount + 3
-            end_line = start_line + self._heavyatomcount
-            data = pd.DataFrame({
-                "atom_id": [int(a.split()[0]) for a in self._lines[start_line:end_line]],
-                "element": [a.split()[1] for a in self._lines[start_line:end_line]],
-                "partial_charge": [float(a.split()[2]) for a in self._lines[start_line:end_line]]
-            })
+        table = self._get_atom_table()
+        columns = ['mulliken_charge', 'spin_density', 'esp_charge']
 
-        if with_coordinates is True:
-            data = (data.assign(
-                x=self.get_coordinates(heavy_atoms=heavy_atoms, **kwargs)['x'].to_list(),
-                y=self.get_coordinates(heavy_atoms=heavy_atoms, **kwargs)['y'].to_list(),
-                z=self.get_coordinates(heavy_atoms=heavy_atoms, **kwargs)['z'].to_list()
-            ))
+        if heavy_atoms is True:
+            table = (table
+                     .query('heavy_atom == True')
+                     .drop(columns=columns)
+                     .rename(columns={c + '_summed': c for c in columns})
+                     .reset_index(drop=True)
+                     )
 
-        return data
-    
-    def get_mulliken_spin_densities(self, heavy_atoms: bool = False, with_coordinates: bool = False, **kwargs) -> pd.DataFrame:
+        if scf_iteration != -1:
+            coordinates = self._get_all_coordinates()[scf_iteration][self._get_atom_mask(heavy_atoms)]
+            table = table.assign(x=coordinates[:, 0], y=coordinates[:, 1], z=coordinates[:, 2])
+
+        return table.filter(['atom_id', 'element', 'heavy_atom', 'x', 'y', 'z'] + columns)
+
+    def _get_atom_table(self) -> pd.DataFrame:
         """
-        method to return the mulliken spin densities from the log file
-        :param heavy_atoms: whether to give the heavy atoms or all the atoms
-        :param with_coordinates: whether to also output coordinates
-        :return: pandas dataframe with the spin densities
+        method to build the table of atom properties from the indexed sections of the log file, the first time it is
+        needed. The columns ending in _summed are the properties with the hydrogens summed into the heavy atoms.
+        :return: pandas dataframe with a row for each atom
         """
-        # check whether spin density information is in the log file
-        if any('Mulliken charges and spin densities:' in s for s in self._lines) is False:
-            spins = False
-        else:
-            spins = True
+        if self._atom_table is not None:
+            return self._atom_table
 
-        start_line = len(self._lines) - self._lines[::-1].index([k for k in self._lines if 'Mulliken charges and spin densities:' in k][0]) + 1
-        end_line = start_line + self._atomcount
+        heavy = self._get_atom_mask(heavy_atoms=True)
+        table = pd.DataFrame({
+            'atom_id': np.arange(1, self._atomcount + 1),
+            'element': self._atoms,
+            'heavy_atom': heavy
+        })
 
-        if heavy_atoms is False:
-            data = pd.DataFrame({
-                "atom_id": [int(a.split()[0]) for a in self._lines[start_line:end_line]],
-                "element": [a.split()[1] for a in self._lines[start_line:end_line]]
-            })
+        if len(self._index['Standard orientation:']) > 0:
+            coordinates = self._get_all_coordinates()[-1]
+            table = table.assign(x=coordinates[:, 0], y=coordinates[:, 1], z=coordinates[:, 2])
+        else:
+            table = table.assign(x=np.nan, y=np.nan, z=np.nan)
 
-            if spins == True:
-                data = data.assign(spin_density=[float(a.split()[3]) for a in self._lines[start_line:end_line]])
-            else:
-                data = data.assign(spin_density = 0)
+        mulliken_start = self._get_last_repeat('Mulliken charges') + 2
+        mulliken, mulliken_summed = self._get_atom_blocks(mulliken_start)
+        table = (table
+                 .assign(mulliken_charge=mulliken[:, 2].astype(float))
+                 .assign(mulliken_charge_summed=self._spread_heavy(mulliken_summed[:, 2].astype(float), heavy))
+                 )
 
+        if len(self._index['Mulliken charges and spin densities:']) > 0:
+            spin_start = self._get_last_repeat('Mulliken charges and spin densities:') + 2
+            spins, spins_summed = self._get_atom_blocks(spin_start)
+            table = (table
+                     .assign(spin_density=spins[:, 3].astype(float))
+                     .assign(spin_density_summed=self._spread_heavy(spins_summed[:, 3].astype(float), heavy))
+                     )
         else:
-            start_line = start_line + self._atomcount + 3
-            end_line = start_line + self._heavyatomcount
-            data = pd.DataFrame({
-                "atom_id": [int(a.split()[0]) for a in self._lines[start_line:end_line]],
-                "element": [a.split()[1] for a in self._lines[start_line:end_line]]
-            })
-
-            if spins == True:
-                data = data.assign(spin_density=[float(a.split()[3]) for a in self._lines[start_line:end_line]])
-            else:
-                data = data.assign(spin_density = 0)
+            table = table.assign(spin_density=0, spin_density_summed=0)
+
+        if self._esp is True:
+            esp_start = self._get_last_repeat('ESP charges') + 2
+            esp, esp_summed = self._get_atom_blocks(esp_start)
+            table = (table
+                     .assign(esp_charge=esp[:, 2].astype(float))
+                     .assign(esp_charge_summed=self._spread_heavy(esp_summed[:, 2].astype(float), heavy))
+                     )
+        else:
+            table = table.assign(esp_charge=np.nan, esp_charge_summed=np.nan)
+
+        self._atom_table = table
+        return self._atom_table
+
+    def _get_atom_blocks(self, start_line: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        method to split the lines of a block of atom properties, and the block following it with the hydrogens summed
+        into the heavy atoms
+        :param start_line: the first line of the block
+        :return: arrays of the split lines of the two blocks, with a row for each atom
+        """
+        summed_start = start_line + self._atomcount + 3
+        block = np.array([a.split() for a in self._lines[start_line:start_line + self._atomcount]])
+        summed = np.array([a.split() for a in self._lines[summed_start:summed_start + self._heavyatomcount]])
+        return block, summed
+
+    @staticmethod
+    def _spread_heavy(values: np.ndarray, heavy: np.ndarray) -> np.ndarray:
+        """
+        method to place values for the heavy atoms into an array for all the atoms, leaving the hydrogens empty
+        :param values: the values for the heavy atoms
+        :param heavy: boolean mask of the heavy atoms
+        :return: array with a value for each atom
+        """
+        spread = np.full(len(heavy), np.nan)
+        spread[heavy] = values
+        return spread
+
+    def _get_atom_columns(self, columns: dict, heavy_atoms: bool, with_coordinates: bool, **kwargs) -> pd.DataFrame:
+        """
+        method to project the table of atom properties onto some of its columns
+        :param columns: dict of the columns to take, with their new names
+        :param heavy_atoms: whether to give the heavy atoms or all the atoms
+        :param with_coordinates: whether to also output the x,y,z coordinates
+        :return: pandas dataframe
+        """
+        table = self.get_atom_properties(heavy_atoms=heavy_atoms, **kwargs)
+        data = table.filter(['atom_id', 'element'] + list(columns)).rename(columns=columns)
 
         if with_coordinates is True:
-            data = (data.assign(
-                x=self.get_coordinates(heavy_atoms=heavy_atoms, **kwargs)['x'].to_list(),
-                y=self.get_coordinates(heavy_atoms=heavy_atoms, **kwargs)['y'].to_list(),
-                z=self.get_coordinates(heavy_atoms=heavy_atoms, **kwargs)['z'].to_list()
-            ))
+            data = data.assign(x=table['x'], y=table['y'], z=table['z'])
 
         return data
 
+    def get_mulliken_charges(self, heavy_atoms: bool = False, with_coordinates: bool = False, **kwargs) -> pd.DataFrame:
+        """
+        method to return the mulliken charges from the log file
+        :param heavy_atoms: whether to give the heavy atoms or all the atoms
+        :param with_coordinates: whether to also output coordinates
+        :return:
+        """
+        return self._get_atom_columns({'mulliken_charge': 'partial_charge'}, heavy_atoms, with_coordinates, **kwargs)
+    
+    def get_mulliken_spin_densities(self, heavy_atoms: bool = False, with_coordinates: bool = False, **kwargs) -> pd.DataFrame:
+        """
+        method to return the mulliken spin densities from the log file
+        :param heavy_atoms: whether to give the heavy atoms or all the atoms
+        :param with_coordinates: whether to also output coordinates
+        :return: pandas dataframe with the spin densities
+        """
+        return self._get_atom_columns({'spin_density': 'spin_density'}, heavy_atoms, with_coordinates, **kwargs)
+
     def get_esp_charges(self, heavy_atoms: bool = False, with_coordinates: bool = False, **kwargs) -> pd.DataFrame:
         """
         method to return the mulliken charges from the log file
@@ -563,32 +1132,7 @@ class GaussianParser:
         if self._esp is False:
             raise ValueError("This gaussian log file doesnt have ESP data in it!")
 
-        start_line = len(self._lines) - self._lines[::-1].index([k for k in self._lines if 'ESP charges' in k][0]) + 1
-        end_line = start_line + self._atomcount
-
-        if heavy_atoms is False:
-            data = pd.DataFrame({
-                "atom_id": [int(a.split()[0]) for a in self._lines[start_line:end_line]],
-                "element": [a.split()[1] for a in self._lines[start_line:end_line]],
-                "partial_charge": [float(a.split()[2]) for a in self._lines[start_line:end_line]]
-            })
-        else:
-            start_line = start_line + self._atomcount + 3
-            end_line = start_line + self._heavyatomcount
-            data = pd.DataFrame({
-                "atom_id": [int(a.split()[0]) for a in self._lines[start_line:end_line]],
-                "element": [a.split()[1] for a in self._lines[start_line:end_line]],
-                "partial_charge": [float(a.split()[2]) for a in self._lines[start_line:end_line] if 'H' not in a]
-            })
-
-        if with_coordinates is True:
-            data = (data.assign(
-                x=self.get_coordinates(heavy_atoms=heavy_atoms, **kwargs)['x'].to_list(),
-                y=self.get_coordinates(heavy_atoms=heavy_atoms, **kwargs)['y'].to_list(),
-                z=self.get_coordinates(heavy_atoms=heavy_atoms, **kwargs)['z'].to_list()
-            ))
-
-        return data
+        return self._get_atom_columns({'esp_charge': 'partial_charge'}, heavy_atoms, with_coordinates, **kwargs)
 
     def get_raman_frequencies(self, frac_filter: float = 1) -> pd.DataFrame:
         """
@@ -602,9 +1146,9 @@ class GaussianParser:
         if frac_filter < 0 or frac_filter > 1:
             raise ValueError("frac_filter must be between 0 and 1!")
 
-        frequencies = [line.split("--")[1].split() for line in self._lines if "Frequencies --" in line]
+        frequencies = [line.split("--")[1].split() for line in self._get_marked_lines("Frequencies --")]
         frequencies = [item for sublist in frequencies for item in sublist]
-        activities = [line.split("--")[1].split() for line in self._lines if "Raman Activ --" in line]
+        activities = [line.split("--")[1].split() for line in self._get_marked_lines("Raman Activ --")]
         activities = [item for sublist in activities for item in sublist]
 
         data = (pd
@@ -624,42 +1168,83 @@ class GaussianParser:
 
         return data
 
-    def get_raman_spectra(self, width: float = 20, wn_min: int = 500, wn_max: int = 2500, wn_step: float = 1, **kwargs):
+    def get_raman_spectra(self, width: float = 20, wn_min: int = 500, wn_max: int = 2500, wn_step: float = 1,
+                          shape: str = 'lorentzian', eta: float = 0.5, fft: bool = False, **kwargs):
         """
         method to get a theoretical spectrum from the gaussian log file
-        :param width: the width of the lorentzian peaks
+        :param width: the width of the peaks
         :param wn_min: the minimum wave number
         :param wn_max: the maximum wave number
         :param wn_step: the number of intervals in the spectrum
+        :param shape: the line shape of the peaks, either 'lorentzian', 'gaussian' or 'pseudo_voigt'
+        :param eta: the fraction of the lorentzian in a pseudo-voigt line shape
+        :param fft: build the spectrum with an FFT convolution, which is faster for fine grids
         :return:
         """
         peaks = self.get_raman_frequencies(**kwargs)
-        wn = [w for w in np.arange(wn_min, wn_max, wn_step)]
-        intensity = [0] * len(wn)
-
-        for index, row in peaks.iterrows():
-            peak = lorentzian(wn, row['frequencies'], width, row['raman_activity'])
-            intensity = [sum(intensity) for intensity in zip(intensity, peak)]
+        wn = np.arange(wn_min, wn_max, wn_step)
+        intensity = broadened_spectrum(wn, peaks['frequencies'], peaks['raman_activity'], width, shape=shape, eta=eta, fft=fft)
 
         return pd.DataFrame({'wavenumber': wn, 'intensity': intensity})
+
+    @staticmethod
+    def get_batch_raman_spectra(logs: list, width: float = 20, wn_min: int = 500, wn_max: int = 2500,
+                                wn_step: float = 1, shape: str = 'lorentzian', eta: float = 0.5, fft: bool = False,
+                                **kwargs) -> pd.DataFrame:
+        """
+        method to get the theoretical spectra of many gaussian log files at once. The peaks of all the log files are
+        broadened together, in chunks of spectra so that the memory used stays bounded for large batches.
+        :param logs: list of GaussianParser objects
+        :param width: the width of the peaks
+        :param wn_min: the minimum wave number
+        :param wn_max: the maximum wave number
+        :param wn_step: the number of intervals in the spectrum
+        :param shape: the line shape of the peaks, either 'lorentzian', 'gaussian' or 'pseudo_voigt'
+        :param eta: the fraction of the lorentzian in a pseudo-voigt line shape
+        :param fft: build the spectra with an FFT convolution, which is faster for fine grids
+        :return: long dataframe with the log file, wavenumber and intensity. The log files of a restarted calculation are
+        joined into one string with ', '
+        """
+        peaks = [log.get_raman_frequencies(**kwargs) for log in logs]
+        names = [log.log_file if type(log.log_file) == str else ', '.join(log.log_file) for log in logs]
+        n_peaks = max([len(p) for p in peaks] + [1])
+        frequencies = np.zeros((len(logs), n_peaks))
+        activities = np.zeros((len(logs), n_peaks))
+        for i, p in enumerate(peaks):
+            frequencies[i, :len(p)] = p['frequencies']
+            activities[i, :len(p)] = p['raman_activity']
+
+        wn = np.arange(wn_min, wn_max, wn_step)
+        intensity = broadened_spectrum(wn, frequencies, activities, width, shape=shape, eta=eta, fft=fft)
+
+        return pd.DataFrame({
+            'log_file': np.repeat(names, len(wn)),
+            'wavenumber': np.tile(wn, len(logs)),
+            'intensity': intensity.ravel()
+        })
     
-    def get_optimisation_trajectory(self, filename: str, path: str = '.', fit_t0 = False):
+    def get_optimisation_trajectory(self, filename: str, path: str = '.', fit_t0 = False, file_format: str = 'pdb'):
         """
         Function to get the optimisation trajectory from the log file
+        :param filename: name of the trajectory file
+        :param path: path to write the trajectory file
+        :param fit_t0: whether to rotate each frame to fit the first frame
+        :param file_format: either 'pdb', 'xyz' or 'dcd'
         """
         coordinates = self.get_coordinates_through_scf()
-        PdbParser.pandas_to_pdb_trajectory(coordinates, time_col='iteration', filename=filename, path=path, fit_t0=fit_t0)
+        PdbParser.pandas_to_trajectory(coordinates, time_col='iteration', file_format=file_format, filename=filename,
+                                       path=path, fit_t0=fit_t0)
         return None
     
     def _get_orbitals(self):
         """
         Function to get the orbital information from the log file
         """
-        if any('Population analysis using the SCF Density' in s for s in self._lines) is False:
+        if len(self._index['Population analysis using the SCF Density']) == 0:
             raise ValueError("This log file doesnt have molecular orbital data in it")
         
-        start_line = [i for i, line in enumerate(self._lines) if 'Population analysis using the SCF Density' in line][-1] + 4
-        end_line = [i for i, line in enumerate(self._lines) if 'Condensed to atoms (all electrons)' in line][-1]
+        start_line = self._index['Population analysis using the SCF Density'][-1] + 4
+        end_line = self._index['Condensed to atoms (all electrons)'][-1]
         chunk = self._lines[start_line:end_line]
 
         alpha_len = len([l for l in chunk if 'Alpha  occ. eigenvalues' in l])
@@ -1,10 +1,22 @@
 #!/usr/bin/env python
 import click
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 from Materials_Data_Analytics.metadynamics.free_energy import FreeEnergySpace
 from glob import glob
 
 
+def write_figure(figure, path: str) -> str:
+    """
+    function to write a figure to a pdf. It is run in a separate process for each figure, as kaleido is not thread-safe
+    :param figure: the plotly figure
+    :param path: the path to write the figure to
+    :return: the path
+    """
+    figure.write_image(path, scale=2)
+    return path
+
+
 @click.command()
 @click.option("--file", "-f", default="HILLS", help="Hills file to plot", type=str)
 @click.option("--output", "-o", default="Figures/", help="Output directory for figures", type=str)
@@ -12,7 +24,9 @@ from glob import glob
 @click.option("--height_power", "-hp", default=1, help="Power to raise height of _hills for easier visualisation", type=float)
 @click.option("--bias_exchange", "-be", is_flag=True, default=False, help="Is this a bias-exchange simulation?")
 @click.option("--show", "-s", is_flag=True, default=False, help="Show the figures in a window")
-def main(file: str, output: str, time_resolution: int, height_power: float, bias_exchange: bool = False, show: bool = False):
+@click.option("--workers", "-w", default=None, help="Number of processes to write the figures with", type=int)
+def main(file: str, output: str, time_resolution: int, height_power: float, bias_exchange: bool = False, show: bool = False,
+         workers: int = None):
     """
     cli tool to plot hill heights for all walkers, as well as the value of their CV. It also plots the average and max _hills deposited
     :param file: the location of the HILLS file
@@ -20,6 +34,8 @@ def main(file: str, output: str, time_resolution: int, height_power: float, bias
     :param time_resolution: how to bin the t axis for faster plotting
     :param height_power: power to raise _hills too for easier visualisation
     :param bias_exchange: is this a bias-exchange simulation?
+    :param show: show the figures in a window
+    :param workers: number of processes to write the figures with, each with its own kaleido. If None, one per cpu
     :return: saved figures
     """
     if bias_exchange is True:
@@ -28,32 +44,22 @@ def main(file: str, output: str, time_resolution: int, height_power: float, bias
     landscape = FreeEnergySpace(file)
     figures = landscape.get_hills_figures(time_resolution=time_resolution, height_power=height_power)
 
-    for key, value in figures.items():
-        key = str(key)
-        save_dir = output + "/Walker_" + key + ".pdf"
+    figures = {"Walker_" + str(key) + ".pdf": value for key, value in figures.items()}
+    figures["hills_mean.pdf"] = landscape.get_average_hills_figure(time_resolution=time_resolution)
+    figures["hills_max.pdf"] = landscape.get_max_hills_figure(time_resolution=time_resolution)
+
+    for value in figures.values():
         value.update_traces(line_color='white')
-        value.write_image(save_dir, scale=2)
-        current_time = datetime.now().strftime("%H:%M:%S")
-        click.echo(f"{current_time}: Made Walker_{key}.pdf in {output}", err=True)
-        if show:
-            value.show()
 
-    (landscape
-     .get_average_hills_figure(time_resolution=time_resolution)
-     .update_traces(line_color='white')
-     .write_image(output + "/" + "hills_mean.pdf", scale=2)
-     )
-    
-    current_time = datetime.now().strftime("%H:%M:%S")
-    click.echo(f"{current_time}: Made hills_mean.pdf in {output}", err=True)
-
-    (landscape
-     .get_max_hills_figure(time_resolution=time_resolution)
-     .update_traces(line_color='white')
-     .write_image(output + "/" + "hills_max.pdf", scale=2)
-     )
-    current_time = datetime.now().strftime("%H:%M:%S")
-    click.echo(f"{current_time}: Made hills_max.pdf in {output}", err=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        paths = [output + "/" + name for name in figures.keys()]
+        for name, _ in zip(figures.keys(), executor.map(write_figure, figures.values(), paths)):
+            current_time = datetime.now().strftime("%H:%M:%S")
+            click.echo(f"{current_time}: Made {name} in {output}", err=True)
+
+    if show:
+        for value in figures.values():
+            value.show()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+import hashlib
+import os
+import pickle
+import re
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+class CacheMissError(KeyError):
+    """
+    Error raised when an object is not in the cache, either because it was dropped or because the key is not valid
+    """
+
+
+class ObjectCache():
+    """
+    A server side cache for the objects used by the dash app. Objects are kept in memory under a key, and only the key
+    is sent to the browser. The cache holds at most max_items objects and roughly max_bytes of data, dropping the least
+    recently used objects when it is full, or writing them to spill_directory if one is given so that they can be read
+    back later. Results derived from an object, such as charge tables and peak fits, are memoized alongside it.
+    Main contributors:
+    Nicholas Siemons
+    Contributors:
+    """
+    # keys are a hex session id followed by one or more hex digests, as made by make_key
+    _KEY_PATTERN = re.compile(r'[0-9a-f]{1,64}(-[0-9a-f]{32})+')
+    _SESSION_PATTERN = re.compile(r'[0-9a-f]{1,64}(-[0-9a-f]{32})*')
+
+    def __init__(self, max_items: int = 16, spill_directory: str = None, max_bytes: int = None) -> None:
+        """
+        :param max_items: the maximum number of objects to keep in memory
+        :param spill_directory: a directory to write objects to when they are dropped from memory. If None, dropped
+        objects are lost
+        :param max_bytes: the approximate maximum memory to use for the objects and their memoized results. If None,
+        only the number of objects is limited
+        """
+        if max_items < 1:
+            raise ValueError('max_items must be at least 1')
+
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError('max_bytes must be at least 1')
+
+        self._max_items = max_items
+        self._max_bytes = max_bytes
+        self._spill_directory = spill_directory
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.RLock()
+
+        if spill_directory is not None:
+            os.makedirs(spill_directory, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: str) -> bool:
+        if not self.is_valid_key(key):
+            return False
+
+        with self._lock:
+            return key in self._items or (self._spill_directory is not None and os.path.exists(self._spill_path(key)))
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @classmethod
+    def is_valid_key(cls, key) -> bool:
+        """
+        Function to check that a key has the form made by make_key, as keys sent back by the browser cannot be trusted
+        :param key: the key
+        :return: True if the key is valid
+        """
+        return isinstance(key, str) and cls._KEY_PATTERN.fullmatch(key) is not None
+
+    @classmethod
+    def make_key(cls, session: str, contents: str, *parameters) -> str:
+        """
+        Function to make a cache key from a session id, the uploaded file contents and any parameters used to make the object
+        :param session: the hex id of the browser session, or the key of the object this one is derived from
+        :param contents: the uploaded file contents
+        :param parameters: any other values which the object depends on
+        :return: the key
+        """
+        if not isinstance(session, str) or cls._SESSION_PATTERN.fullmatch(session) is None:
+            raise ValueError('The session must be a hex string or a cache key')
+
+        digest = hashlib.sha256(contents.encode('utf-8'))
+        for p in parameters:
+            digest.update(repr(p).encode('utf-8'))
+
+        return f"{session}-{digest.hexdigest()[:32]}"
+
+    @staticmethod
+    def _get_size(obj) -> int:
+        """
+        Function to estimate the memory used by an object, from its data if it is or holds a pandas object
+        :param obj: the object
+        :return: the approximate size in bytes
+        """
+        data = obj if isinstance(obj, (pd.DataFrame, pd.Series)) else getattr(obj, '_data', None)
+
+        if isinstance(data, (pd.DataFrame, pd.Series)):
+            return int(np.sum(data.memory_usage(deep=True)))
+
+        return sys.getsizeof(obj)
+
+    def _spill_path(self, key: str) -> str:
+        """
+        Function to get the file an object is spilled to, named by a hash of its key rather than the key itself
+        :param key: the key
+        :return: the path to the file
+        """
+        return os.path.join(self._spill_directory, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.pkl")
+
+    def _add_item(self, key: str, item: dict) -> None:
+        """
+        Function to add an entry to the cache as the most recently used, dropping the least recently used entries until
+        the cache fits in max_items and max_bytes. The new entry is always kept
+        :param key: the key
+        :param item: dict with the object and its memoized results
+        """
+        if key in self._items:
+            self._size -= self._items.pop(key)['size']
+
+        item['size'] = self._get_size(item['object']) + sum(self._get_size(d) for d in item['derived'].values())
+        self._items[key] = item
+        self._size += item['size']
+        self._drop_items()
+
+    def _drop_items(self) -> None:
+        """
+        Function to drop the least recently used entries until the cache fits in max_items and max_bytes, writing them
+        to the spill directory if there is one
+        """
+        while len(self._items) > 1 and (len(self._items) > self._max_items or (self._max_bytes is not None and self._size > self._max_bytes)):
+            old_key, old_item = self._items.popitem(last=False)
+            self._size -= old_item['size']
+            if self._spill_directory is not None:
+                with open(self._spill_path(old_key), 'wb') as f:
+                    pickle.dump({'object': old_item['object'], 'derived': old_item['derived']}, f)
+
+    def set(self, key: str, obj) -> str:
+        """
+        Function to add an object to the cache, dropping any results memoized for a previous object with the same key
+        :param key: the key to store the object under
+        :param obj: the object
+        :return: the key
+        """
+        if not self.is_valid_key(key):
+            raise ValueError(f'{key} is not a valid cache key')
+
+        with self._lock:
+            if self._spill_directory is not None and os.path.exists(self._spill_path(key)):
+                os.remove(self._spill_path(key))
+
+            self._add_item(key, {'object': obj, 'derived': {}})
+
+        return key
+
+    def _get_item(self, key: str) -> dict:
+        """
+        Function to get the cache entry for a key, reading it back from the spill directory if needed
+        :param key: the key
+        :return: dict with the object and its memoized results
+        """
+        if not self.is_valid_key(key):
+            raise CacheMissError(f'{key} is not a valid cache key')
+
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+
+            if self._spill_directory is None or not os.path.exists(self._spill_path(key)):
+                raise CacheMissError(f'{key} is not in the cache')
+
+            with open(self._spill_path(key), 'rb') as f:
+                item = pickle.load(f)
+
+            os.remove(self._spill_path(key))
+            self._add_item(key, item)
+            return item
+
+    def get(self, key: str):
+        """
+        Function to get an object from the cache
+        :param key: the key
+        :return: the object
+        """
+        return self._get_item(key)['object']
+
+    def memoize(self, key: str, method: str, **kwargs):
+        """
+        Function to call a method of a cached object, returning the stored result if it has been called before with the same arguments
+        :param key: the key of the object
+        :param method: the name of the method
+        :param kwargs: the arguments to the method
+        :return: the result of the method
+        """
+        item = self._get_item(key)
+        derived_key = (method, tuple(sorted(kwargs.items())))
+
+        if derived_key not in item['derived']:
+            result = getattr(item['object'], method)(**kwargs)
+            with self._lock:
+                if derived_key not in item['derived']:
+                    item['derived'][derived_key] = result
+                    result_size = self._get_size(result)
+                    item['size'] += result_size
+                    if self._items.get(key) is item:
+                        self._size += result_size
+                        self._drop_items()
+
+        return item['derived'][derived_key]
@@ -1,8 +1,10 @@
 import dash as ds
 from Materials_Data_Analytics.experiment_modelling.cyclic_voltammetry import CyclicVoltammogram
-import base64
-import io
-import pickle
+from dash_app.cache import ObjectCache, CacheMissError
+from copy import deepcopy
+import os
+import re
+import uuid
 
 source_options = [{'label': 'Biologic', 'value': 'biologic'}, {'label': 'Aftermath', 'value': 'aftermath'}]
 upload_button_style = {'width': '50%', 'height': '30px', 'lineHeight': '30px', 'borderWidth': '1px', 'borderStyle': 'dashed', 'textAlign': 'center'}
@@ -11,6 +13,12 @@ button_style = {'width': '30%', 'height': '30px', 'lineHeight': '15px', 'borderW
 slider_style = {'width':'70%'}
 plotly_template = 'presentation'
 
+reload_message = 'This cyclic voltammogram is no longer loaded on the server. Please load the file again.'
+
+cv_cache = ObjectCache(max_items=int(os.environ.get('CV_CACHE_MAX_ITEMS', 64)), 
+                       max_bytes=int(os.environ.get('CV_CACHE_MAX_BYTES', 2**30)), 
+                       spill_directory=os.environ.get('CV_CACHE_DIRECTORY'))
+
 
 ds.register_page(__name__)
 
@@ -62,8 +70,10 @@ layout = ds.html.Div([
         ds.html.Br(), ds.html.Br(),
         ds.html.Button('Get editing parameters for Cyclic Voltammogram', id='get_cv_parameters', style=button_style),
         ds.html.Div(id='parameters_message'),
+        ds.dcc.ConfirmDialog(id='cache_message', message=reload_message),
         ds.dcc.Store(id="cv_parameters_for_editing"),
         ds.dcc.Store(id="cv_stored"),
+        ds.dcc.Store(id="session_id", storage_type='session'),
         ds.html.Br(), ds.html.Br(), ds.html.Br(),
         ds.html.H3('Select the cycles to analyze'),
         ds.html.Div(ds.dcc.RangeSlider(min=0, max=5, value=[0, 5], step=1, marks={i: str(i) for i in range(6)}), id='cycle_slider2', style=slider_style),
@@ -88,16 +98,16 @@ layout = ds.html.Div([
     ])
     
 
-def pickle_and_encode(data):
-    pickled_data = pickle.dumps(data)
-    encoded_data = base64.b64encode(pickled_data).decode('utf-8')
-    return encoded_data
-
-
-def pickle_and_decode(encoded_data):
-    pickled_data = base64.b64decode(encoded_data)
-    data = pickle.loads(pickled_data)
-    return data
+def show_reload_message(error):
+    """
+    Function to handle errors in the callbacks which read from the server side cache. If the cyclic voltammogram is no
+    longer there, for example because it was dropped to make space or the server restarted, the user is asked to load
+    the file again and the outputs are left as they are. Any other error is raised as normal
+    """
+    if not isinstance(error, CacheMissError):
+        raise error
+    
+    ds.set_props('cache_message', {'displayed': True})
 
 
 @ds.callback(
@@ -116,24 +126,36 @@ def update_file_name(filename):
 
 @ds.callback(
     [ds.Output('cv_parameters_for_editing', 'data'),
-     ds.Output('parameters_message', 'children')],
+     ds.Output('parameters_message', 'children'),
+     ds.Output('session_id', 'data')],
      ds.Input('get_cv_parameters', 'n_clicks'),
     [ds.State('data_upload', 'contents'),
      ds.State('data_source', 'value'), 
      ds.State('scan_rate_input', 'value'),
-     ds.State('data_upload', 'filename')],
+     ds.State('data_upload', 'filename'),
+     ds.State('session_id', 'data')],
     prevent_initial_call=True
 )
-def store_cv_parameteres_for_editing(n_clicks, file_contents, source, scan_rate, file_name):
+def store_cv_parameteres_for_editing(n_clicks, file_contents, source, scan_rate, file_name, session_id):
     """
-    Callback to store the CV data and update the text to let the user know they updated the CV text
+    Callback to store the CV data and update the text to let the user know they updated the CV text. The CV is kept in 
+    the server side cache, keyed by the session and a hash of the upload, and only the key is sent to the browser
     """
-    the_cv = CyclicVoltammogram.from_html_base64(file_contents = file_contents, source=source, scan_rate = scan_rate)
+    if not isinstance(session_id, str) or re.fullmatch('[0-9a-f]{32}', session_id) is None:
+        session_id = uuid.uuid4().hex
+
+    cv_key = cv_cache.make_key(session_id, file_contents, source, scan_rate)
+
+    try:
+        the_cv = cv_cache.get(cv_key)
+    except CacheMissError:
+        the_cv = CyclicVoltammogram.from_html_base64(file_contents = file_contents, source=source, scan_rate = scan_rate)
+        cv_cache.set(cv_key, the_cv)
+
     max_cycle = the_cv.max_cycle
     potential_steps_per_cycle = the_cv.steps_per_cycle
 
-    cv_data = {'cv': pickle_and_encode(the_cv),
-               'file_contents': file_contents,
+    cv_data = {'cv': cv_key,
                'source': source,
                'scan_rate': scan_rate, 
                'max_cycle': max_cycle, 
@@ -147,7 +169,7 @@ def store_cv_parameteres_for_editing(n_clicks, file_contents, source, scan_rate,
 
     code_snippet_element = ds.dcc.Markdown(code_snippet)
 
-    return cv_data, code_snippet_element
+    return cv_data, code_snippet_element, session_id
 
 
 @ds.callback(
@@ -180,46 +202,54 @@ def display_editing_tools(cv_data):
     [ds.State('cycle_slider', 'value'),
      ds.State('downsample_slider', 'value'),
      ds.State('cv_parameters_for_editing', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
 def update_cv_data(n_clicks, cycle_range, down_sample_n, cv_data):
     """
     Callback to update the CV data based off of the sliders
     """
-    the_cv = pickle_and_decode(cv_data['cv'])
+    the_cv = cv_cache.get(cv_data['cv'])
     max_cycle = cv_data['max_cycle']
     potential_steps_per_cycle = cv_data['potential_steps_per_cycle']
+    new_cv_key = cv_cache.make_key(cv_data['cv'], '', cycle_range, down_sample_n)
     
     if cycle_range != [0, max_cycle] and down_sample_n == potential_steps_per_cycle:
         cycles = [i for i in range(cycle_range[0], cycle_range[1]+1)]
-        new_cv = the_cv.drop_cycles(keep=cycles)
+        edit = lambda cv: cv.drop_cycles(keep=cycles)
         code_snippet = f"""```cyclic_voltammogram = cyclic_voltammogram.drop_cycles(keep={cycles})```"""
     elif cycle_range == [0, max_cycle] and down_sample_n != potential_steps_per_cycle:
-        new_cv = the_cv.downsample(n=down_sample_n)
+        edit = lambda cv: cv.downsample(n=down_sample_n)
         code_snippet = f"""```cyclic_voltammogram = cyclic_voltammogram.downsample(n={down_sample_n})```"""
     elif cycle_range == [0, max_cycle] and down_sample_n == potential_steps_per_cycle:
-        new_cv = the_cv
+        edit = None
+        new_cv_key = cv_data['cv']
         code_snippet = f"""```cyclic_voltammogram = cyclic_voltammogram```"""
     elif cycle_range != [0, max_cycle] and down_sample_n != potential_steps_per_cycle:
         cycles = [i for i in range(cycle_range[0], cycle_range[1]+1)]
-        new_cv = the_cv.drop_cycles(keep=cycles).downsample(n=down_sample_n)
+        edit = lambda cv: cv.drop_cycles(keep=cycles).downsample(n=down_sample_n)
         code_snippet = f"""```cyclic_voltammogram = cyclic_voltammogram.drop_cycles(keep={cycles}).downsample(n={down_sample_n})```"""
 
+    # the edits change the cv in place, so they are applied to a copy to keep the loaded cv in the cache unchanged
+    if edit is not None and new_cv_key not in cv_cache:
+        cv_cache.set(new_cv_key, edit(deepcopy(the_cv)))
+
     code_snippet_element = ds.dcc.Markdown(code_snippet)
 
-    return pickle_and_encode(new_cv), code_snippet_element
+    return new_cv_key, code_snippet_element
 
 
 @ds.callback(
     ds.Output('basic_analysis', 'children'),
     [ds.Input('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def display_basic_analysis(encoded_cv):
+def display_basic_analysis(cv_key):
     """
     Callback to display the basic analysis of the CV
     """
-    the_cv = pickle_and_decode(encoded_cv)
+    the_cv = cv_cache.get(cv_key)
 
     data = the_cv.data.round(7).to_dict('records')
     current_time_plot = the_cv.get_current_time_plot(width=1400, height=600, template=plotly_template)
@@ -279,19 +309,20 @@ def display_basic_analysis(encoded_cv):
 @ds.callback(
     ds.Output('charge_passed_analysis', 'children'),
     [ds.Input('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def display_charge_passed_analysis(encoded_cv):
+def display_charge_passed_analysis(cv_key):
     """
     Callback to display the charge passed analysis
     """
-    the_cv = pickle_and_decode(encoded_cv)
+    the_cv = cv_cache.get(cv_key)
 
-    charge_passed_table_summary = the_cv.get_charge_passed(average_segments = True).round(7).to_dict('records')
-    charge_passed_table = the_cv.get_charge_passed().round(7).to_dict('records')
+    charge_passed_table_summary = cv_cache.memoize(cv_key, 'get_charge_passed', average_segments = True).round(7).to_dict('records')
+    charge_passed_table = cv_cache.memoize(cv_key, 'get_charge_passed').round(7).to_dict('records')
     charge_passed_plot = the_cv.get_charge_passed_plot(width=740, height=600, template=plotly_template)
-    max_charges_passed_table_summary = the_cv.get_maximum_charges_passed(average_sections = True).round(7).to_dict('records')
-    max_charges_passed_table = the_cv.get_maximum_charges_passed().round(7).to_dict('records')
+    max_charges_passed_table_summary = cv_cache.memoize(cv_key, 'get_maximum_charges_passed', average_sections = True).round(7).to_dict('records')
+    max_charges_passed_table = cv_cache.memoize(cv_key, 'get_maximum_charges_passed').round(7).to_dict('records')
     max_charge_passed_plot = the_cv.get_maximum_charge_passed_plot(width=740, height=600, template=plotly_template)
 
     charge_passed_table_summary_element = ds.html.Div([
@@ -387,7 +418,7 @@ def display_charge_passed_analysis(encoded_cv):
     [ds.Input('cv_stored', 'data')],
     prevent_initial_call=True
 )
-def display_peak_fitting_tools(encoded_cv):
+def display_peak_fitting_tools(cv_key):
     """
     Callback to display the peak fitting analysis
     """
@@ -413,12 +444,13 @@ def display_peak_fitting_tools(encoded_cv):
     [ds.State('cv_stored', 'data'),
      ds.State('polynomial_order_slider', 'value'),
      ds.State('window_slider', 'value')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def display_peak_fitting_analysis(n_clicks, encoded_cv, polynomial_order, window):
+def display_peak_fitting_analysis(n_clicks, cv_key, polynomial_order, window):
 
-    the_cv = pickle_and_decode(encoded_cv)
-    peak_points = the_cv.get_peaks(window=window, polynomial_order=polynomial_order, summary=True).round(7).to_dict('records')
+    the_cv = cv_cache.get(cv_key)
+    peak_points = cv_cache.memoize(cv_key, 'get_peaks', window=window, polynomial_order=polynomial_order, summary=True).round(7).to_dict('records')
     peak_plot_reduction = the_cv.get_peak_plot(direction='reduction', window = window, polynomial_order = polynomial_order, width=700, height=500, template=plotly_template)
     peak_plot_oxidation = the_cv.get_peak_plot(direction='oxidation', window = window, polynomial_order = polynomial_order, width=700, height=500, template=plotly_template)
     current_figure, potential_figure = the_cv.get_plots_peaks_with_cycle(polynomial_order=polynomial_order, window=window, width=700, height=500, template=plotly_template)
@@ -472,13 +504,14 @@ def display_peak_fitting_analysis(n_clicks, encoded_cv, polynomial_order, window
      ds.Output('current_integration_plot_code', 'children')],
     [ds.Input('charge_passed_id', 'clickData')],
     [ds.State('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def update_integration_plot(clickData, encoded_cv):
+def update_integration_plot(clickData, cv_key):
     """
     Callback to update the integration plot based off of the click data
     """
-    the_cv = pickle_and_decode(encoded_cv)
+    the_cv = cv_cache.get(cv_key)
 
     point_info = clickData['points'][0]
     cycle = point_info['x']
@@ -496,13 +529,14 @@ def update_integration_plot(clickData, encoded_cv):
      ds.Output('max_current_integration_plot_code', 'children')],
     [ds.Input('max_charge_passed_id', 'clickData')],
     [ds.State('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def update_max_charges_integration_plot(clickData, encoded_cv):
+def update_max_charges_integration_plot(clickData, cv_key):
     """
     Callback to update the integration plot based off of the click data
     """
-    the_cv = pickle_and_decode(encoded_cv)
+    the_cv = cv_cache.get(cv_key)
 
     point_info = clickData['points'][0]
     section = point_info['x']
@@ -518,14 +552,14 @@ def update_max_charges_integration_plot(clickData, encoded_cv):
     ds.Output('charges_summary_download', 'data'),
     [ds.Input('charges_summary_download_button', 'n_clicks')],
     [ds.State('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def download_charges_summary(n_clicks, encoded_cv):
+def download_charges_summary(n_clicks, cv_key):
     """
     Callback to download the charges summary table
     """
-    the_cv = pickle_and_decode(encoded_cv)
-    data = the_cv.get_charge_passed(average_segments = True)
+    data = cv_cache.memoize(cv_key, 'get_charge_passed', average_segments = True)
     return ds.dcc.send_data_frame(data.to_csv, "charges_summary.csv")
 
 
@@ -533,14 +567,14 @@ def download_charges_summary(n_clicks, encoded_cv):
     ds.Output('charges_cycle_download', 'data'),
     [ds.Input('charges_cycle_download_button', 'n_clicks')],
     [ds.State('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def download_charges_cycle(n_clicks, encoded_cv):
+def download_charges_cycle(n_clicks, cv_key):
     """
     Callback to download the charges cycle table
     """
-    the_cv = pickle_and_decode(encoded_cv)
-    data = the_cv.get_charge_passed()
+    data = cv_cache.memoize(cv_key, 'get_charge_passed')
     return ds.dcc.send_data_frame(data.to_csv, "charges_cycle.csv")
 
 
@@ -548,13 +582,14 @@ def download_charges_cycle(n_clicks, encoded_cv):
     ds.Output('download_raw_data', 'data'),
     [ds.Input('download_raw_data_button', 'n_clicks')],
     [ds.State('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def download_raw_data(n_clicks, encoded_cv):
+def download_raw_data(n_clicks, cv_key):
     """
     Callback to download the raw data
     """
-    the_cv = pickle_and_decode(encoded_cv)
+    the_cv = cv_cache.get(cv_key)
     data = the_cv.data
     return ds.dcc.send_data_frame(data.to_csv, "raw_data.csv")
 
@@ -563,13 +598,14 @@ def download_raw_data(n_clicks, encoded_cv):
     ds.Output('download_current_potential', 'data'),
     [ds.Input('download_current_potential_button', 'n_clicks')],
     [ds.State('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def download_current_potential(n_clicks, encoded_cv):
+def download_current_potential(n_clicks, cv_key):
     """
     Callback to download the current potential plot
     """
-    the_cv = pickle_and_decode(encoded_cv)
+    the_cv = cv_cache.get(cv_key)
     fig = the_cv.get_current_potential_plot(width=1100, height=800, template=plotly_template)
     pdf_file = "/tmp/current_potential.pdf"
     fig.write_image(pdf_file, format='pdf')
@@ -581,13 +617,14 @@ def download_current_potential(n_clicks, encoded_cv):
     ds.Output('download_current_time', 'data'),
     [ds.Input('download_current_time_button', 'n_clicks')],
     [ds.State('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def download_current_time(n_clicks, encoded_cv):
+def download_current_time(n_clicks, cv_key):
     """
     Callback to download the current time plot
     """
-    the_cv = pickle_and_decode(encoded_cv)
+    the_cv = cv_cache.get(cv_key)
     fig = the_cv.get_current_time_plot(width=1400, height=600, template=plotly_template)
     pdf_file = "/tmp/current_time.pdf"
     fig.write_image(pdf_file, format='pdf')
@@ -598,13 +635,14 @@ def download_current_time(n_clicks, encoded_cv):
     ds.Output('download_potential_time', 'data'),
     [ds.Input('download_potential_time_button', 'n_clicks')],
     [ds.State('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def download_potential_time(n_clicks, encoded_cv):
+def download_potential_time(n_clicks, cv_key):
     """
     Callback to download the potential time plot
     """
-    the_cv = pickle_and_decode(encoded_cv)
+    the_cv = cv_cache.get(cv_key)
     fig = the_cv.get_potential_time_plot(width=1400, height=500, template=plotly_template)
     pdf_file = "/tmp/potential_time.pdf"
     fig.write_image(pdf_file, format='pdf')
@@ -615,14 +653,14 @@ def download_potential_time(n_clicks, encoded_cv):
     ds.Output('max_charges_passed_download', 'data'),
     [ds.Input('max_charges_passed_download_button', 'n_clicks')],
     [ds.State('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def download_max_charges_passed(n_clicks, encoded_cv):
+def download_max_charges_passed(n_clicks, cv_key):
     """
     Callback to download the max charges passed table
     """
-    the_cv = pickle_and_decode(encoded_cv)
-    data = the_cv.get_maximum_charges_passed()
+    data = cv_cache.memoize(cv_key, 'get_maximum_charges_passed')
     return ds.dcc.send_data_frame(data.to_csv, "max_charges_passed.csv")
 
 
@@ -630,14 +668,14 @@ def download_max_charges_passed(n_clicks, encoded_cv):
     ds.Output('max_charges_summary_download', 'data'),
     [ds.Input('max_charges_summary_download_button', 'n_clicks')],
     [ds.State('cv_stored', 'data')],
-    prevent_initial_call=True
+    prevent_initial_call=True,
+    on_error=show_reload_message
 )
-def download_max_charges_summary(n_clicks, encoded_cv):
+def download_max_charges_summary(n_clicks, cv_key):
     """
     Callback to download the max charges summary table
     """
-    the_cv = pickle_and_decode(encoded_cv)
-    data = the_cv.get_maximum_charges_passed(average_sections = True)
+    data = cv_cache.memoize(cv_key, 'get_maximum_charges_passed', average_sections = True)
     return ds.dcc.send_data_frame(data.to_csv, "max_charges_summary.csv")
 
 
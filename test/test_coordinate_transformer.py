@@ -1,6 +1,10 @@
 import unittest
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
-from Materials_Data_Analytics.core.coordinate_transformer import CoordinateTransformer
+from Materials_Data_Analytics.core.coordinate_transformer import CoordinateTransformer, PdbParser, TrajectoryWriter
+from Materials_Data_Analytics.core.coordinate_transformer import kabsch, align, rmsd
 
 
 class TestCoordinateTransformer(unittest.TestCase):
@@ -25,3 +29,110 @@ class TestCoordinateTransformer(unittest.TestCase):
 
         self.assertTrue(type(rot_data) == pd.DataFrame)
         pd.testing.assert_frame_equal(rot_data, correct_data, atol=0.001)
+
+    def test_rotation_fit(self):
+        """ Test that rotated and translated coordinates are fitted back onto the reference """
+        moved = CoordinateTransformer(self.data.copy()).rotate(theta_x=30, theta_y=40, theta_z=50).translate(1, 2, 3).data
+        fitted = CoordinateTransformer(moved).rotation_fit(self.data).data
+        pd.testing.assert_frame_equal(fitted, self.data.astype(float), atol=1e-6)
+
+    def test_rotation_fit_frames(self):
+        """ Test that all the frames of a trajectory are fitted to the reference at once """
+        frames = pd.concat([
+            CoordinateTransformer(self.data.copy()).rotate(theta_z=10 * i).translate(x=i).data.assign(frame=i)
+            for i in range(5)
+        ]).reset_index(drop=True)
+
+        transformer = CoordinateTransformer(frames, frame_col='frame')
+        self.assertTrue(transformer.coordinates.shape == (5, 4, 3))
+
+        fitted = transformer.rotation_fit(self.data).data
+        for i, group in fitted.groupby('frame'):
+            self.assertTrue(np.allclose(group[['x', 'y', 'z']].to_numpy(), self.data.to_numpy()))
+
+
+class TestAlignment(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.reference = rng.normal(size=(12, 3))
+        self.weights = rng.uniform(1, 16, size=12)
+        angles = rng.uniform(0, 2 * np.pi, size=(50, 3))
+        self.frames = np.stack([self.reference @ self._rotation(a).T for a in angles]) + rng.normal(size=(50, 1, 3))
+
+    @staticmethod
+    def _rotation(angles):
+        rx = np.array([[1, 0, 0], [0, np.cos(angles[0]), -np.sin(angles[0])], [0, np.sin(angles[0]), np.cos(angles[0])]])
+        ry = np.array([[np.cos(angles[1]), 0, np.sin(angles[1])], [0, 1, 0], [-np.sin(angles[1]), 0, np.cos(angles[1])]])
+        rz = np.array([[np.cos(angles[2]), -np.sin(angles[2]), 0], [np.sin(angles[2]), np.cos(angles[2]), 0], [0, 0, 1]])
+        return rz @ ry @ rx
+
+    def test_align(self):
+        """ Test that rotated and translated frames are aligned back onto the reference with both methods """
+        for method in ['quaternion', 'svd']:
+            aligned = align(self.frames, self.reference, weights=self.weights, method=method)
+            self.assertTrue(aligned.shape == self.frames.shape)
+            self.assertTrue(np.allclose(aligned, self.reference))
+            self.assertTrue(np.allclose(align(self.frames[0], self.reference, method=method), self.reference))
+
+    def test_rmsd(self):
+        """ Test the rmsd of frames with and without superposition """
+        self.assertTrue(np.allclose(rmsd(self.frames, self.reference, weights=self.weights), 0))
+        self.assertTrue(np.all(rmsd(self.frames, self.reference, superposition=False) > 0.1))
+        self.assertTrue(type(rmsd(self.reference + 1, self.reference, superposition=False)) == float)
+        self.assertTrue(np.isclose(rmsd(self.reference + 1, self.reference, superposition=False), np.sqrt(3)))
+
+    def test_no_reflection(self):
+        """ Test that a mirror image is fitted with a proper rotation rather than a reflection """
+        mirror = self.reference * np.array([1, 1, -1])
+        for method in ['quaternion', 'svd']:
+            r, centroid_frames, centroid_reference = kabsch(mirror, self.reference, method=method)
+            self.assertTrue(np.isclose(np.linalg.det(r[0]), 1))
+            self.assertTrue(rmsd(mirror, self.reference) > 0.1)
+
+
+class TestTrajectoryWriter(unittest.TestCase):
+
+    def setUp(self):
+
+        self.data = pd.DataFrame({
+            'x': [-0.931, -0.468, -2.329, -2.972] * 3,
+            'y': [2.537, 3.513, 2.402, 3.270] * 3,
+            'z': [0.0, 0.0, 0.0, 0.0] * 3,
+            'element': ['C', 'H', 'C', 'H'] * 3,
+            'time': [0] * 4 + [1] * 4 + [2] * 4
+        })
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pdb(self):
+        """ Test that a pdb trajectory has a model for each frame """
+        PdbParser.pandas_to_pdb_trajectory(self.data, time_col='time', filename='trajectory', path=self.directory)
+        lines = open(f"{self.directory}/trajectory.pdb").readlines()
+        self.assertTrue(len([l for l in lines if l.startswith('MODEL')]) == 3)
+        self.assertTrue(lines[5] == "ATOM      1  C   UNK     1      -0.931   2.537   0.000  1.00  0.00          C \n")
+
+    def test_xyz(self):
+        """ Test that an xyz trajectory can be written """
+        PdbParser.pandas_to_trajectory(self.data, time_col='time', file_format='xyz', filename='trajectory', path=self.directory)
+        lines = open(f"{self.directory}/trajectory.xyz").readlines()
+        self.assertTrue(len(lines) == 3 * 6)
+        self.assertTrue(lines[0] == "4\n")
+        self.assertTrue(lines[2].split() == ['C', '-0.93100000', '2.53700000', '0.00000000'])
+
+    def test_dcd(self):
+        """ Test that a dcd trajectory has the right number of frames and coordinates """
+        with TrajectoryWriter('trajectory.dcd', path=self.directory) as writer:
+            for time, group in self.data.groupby('time'):
+                writer.write_frame(group, time=time)
+
+        contents = open(f"{self.directory}/trajectory.dcd", 'rb').read()
+        header = np.frombuffer(contents[:92], dtype='<i4')
+        self.assertTrue(contents[4:8] == b'CORD')
+        self.assertTrue(header[2] == 3)
+        self.assertTrue(np.frombuffer(contents[184:196], dtype='<i4')[1] == 4)
+        x = np.frombuffer(contents[196 + 56 + 4:196 + 56 + 20], dtype='<f4')
+        self.assertTrue(np.allclose(x, self.data['x'].iloc[:4]))
+        self.assertTrue(len(contents) == 196 + 3 * (56 + 3 * (8 + 16)))
@@ -1,4 +1,4 @@
-from Materials_Data_Analytics.experiment_modelling.cyclic_voltammetry import CyclicVoltammogram
+from Materials_Data_Analytics.experiment_modelling.cyclic_voltammetry import CyclicVoltammogram, CyclicVoltammogramBatch
 import unittest
 import pandas as pd
 from Materials_Data_Analytics.materials.electrolytes import Electrolyte
@@ -10,6 +10,13 @@ import mimetypes
 from plotly import graph_objects as go
 from copy import copy
 from datetime import datetime as dt
+from Materials_Data_Analytics.experiment_modelling.core import ElectrochemicalMeasurement
+import numpy as np
+import importlib.util
+import scipy.integrate as integrate
+import sys
+import types
+from unittest import mock
 
 
 class TestBiologic1(unittest.TestCase):
@@ -60,6 +67,15 @@ class TestBiologic1(unittest.TestCase):
         self.assertTrue(type(self.cv._object_creation_time) == dt)
         self.assertTrue(type(self.cv.object_creation_time) == str)
 
+    def test_data_with_metadata(self):
+        """ Test that metadata is only broadcast into categorical columns when the data is requested """
+        data = self.cv.data_with_metadata()
+        self.assertTrue('scan_rate' not in self.cv._data.columns)
+        self.assertTrue(isinstance(data['instrument'].dtype, pd.CategoricalDtype))
+        self.assertTrue((data['scan_rate'] == 5).all())
+        self.assertTrue((data['instrument'] == 'Biologic').all())
+        pd.testing.assert_frame_equal(data.drop(columns=['scan_rate', 'instrument']), self.cv._data)
+
     def test_drop_cycles(self):
         """ Test the drop_cycles method """
         data = copy(self.cv).drop_cycles(drop=[1]).data
@@ -221,6 +237,41 @@ class TestBiologic2(unittest.TestCase):
         self.assertTrue(type(integrals) == pd.DataFrame)
         self.assertTrue(charges == [0.0105])
 
+    def test_read_options(self):
+        """ Test reading biologic files in chunks, in single precision and in the native .mpr format """
+        path = 'test_trajectories/cyclic_voltammetry/biologic2.txt'
+        chunked = CyclicVoltammogram.from_biologic(path = path, chunksize=50)
+        pd.testing.assert_frame_equal(chunked.data, self.cv.data)
+
+        single = CyclicVoltammogram.from_biologic(path = path, dtype=np.float32)
+        self.assertTrue(np.allclose(single.data['current'].sum(), self.cv.data['current'].sum(), rtol=1e-4))
+
+        if importlib.util.find_spec('galvani') is None:
+            with self.assertRaises(ImportError):
+                CyclicVoltammogram.from_biologic(path = 'test_trajectories/cyclic_voltammetry/biologic2.mpr')
+
+    def test_read_mpr_columns(self):
+        """ Test that the columns of a native .mpr file are mapped onto the biologic names, with a mocked galvani """
+        raw = CyclicVoltammogram._read_columns('test_trajectories/cyclic_voltammetry/biologic2.txt', sep='\t', columns=CyclicVoltammogram._BIOLOGIC_COLUMNS)
+        records = np.zeros(len(raw), dtype=[('time/s', np.float64), ('Ewe/V', np.float64), ('I/mA', np.float64), ('cycle number', np.float64)])
+        records['time/s'] = raw['time']
+        records['Ewe/V'] = raw['potential']
+        records['I/mA'] = raw['current']
+
+        galvani = types.ModuleType('galvani')
+        galvani.BioLogic = mock.Mock()
+        galvani.BioLogic.MPRfile.return_value.data = records
+
+        with mock.patch.dict(sys.modules, {'galvani': galvani}), mock.patch('importlib.util.find_spec', return_value=True):
+            data = CyclicVoltammogram._read_biologic_mpr('biologic2.mpr')
+            cv = CyclicVoltammogram.from_biologic(path = 'biologic2.mpr')
+
+        self.assertTrue(data.columns.to_list() == ['Ewe/V', '<I>/mA', 'time/s'])
+        self.assertTrue((data.dtypes == np.float64).all())
+        self.assertTrue(np.allclose(data['<I>/mA'], raw['current']))
+        pd.testing.assert_frame_equal(cv.data, self.cv.data)
+        galvani.BioLogic.MPRfile.assert_called_with('biologic2.mpr')
+
 
 class TestBiologic3(unittest.TestCase):
 
@@ -244,6 +295,16 @@ class TestBiologic3(unittest.TestCase):
         self.assertTrue(type(integrals) == pd.DataFrame)
         self.assertTrue(charges == [3.3214, 61.8374, 3.2826, 0.0318])
 
+    def test_current_roots_after_downsample(self):
+        """ Test that the current roots found after downsampling sit between their neighbours """
+        data = copy(self.cv).downsample(100)._data
+        for i in data.query('current == 0').index.drop([0, len(data)-1], errors='ignore'):
+            self.assertTrue(data.loc[i-1, 'time'] <= data.loc[i, 'time'] <= data.loc[i+1, 'time'])
+
+        full_charges = self.cv.get_charge_passed()['total_charge'].to_numpy()
+        down_charges = copy(self.cv).downsample(100).get_charge_passed().sort_values('segment')['total_charge'].to_numpy()
+        self.assertTrue(np.allclose(full_charges, down_charges, rtol=0.1))
+
 
 class TestBiologic4(unittest.TestCase):
 
@@ -301,6 +362,50 @@ class TestBiologic5(unittest.TestCase):
         # cv.get_current_time_plot().show()
         # cv.get_potential_time_plot().show()
 
+        cv = copy(self.cv).downsample(25, method='lttb')
+        self.assertTrue(len(cv.data.query('segment == 3')) == 27)
+        peak = self.cv.data.query('segment == 3')['current'].max()
+        mean_peak = copy(self.cv).downsample(25).data.query('segment == 3')['current'].max()
+        self.assertTrue(abs(cv.data.query('segment == 3')['current'].max() - peak) < abs(mean_peak - peak))
+
+        with self.assertRaises(ValueError):
+            copy(self.cv).downsample(25, method='median')
+
+    def test_get_lttb_indices(self):
+        """ Test that lttb keeps the ends and the spike of each group, and keeps short groups whole """
+        x = np.concatenate([np.arange(100), np.arange(5)]).astype(float)
+        y = np.concatenate([np.where(np.arange(100) == 37, 10.0, 0.0), np.ones(5)])
+        groups = np.repeat([0, 1], [100, 5])
+        kept = ElectrochemicalMeasurement.get_lttb_indices(x, y, groups, 10)
+        self.assertTrue(len(kept) == 15)
+        self.assertTrue(all(i in kept for i in [0, 37, 99, 100, 101, 102, 103, 104]))
+
+    def test_add_endpoints(self):
+        """ Test that every segment starts on the last point of the segment before it """
+        for data in [self.cv._data, copy(self.cv).downsample(25)._data]:
+            first_points = data.groupby('segment').head(1).set_index('segment')[['time', 'potential', 'current']]
+            last_points = data.groupby('segment').tail(1).set_index('segment')[['time', 'potential', 'current']]
+            self.assertTrue(np.allclose(first_points.iloc[1:].to_numpy(), last_points.iloc[:-1].to_numpy()))
+
+    def test_find_local_peaks_with_polynomial(self):
+        """ Test that the batched peak fits match fitting each segment on its own """
+        data = self.cv._data.query('segment != 0 and segment != segment.max()').query('direction == "oxidation"')
+        for order in [2, 4, 6]:
+            batched = ElectrochemicalMeasurement.find_local_peaks_with_polynomial(data, y_col='current', x_col='potential', group_cols=['segment'], window=0.1, polynomial_order=order)
+            single = (data
+                      .groupby(['segment'], group_keys=False)
+                      .apply(lambda df: ElectrochemicalMeasurement.find_local_peak_with_polynomial(df, y_col='current', x_col='potential', initial_guess=df.loc[df['current'].idxmax(), 'potential'], window=0.1, polynomial_order=order))
+                      )
+            pd.testing.assert_frame_equal(batched, single, rtol=1e-6)
+
+    def test_get_peaks_cache(self):
+        """ Test that peak fits are reused until the data changes """
+        peaks = self.cv.get_peaks(window=0.1)
+        self.assertTrue(self.cv._peak_cache[1][(0.1, 4)] is not peaks)
+        pd.testing.assert_frame_equal(self.cv.get_peaks(window=0.1), peaks)
+        self.cv.drop_cycles(keep=[1, 2])
+        self.assertTrue(set(self.cv.get_peaks(window=0.1, summary=True)['cycle']) == {1, 2})
+
     def test_get_peaks_biologic5(self):
         """ Test the get_peaks method for biologic5 """
         peaks = self.cv.get_peaks(window=0.1)
@@ -383,6 +488,11 @@ class TestAftermath1(unittest.TestCase):
         # self.cv.show_potential_time()
         self.assertTrue(type(self.cv.data == pd.DataFrame))
 
+    def test_read_chunks(self):
+        """ Test reading an aftermath file in chunks """
+        cv = CyclicVoltammogram.from_aftermath(path = 'test_trajectories/cyclic_voltammetry/aftermath1.csv', scan_rate=5, chunksize=40)
+        pd.testing.assert_frame_equal(cv.data, self.cv.data)
+
 
 class TestAftermath2(unittest.TestCase):
 
@@ -509,3 +619,101 @@ class TestBiologic7(unittest.TestCase):
         # self.cv.show_current_time()
         # self.cv.show_potential_time()
         self.assertTrue(type(self.cv.data == pd.DataFrame))
+
+
+class TestVoltagePeaks(unittest.TestCase):
+
+    def setUp(self):
+        """
+        A synthetic triangular sweep starting upwards, with three turning points
+        """
+        potential = np.concatenate([np.linspace(0, 1, 11), np.linspace(0.9, -1, 20), np.linspace(-0.9, 1, 20), np.linspace(0.9, 0, 10)])
+        self.data = pd.DataFrame({'time': np.arange(len(potential), dtype=float), 'potential': potential, 'current': potential})
+
+    def test_find_voltage_peaks(self):
+        """ Test that segments, directions and cycles switch on the point after each turning point """
+        data = ElectrochemicalMeasurement._find_voltage_peaks(self.data)
+        self.assertTrue(data['segment'].to_list() == [0]*11 + [1]*20 + [2]*20 + [3]*10)
+        self.assertTrue(data['direction'].to_list() == ['oxidation']*11 + ['reduction']*20 + ['oxidation']*20 + ['reduction']*10)
+        self.assertTrue(data['cycle'].to_list() == [0]*11 + [1]*40 + [2]*10)
+        self.assertTrue(data['segment'].dtype == np.int64)
+
+
+class TestSimpsonIntegrals(unittest.TestCase):
+
+    def test_get_simpson_integrals(self):
+        """ Test that grouped simpson integrals match scipy on each group, for odd, even and short groups """
+        rng = np.random.default_rng(0)
+        groups = np.repeat(np.arange(8), [1, 2, 3, 4, 5, 6, 7, 50])
+        x = np.concatenate([np.sort(rng.uniform(0, 1, n)) for n in [1, 2, 3, 4, 5, 6, 7, 50]])
+        y = rng.normal(size=len(x))
+        integrals = ElectrochemicalMeasurement.get_simpson_integrals(x, y, groups)
+
+        # interleave the groups while keeping the order of the points within each group
+        mixed_groups = groups[rng.permutation(len(x))]
+        mixed_x, mixed_y = np.empty_like(x), np.empty_like(y)
+        for g in range(8):
+            mixed_x[mixed_groups == g] = x[groups == g]
+            mixed_y[mixed_groups == g] = y[groups == g]
+        mixed = ElectrochemicalMeasurement.get_simpson_integrals(mixed_x, mixed_y, mixed_groups)
+
+        self.assertTrue(integrals.index.to_list() == list(range(8)))
+        self.assertTrue(integrals[0] == 0)
+        for g in range(1, 8):
+            self.assertTrue(np.isclose(integrals[g], integrate.simpson(y[groups == g], x=x[groups == g])))
+        self.assertTrue(np.allclose(integrals, mixed))
+
+
+class TestCyclicVoltammogramBatch(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Processing three biologic CVs in series
+        """
+        self.files = 'test_trajectories/cyclic_voltammetry/biologic[4-6].txt'
+        self.batch = CyclicVoltammogramBatch(self.files, workers=1).process(window=0.1)
+
+    def test_manifest(self):
+        """ Test that the glob is expanded and sorted into the manifest """
+        self.assertTrue(self.batch.manifest['file'].to_list() == [f'test_trajectories/cyclic_voltammetry/biologic{i}.txt' for i in [4, 5, 6]])
+        self.assertTrue(self.batch.log['error'].isna().all())
+        self.assertTrue((self.batch.log['time'] > 0).all())
+
+    def test_matches_single_files(self):
+        """ Test that the batch tables match the analysis of each file on its own """
+        for file in self.batch.manifest['file']:
+            cv = CyclicVoltammogram.from_biologic(path=file)
+            charges = self.batch.charges.query('file == @file').drop(columns='file').reset_index(drop=True)
+            peaks = self.batch.peaks.query('file == @file').drop(columns='file').reset_index(drop=True)
+            pd.testing.assert_frame_equal(charges, cv.get_charge_passed().reset_index(drop=True))
+            pd.testing.assert_frame_equal(peaks, cv.get_peaks(window=0.1, summary=True).reset_index(drop=True))
+
+    def test_process_pool(self):
+        """ Test that a process pool gives the same tables as processing in series """
+        batch = CyclicVoltammogramBatch(self.files, workers=2).process(window=0.1)
+        pd.testing.assert_frame_equal(batch.charges, self.batch.charges)
+        pd.testing.assert_frame_equal(batch.peaks, self.batch.peaks)
+
+    def test_manifest_errors(self):
+        """ Test that metadata is kept and that failing files are logged without stopping the batch """
+        manifest = pd.DataFrame({
+            'file': ['test_trajectories/cyclic_voltammetry/biologic4.txt', 'test_trajectories/cyclic_voltammetry/biologic1.txt', 'missing.txt'],
+            'sample': ['a', 'b', 'c']
+            })
+        batch = CyclicVoltammogramBatch(manifest, workers=1).process(window=0.1)
+        log = batch.log.set_index('sample')
+        self.assertTrue(log.loc['a', 'error'] is None)
+        self.assertTrue(log.loc['b', 'error'].startswith('peaks ValueError'))
+        self.assertTrue(log.loc['c', 'error'].startswith('FileNotFoundError'))
+        self.assertTrue(batch.charges['sample'].unique().tolist() == ['a', 'b'])
+        self.assertTrue(batch.peaks['sample'].unique().tolist() == ['a'])
+        self.assertTrue(batch.charges.columns[:2].to_list() == ['file', 'sample'])
+
+    def test_bad_manifest(self):
+        """ Test that a manifest without a file column or with an unknown source raises an error """
+        with self.assertRaises(ValueError):
+            CyclicVoltammogramBatch(pd.DataFrame({'path': ['a.txt']}))
+        with self.assertRaises(ValueError):
+            CyclicVoltammogramBatch(['a.txt'], source='gamry')
+        with self.assertRaises(ValueError):
+            CyclicVoltammogramBatch(['a.txt']).charges
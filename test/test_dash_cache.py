@@ -0,0 +1,92 @@
+from dash_app.cache import ObjectCache, CacheMissError
+import unittest
+import tempfile
+import os
+import pandas as pd
+
+
+class TestObjectCache(unittest.TestCase):
+
+    def setUp(self):
+        self.keys = {k: ObjectCache.make_key('0123abcd', k) for k in ['a', 'b', 'c']}
+
+    def test_make_key(self):
+        """ Test that keys depend on the session, the contents and the parameters """
+        key = ObjectCache.make_key('abc123', 'contents', 'biologic', None)
+        self.assertTrue(key.startswith('abc123-'))
+        self.assertTrue(key == ObjectCache.make_key('abc123', 'contents', 'biologic', None))
+        self.assertTrue(key != ObjectCache.make_key('abc124', 'contents', 'biologic', None))
+        self.assertTrue(key != ObjectCache.make_key('abc123', 'contents', 'aftermath', None))
+        self.assertTrue(ObjectCache.is_valid_key(ObjectCache.make_key(key, '', [0, 2], 100)))
+        with self.assertRaises(ValueError):
+            ObjectCache.make_key('../session', 'contents')
+
+    def test_invalid_keys(self):
+        """ Test that keys which were not made by make_key are rejected and never used as file names """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ObjectCache(spill_directory=directory)
+            for key in ['../../etc/passwd', 'a', None, self.keys['a'] + '/x']:
+                self.assertTrue(key not in cache)
+                with self.assertRaises(CacheMissError):
+                    cache.get(key)
+                with self.assertRaises(ValueError):
+                    cache.set(key, 1)
+
+    def test_lru(self):
+        """ Test that the least recently used object is dropped when the cache is full """
+        a, b, c = self.keys.values()
+        cache = ObjectCache(max_items=2)
+        cache.set(a, 1)
+        cache.set(b, 2)
+        cache.get(a)
+        cache.set(c, 3)
+        self.assertTrue(len(cache) == 2)
+        self.assertTrue(a in cache and c in cache)
+        self.assertTrue(b not in cache)
+        with self.assertRaises(CacheMissError):
+            cache.get(b)
+        with self.assertRaises(ValueError):
+            ObjectCache(max_items=0)
+
+    def test_max_bytes(self):
+        """ Test that objects are dropped when the cache holds more than max_bytes, counting memoized results """
+        a, b, c = self.keys.values()
+        data = pd.DataFrame({'x': range(1000)}, dtype=float)
+        size = int(data.memory_usage(deep=True).sum())
+        cache = ObjectCache(max_bytes=int(2.5*size))
+        cache.set(a, data)
+        cache.set(b, data.copy())
+        self.assertTrue(len(cache) == 2 and cache.size == 2*size)
+        cache.memoize(b, 'copy')
+        self.assertTrue(a not in cache and b in cache)
+        self.assertTrue(cache.size == 2*size)
+        cache.set(c, pd.DataFrame({'x': range(10000)}, dtype=float))
+        self.assertTrue(len(cache) == 1 and c in cache)
+
+    def test_spill(self):
+        """ Test that dropped objects and their memoized results are written to disk and read back """
+        a, b = self.keys['a'], self.keys['b']
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ObjectCache(max_items=1, spill_directory=directory)
+            cache.set(a, pd.DataFrame({'x': [1, 2, 3]}))
+            total = cache.memoize(a, 'sum')
+            cache.set(b, pd.DataFrame({'x': [4]}))
+            self.assertTrue(len(cache) == 1)
+            self.assertTrue(os.listdir(directory) == [os.path.basename(cache._spill_path(a))])
+            self.assertTrue(a not in os.listdir(directory)[0])
+            self.assertTrue(a in cache)
+            self.assertTrue(cache.get(a)['x'].to_list() == [1, 2, 3])
+            self.assertTrue(cache.memoize(a, 'sum').equals(total))
+            self.assertTrue(('sum', ()) in cache._items[a]['derived'])
+            self.assertTrue(not os.path.exists(cache._spill_path(a)))
+
+    def test_memoize(self):
+        """ Test that derived results are computed once per object and arguments, and reset when the object is replaced """
+        a = self.keys['a']
+        cache = ObjectCache()
+        cache.set(a, pd.DataFrame({'x': [1.0, 2.0]}))
+        first = cache.memoize(a, 'round', decimals=1)
+        self.assertTrue(cache.memoize(a, 'round', decimals=1) is first)
+        self.assertTrue(cache.memoize(a, 'round', decimals=2) is not first)
+        cache.set(a, pd.DataFrame({'x': [3.0]}))
+        self.assertTrue(cache.memoize(a, 'round', decimals=1)['x'].to_list() == [3.0])
@@ -1,11 +1,14 @@
 import unittest
 import tracemalloc
 import os
+import shutil
+import tempfile
 import plotly.graph_objects as go
 from glob import glob
 import pandas as pd
 import matplotlib.pyplot as plt
 from Materials_Data_Analytics.metadynamics.free_energy import FreeEnergySpace, MetaTrajectory, FreeEnergyLine, FreeEnergySurface
+from Materials_Data_Analytics.metadynamics.free_energy import StreamingReweighter
 tracemalloc.start()
 
 
@@ -59,6 +62,23 @@ class TestFreeEnergyLineFromPlumedMultiple(unittest.TestCase):
         my_diff = self.line._time_data[2].loc[1, 'energy'] - self.line._time_data[2].loc[2, 'energy']
         self.assertEqual(energy_diff, my_diff)
 
+    def test_lazy_and_eager_time_data(self):
+        """
+        checking that lazily read time data matches time data read eagerly with a thread pool, and that the lazy
+        reader keeps no more than max_cached time stamps in memory
+        """
+        lazy_line = FreeEnergyLine.from_plumed(self.all_fes_files_list, lazy=True, max_cached=1).set_datum({'CM1': 3})
+        eager_line = FreeEnergyLine.from_plumed(self.all_fes_files_list, workers=2).set_datum({'CM1': 3})
+        self.assertTrue(type(eager_line._time_data) == dict)
+        self.assertEqual(sorted(lazy_line._time_data.keys()), sorted(eager_line._time_data.keys()))
+        for ts in eager_line._time_data.keys():
+            pd.testing.assert_frame_equal(lazy_line._time_data[ts], eager_line._time_data[ts])
+        self.assertEqual(len(lazy_line._time_data._cache), 1)
+
+        ts = max(eager_line._time_data.keys())
+        eager_line._time_data[ts]['energy'] = 0.0
+        self.assertTrue((eager_line._time_data[ts]['energy'] == 0).all())
+
     def test_normalise_with_float_on_time_data(self):
         """
         testing that the normalise function works with a range
@@ -90,6 +110,18 @@ class TestFreeEnergyLineFromPlumedMultiple(unittest.TestCase):
         figure.add_trace(trace)
         # figure.show()
 
+    def test_get_change_over_time_values(self):
+        """
+        testing that the time difference matches the energies read directly from each time stamp
+        """
+        change_data = self.line.get_time_difference(1, region_2=(2.8, 3.2))
+        self.assertEqual(change_data['time_stamp'].to_list(), [0, 1, 2])
+        for ts, df in self.line._time_data.items():
+            value_1 = df.loc[(df['CM1'] - 1).abs().idxmin(), 'energy']
+            value_2 = df.loc[df['CM1'].between(2.8, 3.2), 'energy'].mean()
+            my_value = change_data.loc[change_data['time_stamp'] == ts, 'energy_difference'].values[0]
+            self.assertAlmostEqual(my_value, value_2 - value_1)
+
     def test_set_datum_twice(self):
         """
         testing that the normalise function works with a single value
@@ -394,6 +426,24 @@ class TestFreeEnergySpace(unittest.TestCase):
         figure = self.landscape.get_average_hills_figure()
         self.assertTrue(figure._validate)
 
+    def test_long_hills_time_binning(self):
+        """
+        Test that binning the long format hills in time gives the mean of each walker's hills in each time bin
+        """
+        long_hills = self.landscape.get_long_hills(time_resolution=2, height_power=0.5)
+        compare = (self.landscape._hills
+                   .assign(time=lambda x: x['time'].round(2))
+                   .assign(height=lambda x: x['height']**0.5)
+                   .groupby(['time', 'walker'])
+                   .mean()
+                   )
+        self.assertEqual(long_hills.columns.to_list(), ['time', 'walker', 'variable', 'value'])
+        self.assertEqual(sorted(long_hills['variable'].unique()), ['CM1', 'D1', 'height^0.5'])
+        self.assertEqual(long_hills.shape[0], compare.shape[0] * 3)
+        for _, row in long_hills.iterrows():
+            variable = 'height' if row['variable'] == 'height^0.5' else row['variable']
+            self.assertAlmostEqual(row['value'], compare.loc[(row['time'], row['walker']), variable])
+
     def test_fes_adder_checks_work(self):
         """
         Test that the fes adder works
@@ -515,3 +565,62 @@ class TestFreeEnergySpaceBiasExchange(unittest.TestCase):
         data = self.landscape.lines['CM1'].get_data()
         self.assertTrue(type(data) == pd.DataFrame)
 
+
+
+class TestStreamingReweighter(unittest.TestCase):
+
+    def setUp(self):
+        self.colvar_files = ["./test_trajectories/ndi_na_binding/COLVAR_REWEIGHT.0",
+                             "./test_trajectories/ndi_na_binding/COLVAR_REWEIGHT.1"]
+        self.space = FreeEnergySpace(temperature=320)
+        for f in self.colvar_files:
+            self.space.add_metad_trajectory(MetaTrajectory(f, temperature=320))
+        self.bins = [6, 6.4, 6.8, 7.2]
+
+    def test_matches_reweighted_line(self):
+        """
+        Test that streaming the complete colvar files gives the same line as reweighting the trajectories
+        """
+        reweighter = StreamingReweighter(self.colvar_files, 'D1', bins=self.bins, temperature=320)
+        line = reweighter.get_line()
+        compare = self.space.get_reweighted_line('D1', bins=self.bins)
+        pd.testing.assert_frame_equal(line.get_data(), compare.get_data())
+        self.assertEqual(reweighter.n_frames, 104)
+
+        reweighter = StreamingReweighter(self.colvar_files, 'D1', bins=10, cv_range=(6, 7.2), temperature=320)
+        compare = self.space.get_reweighted_line('D1', bins=10)
+        self.assertEqual(reweighter.get_line().get_data().shape, compare.get_data().shape)
+
+        with self.assertRaises(ValueError):
+            StreamingReweighter(self.colvar_files, 'D1', bins=10)
+
+    def test_tailing_and_restart(self):
+        """
+        Test that frames are read as they are written, including partially written lines and a plumed backup on restart
+        """
+        with open(self.colvar_files[0]) as f:
+            lines = f.readlines()
+
+        with tempfile.TemporaryDirectory() as directory:
+            colvar = os.path.join(directory, "COLVAR_REWEIGHT.0")
+            reweighter = StreamingReweighter(colvar, 'D1', bins=self.bins, temperature=320)
+
+            with open(colvar, 'w') as f:
+                f.writelines(lines[:20])
+                f.write(lines[20][:10])
+            reweighter.update()
+            self.assertEqual(reweighter.n_frames, 19)
+
+            with open(colvar, 'a') as f:
+                f.write(lines[20][10:])
+                f.writelines(lines[21:30])
+
+            shutil.move(colvar, os.path.join(directory, "bck.0.COLVAR_REWEIGHT.0"))
+            with open(colvar, 'w') as f:
+                f.writelines([lines[0]] + lines[30:])
+
+            line = reweighter.get_line()
+            self.assertEqual(reweighter.n_frames, len(lines) - 1)
+
+        compare = StreamingReweighter(self.colvar_files[0], 'D1', bins=self.bins, temperature=320).get_line()
+        pd.testing.assert_frame_equal(line.get_data(), compare.get_data())
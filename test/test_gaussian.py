@@ -1,10 +1,14 @@
 import unittest
+import os
+import tempfile
+from unittest import mock
 import tracemalloc
 import pandas as pd
 import plotly.express as px
 import numpy as np
-from Materials_Data_Analytics.quantum_chemistry.gaussian import GaussianParser
+from Materials_Data_Analytics.quantum_chemistry.gaussian import GaussianParser, LogLines
 from Materials_Data_Analytics.core.coordinate_transformer import PdbParser
+from Materials_Data_Analytics.laws_and_constants import broadened_spectrum
 tracemalloc.start()
 
 
@@ -41,6 +45,42 @@ class TestPedotRaman(unittest.TestCase):
         raman_spectra = self.log.get_raman_spectra()
         self.assertTrue(len(raman_spectra) == 2000)
 
+    def test_raman_line_shapes(self):
+        """ Test the different line shapes, the FFT convolution and the batch spectra """
+        lorentzian = self.log.get_raman_spectra()
+        fft = self.log.get_raman_spectra(fft=True)
+        self.assertTrue(np.allclose(lorentzian['intensity'], fft['intensity'], atol=5e-3 * lorentzian['intensity'].max()))
+
+        for shape in ['gaussian', 'pseudo_voigt']:
+            spectrum = self.log.get_raman_spectra(shape=shape)
+            self.assertTrue(len(spectrum) == 2000)
+            self.assertTrue(spectrum['intensity'].max() > lorentzian['intensity'].max())
+
+        with self.assertRaises(ValueError):
+            self.log.get_raman_spectra(shape='triangle')
+
+        # the log file names of a restarted calculation are joined into one string
+        lines = open('./test_trajectories/pedot_raman/step1.log', 'r').readlines()
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, 'step1.log'), os.path.join(directory, 'step1_restart.log')]
+            for path, part in zip(paths, [lines[:7000], lines[7000:]]):
+                with open(path, 'w') as f:
+                    f.writelines(part)
+            with GaussianParser(paths) as restart:
+                batch = GaussianParser.get_batch_raman_spectra([restart, self.log])
+        self.assertTrue(len(batch) == 4000)
+        self.assertTrue(batch['log_file'].iloc[0] == ', '.join(paths))
+        self.assertTrue(batch.groupby('log_file')['intensity'].count().to_list() == [2000, 2000])
+        self.assertTrue(np.allclose(batch['intensity'].iloc[2000:], lorentzian['intensity']))
+
+        # a small element budget builds the spectra in chunks, giving the same result
+        rng = np.random.default_rng(0)
+        x0 = rng.uniform(500, 2500, (7, 30))
+        h = rng.uniform(0, 1, (7, 30))
+        wn = np.arange(500, 2500, 1.0)
+        self.assertTrue(np.allclose(broadened_spectrum(wn, x0, h, 20, max_elements=2 * 30 * len(wn)), broadened_spectrum(wn, x0, h, 20)))
+        self.assertTrue(np.allclose(broadened_spectrum(wn, x0, h, 20, max_elements=1), broadened_spectrum(wn, x0, h, 20)))
+
     def test_atoms(self):
         """ Test that the parser can extract the atoms from the log file """
         atoms = self.log.atoms
@@ -51,6 +91,23 @@ class TestPedotRaman(unittest.TestCase):
         self.assertTrue(heavyatoms == ['C', 'C', 'C', 'S', 'C', 'O', 'O', 'C', 'C', 'C', 'C', 'C', 'C', 'S', 'O', 'O',
                                        'C', 'C'])
         
+    def test_heavy_atoms_with_h_in_symbol(self):
+        """ Test that elements such as Hg, whose symbols contain an H, are counted as heavy atoms everywhere """
+        lines = open('./test_trajectories/pedot_raman/step1.log', 'r').readlines()
+        first_atom = next(i for i, line in enumerate(lines) if 'Mulliken charges:' in line) + 2
+        lines[first_atom] = lines[first_atom].replace(' C ', ' Hg', 1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'step1.log')
+            with open(path, 'w') as f:
+                f.writelines(lines)
+            with GaussianParser(path) as log:
+                self.assertTrue(log.heavyatoms == ['Hg'] + self.log.heavyatoms[1:])
+                self.assertTrue(log.heavyatomcount == self.log.heavyatomcount)
+                self.assertTrue(log._get_atom_mask(heavy_atoms=True).sum() == log.heavyatomcount)
+                table = log.get_atom_properties(heavy_atoms=True)
+                self.assertTrue(table['element'].to_list() == log.heavyatoms)
+                self.assertTrue(table['mulliken_charge'].to_list() == self.log.get_atom_properties(heavy_atoms=True)['mulliken_charge'].to_list())
+
     def test_mulliken(self):
         """ Test that the parser can extract the mulliken charges from the log file """
         charges = self.log.get_mulliken_charges()
@@ -64,6 +121,10 @@ class TestPedotRaman(unittest.TestCase):
                                                                0.321773, 0.360884, -0.26943, 0.413122, -0.511813,
                                                                -0.505008, 0.268105, 0.257783])
 
+        spins = self.log.get_mulliken_spin_densities(heavy_atoms=True)
+        self.assertTrue(spins['element'].tolist() == self.log.heavyatoms)
+        self.assertTrue((spins['spin_density'] == 0).all())
+
     def test_coordinates(self):
         """ Various tests for getting coordinates of the log file """
         coordinates = self.log.get_coordinates()
@@ -141,6 +202,59 @@ class TestBblLog3(unittest.TestCase):
         self.assertTrue(result.iloc[30, 3] == "C")
         self.assertTrue(result.iloc[50, 1] == 41)
 
+    def test_index(self):
+        """ Test that the line index built in one scan matches a search through all the lines """
+        for marker in ['SCF Done', 'Standard orientation:', 'Mulliken charges', 'ESP charges']:
+            expected = [i for i, line in enumerate(self.log._lines) if marker in line]
+            self.assertTrue(self.log._index[marker] == expected)
+
+    def test_log_lines(self):
+        """ Test that the memory mapped view of chained log files gives the same lines as reading the files """
+        paths = ['./test_trajectories/bbl/step3.log', './test_trajectories/pedot_raman/step1.log']
+        expected = [line for path in paths for line in open(path, 'r')]
+        lines = LogLines(paths)
+        self.assertTrue(len(lines) == len(expected))
+        self.assertTrue(lines[0] == expected[0])
+        self.assertTrue(lines[-1] == expected[-1])
+        self.assertTrue(lines[25000:25010] == expected[25000:25010])
+        self.assertTrue(list(lines) == expected)
+
+    def test_close(self):
+        """ Test that closing the log lines releases the memory maps, and that the parser can be used as a context manager """
+        with LogLines('./test_trajectories/bbl/step3.log') as lines:
+            self.assertTrue(lines[0] == open('./test_trajectories/bbl/step3.log', 'r').readline())
+        self.assertTrue(all(m.closed for m in lines._maps))
+        with self.assertRaises(ValueError):
+            lines[0]
+
+        with GaussianParser('./test_trajectories/bbl/step3.log') as log:
+            energy = log.energy
+        self.assertTrue(energy == self.log.energy)
+        self.assertTrue(all(m.closed for m in log._lines._maps))
+
+    def test_time_stamp_long_header(self):
+        """ Test that the time stamp comes from the first Leave Link line even when it is far into the file """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'long_header.log')
+            with open(path, 'w') as f:
+                f.write(' header line\n' * 20000)
+                f.write(' Leave Link    1 at Sat Sep 30 13:04:10 2023, MaxMem= 26843545600 cpu:               0.9 elap:               0.1\n')
+                f.write(' Normal termination of Gaussian 16 at Sun Oct  1 10:00:00 2023.\n')
+            self.assertTrue(os.path.getsize(path) > 65536)
+            self.assertTrue(GaussianParser._get_time_stamp(path).strftime("%Y-%m-%d %H:%M:%S") == '2023-09-30 13:04:10')
+
+    def test_get_bonds_covalent(self):
+        """ Test that the bonds can be found with cutoffs from the covalent radii, and through the scf iterations """
+        result = self.log.get_bonds_from_coordinates(covalent=True)
+        self.assertTrue(result.equals(self.log.get_bonds_from_coordinates()))
+        result = self.log.get_bonds_from_coordinates(covalent=True, tolerance=-0.5)
+        self.assertTrue(len(result) == 0)
+
+        result = self.log.get_bonds_through_scf()
+        self.assertTrue(result['iteration'].nunique() == self.log.scf_iterations)
+        first = result.query('iteration == 0').drop(columns='iteration').reset_index(drop=True)
+        self.assertTrue(first.equals(self.log.get_bonds_from_coordinates(scf_iteration=0)))
+
     def test_get_scf_convergence(self):
         """ Test that the parser can extract the SCF convergence from the log file """
         result = self.log.get_scf_convergence().round(5)
@@ -206,6 +320,20 @@ class TestBblLog3(unittest.TestCase):
         self.assertTrue(charges['partial_charge'].tolist()[10] == 0.049955)
         self.assertTrue(charges['partial_charge'].tolist()[15] == -0.080793)
 
+    def test_get_atom_properties(self):
+        """ Test the table of atom properties against the separate methods """
+        table = self.log.get_atom_properties()
+        self.assertTrue(len(table) == self.log.atomcount)
+        self.assertTrue(table['heavy_atom'].sum() == self.log.heavyatomcount)
+        self.assertTrue(table['mulliken_charge'].tolist() == self.log.get_mulliken_charges()['partial_charge'].tolist())
+        self.assertTrue(table['esp_charge'].tolist() == self.log.get_esp_charges()['partial_charge'].tolist())
+        self.assertTrue(table['x'].tolist() == self.log.get_coordinates()['x'].tolist())
+
+        table = self.log.get_atom_properties(heavy_atoms=True, scf_iteration=0)
+        self.assertTrue(table['element'].tolist() == self.log.heavyatoms)
+        self.assertTrue(table['spin_density'].tolist() == self.log.get_mulliken_spin_densities(heavy_atoms=True)['spin_density'].tolist())
+        self.assertTrue(table['x'].tolist() == self.log.get_coordinates(heavy_atoms=True, scf_iteration=0)['x'].tolist())
+
     def test_get_coordinates(self):
         """ Test that the parser can extract the coordinates from the log file for heavy atoms for bbl """
         coordinates = self.log.get_coordinates(heavy_atoms=True)
@@ -215,6 +343,32 @@ class TestBblLog3(unittest.TestCase):
         self.assertTrue(len(coordinates) == self.log.atomcount)
         self.assertTrue(coordinates['x'].iloc[0] == 1.817506)
 
+    def test_get_coordinate_array(self):
+        """ Test that the coordinates through the scf are parsed into an array and a long dataframe """
+        coordinates = self.log.get_coordinate_array()
+        self.assertTrue(coordinates.shape == (self.log.scf_iterations, self.log.atomcount, 3))
+        self.assertTrue(self.log.get_coordinate_array(heavy_atoms=True).shape == (self.log.scf_iterations, self.log.heavyatomcount, 3))
+        self.assertTrue((coordinates[0, :, 0] == self.log.get_coordinates(scf_iteration=0)['x'].to_numpy()).all())
+
+        data = self.log.get_coordinates_through_scf()
+        self.assertTrue(len(data) == self.log.scf_iterations * self.log.atomcount)
+        self.assertTrue((data.query('iteration == 3')['z'].to_numpy() == coordinates[3, :, 2]).all())
+
+    def test_truncated_coordinates(self):
+        """ Test that an orientation block cut off at the end of the log file, as from a killed calculation, is skipped """
+        lines = open('./test_trajectories/bbl/step3.log', 'r').readlines()
+        last_block = max(i for i, line in enumerate(lines) if 'Standard orientation:' in line)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'step3.log')
+            with open(path, 'w') as f:
+                f.writelines(lines[:last_block + 5 + self.log.atomcount // 2])
+            with GaussianParser(path) as log:
+                coordinates = log.get_coordinate_array()
+                self.assertTrue(log._get_all_coordinates().shape == (8, self.log.atomcount, 3))
+                self.assertTrue((coordinates == self.log.get_coordinate_array()[:len(coordinates)]).all())
+                self.assertTrue(log.get_coordinates(scf_iteration=0).equals(self.log.get_coordinates(scf_iteration=0)))
+                self.assertTrue(len(log.get_coordinates_through_scf()) == len(coordinates) * self.log.atomcount)
+
     def test_get_spin_contamination(self):
         """ Test that the parser can extract the spin contamination from the log file """
         data = self.log.get_spin_contamination()
@@ -269,3 +423,91 @@ class TestBblLog4Restart(unittest.TestCase):
         self.assertTrue(self.log.restart == True)
         self.assertTrue(self.log.time_stamp == "2024-08-15 18:21:15")
 
+
+
+class TestBblLog3Restart(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        """ Split the step3 log file into two parts, as if the calculation had been restarted part way through """
+        cls.directory = tempfile.TemporaryDirectory()
+        lines = open('./test_trajectories/bbl/step3.log', 'r').readlines()
+        cls.paths = [os.path.join(cls.directory.name, 'step3_restart.log'), os.path.join(cls.directory.name, 'step3.log')]
+        with open(cls.paths[1], 'w') as f:
+            f.writelines(lines[:11000])
+        with open(cls.paths[0], 'w') as f:
+            f.writelines(lines[11000:])
+        cls.full = GaussianParser('./test_trajectories/bbl/step3.log')
+        cls.log = GaussianParser(cls.paths)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.log.close()
+        cls.directory.cleanup()
+
+    def test_chained_lines(self):
+        """ Test that the log files are chained in the order of their time stamps, not the order they are given """
+        self.assertTrue(self.log.restart is True)
+        self.assertTrue(self.full.restart is False)
+        self.assertTrue(self.log._lines._log_files == self.paths[::-1])
+        self.assertTrue(list(self.log._lines) == list(self.full._lines))
+        self.assertTrue(self.log._index == self.full._index)
+
+    def test_attributes(self):
+        """ Test that the restarted calculation gives the same properties as the single log file """
+        self.assertTrue(self.log.time_stamp == self.full.time_stamp)
+        self.assertTrue(self.log.energy == self.full.energy)
+        self.assertTrue(self.log.keywords == self.full.keywords)
+        self.assertTrue(self.log.atoms == self.full.atoms)
+        self.assertTrue(self.log.complete == self.full.complete)
+        self.assertTrue(self.log.scf_iterations == self.full.scf_iterations)
+        self.assertTrue(self.log.homo == self.full.homo)
+
+
+class TestBulk(unittest.TestCase):
+
+    def setUp(self):
+        self.paths = ['./test_trajectories/pedot_raman/step1.log', './test_trajectories/bbl/step3.log', './test_trajectories/missing.log']
+        self.fields = ['energy', 'homo', 'functional', 'free_energy']
+
+    def test_bulk(self):
+        """ Test that the bulk parser collects the properties of each log file and reports the files which fail """
+        data = GaussianParser.bulk(self.paths, fields=self.fields, workers=2)
+        self.assertTrue(type(data) == pd.DataFrame)
+        self.assertTrue(data.columns.tolist() == ['log_file'] + self.fields + ['error'])
+        self.assertTrue(data['energy'].iloc[0] == GaussianParser(self.paths[0]).energy)
+        self.assertTrue(data['free_energy'].iloc[0] == GaussianParser(self.paths[0]).free_energy)
+        self.assertTrue(data['functional'].iloc[1] == 'WB97XD')
+        self.assertTrue(pd.isna(data['free_energy'].iloc[1]))
+        self.assertTrue(data['error'].iloc[:2].isna().all())
+        self.assertTrue('FileNotFoundError' in data['error'].iloc[2])
+
+        with self.assertRaises(ValueError):
+            GaussianParser.bulk(self.paths, fields=['not_a_field'])
+
+    def test_bulk_cache(self):
+        """ Test that the bulk parser reuses the cached results for log files that have not changed """
+        with tempfile.TemporaryDirectory() as directory:
+            cache = os.path.join(directory, 'manifest.pkl')
+            first = GaussianParser.bulk(self.paths, fields=self.fields, workers=1, cache=cache)
+            manifest = pd.read_pickle(cache)
+            self.assertTrue(len(manifest) == 2)
+            with mock.patch.object(GaussianParser, '_get_fields', wraps=GaussianParser._get_fields) as get_fields:
+                second = GaussianParser.bulk(self.paths, fields=self.fields, workers=1, cache=cache)
+            self.assertTrue(first.equals(second))
+            self.assertTrue([c.args[0] for c in get_fields.call_args_list] == [self.paths[2]])
+
+    def test_bulk_sections(self):
+        """ Test that the bulk parser only runs the parsing steps needed by the requested fields """
+        self.assertTrue(GaussianParser._get_field_sections(['energy', 'functional']) == ['energy'])
+        self.assertTrue(GaussianParser._get_field_sections(['free_energy', 'atoms']) == ['atoms', 'thermochemistry'])
+        with self.assertRaises(ValueError):
+            GaussianParser._get_field_sections(['energy', 'not_a_field'])
+
+        with GaussianParser._from_sections(self.paths[0], ['energy']) as parser:
+            self.assertTrue(parser.energy == GaussianParser(self.paths[0]).energy)
+            self.assertTrue(not hasattr(parser, '_atoms'))
+            self.assertTrue(not hasattr(parser, '_free_energy'))
+
+        result = GaussianParser._get_fields(self.paths[0], ['atoms'], sections=['energy'])
+        self.assertTrue('AttributeError' in result['error'])
@@ -2,7 +2,7 @@ import unittest
 import numpy as np
 import pandas as pd
 from Materials_Data_Analytics.metadynamics.path_analysis import Path
-from Materials_Data_Analytics.metadynamics.free_energy import FreeEnergySpace
+from Materials_Data_Analytics.metadynamics.free_energy import FreeEnergySpace, FreeEnergySurface
 from Materials_Data_Analytics.metadynamics.path_analysis import SurfacePath
 
 
@@ -42,3 +42,36 @@ class TestPath(unittest.TestCase):
         path = SurfacePath.from_points(points, n_steps=21, cvs=cvs, shape=surface)
         forces = path._get_surface_forces(index=5)
         self.assertTrue(type(forces) == np.ndarray)
+
+    def test_minimise(self):
+        """ Test the string method minimisation of a surface path on a double well surface """
+        x, y = np.meshgrid(np.linspace(-1.5, 1.5, 61), np.linspace(-1.5, 1.5, 61), indexing='ij')
+        data = pd.DataFrame({
+            'CM2': x.flatten(),
+            'CM3': y.flatten(),
+            'energy': (10 * (x.flatten()**2 - 1)**2 + 10 * (y.flatten() - 0.5 * x.flatten()**2)**2)
+        })
+        surface = FreeEnergySurface(data)
+
+        path = SurfacePath.from_points([[-1, 0.5], [0, 1], [1, 0.5]], n_steps=21, cvs=['CM2', 'CM3'], shape=surface)
+        energy_before = path.get_data(with_energy=True)['energy'].max()
+        data = path.minimise(step_size=0.005, tolerance=1e-6).get_data(with_energy=True)
+        self.assertTrue(path.converged)
+        self.assertTrue(data.columns.to_list() == ['CM2', 'CM3', 'energy'])
+        self.assertTrue(data.shape[0] == 21)
+        self.assertTrue(data['energy'].max() < energy_before)
+        self.assertAlmostEqual(data['energy'].max(), 10, places=1)
+        self.assertTrue(data[['CM2', 'CM3']].iloc[0].to_list() == [-1, 0.5])
+        self.assertTrue(data[['CM2', 'CM3']].iloc[-1].to_list() == [1, 0.5])
+
+    def test_column_order(self):
+        """ Test that a path given in a different cv order to the surface keeps its own column order """
+        x, y = np.meshgrid(np.linspace(-1.5, 1.5, 61), np.linspace(-1.5, 1.5, 61), indexing='ij')
+        data = pd.DataFrame({'CM2': x.flatten(), 'CM3': y.flatten(), 'energy': (x.flatten() + 2 * y.flatten())})
+        surface = FreeEnergySurface(data)
+
+        path = SurfacePath.from_points([[0.5, -1], [0.5, 1]], n_steps=10, cvs=['CM3', 'CM2'], shape=surface)
+        self.assertTrue(path.get_data().columns.to_list() == ['CM3', 'CM2'])
+        self.assertTrue(path.get_data(with_energy=True).columns.to_list() == ['CM3', 'CM2', 'energy'])
+        self.assertTrue(np.allclose(path._get_surface_forces(index=3), [-2, -1], atol=1e-6))
+        self.assertTrue(path.minimise(max_iterations=5).get_data().columns.to_list() == ['CM3', 'CM2'])